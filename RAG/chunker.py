@@ -0,0 +1,109 @@
+import re
+
+# Version du découpage, enregistrée dans les métadonnées de chaque chunk :
+# à incrémenter dès que les règles ci-dessous changent (réingestion requise)
+CHUNKER_VERSION = "2"
+
+# Tailles en tokens du reranker (bge : 512 max, tokens spéciaux et question compris)
+TARGET_TOKENS = 256
+MAX_TOKENS = 384
+OVERLAP_TOKENS = 48
+MIN_TOKENS = 32
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+
+def make_token_counter(tokenizer=None):
+    """Compteur de tokens : tokenizer (bibliothèque tokenizers) ou ~4 caractères/token."""
+    if tokenizer is None:
+        return lambda text: max(1, len(text) // 4)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+def _units(text, kind):
+    """Unités insécables d'un bloc trop long : lignes (code) ou phrases (texte)."""
+    if kind == "code":
+        return [line for line in text.splitlines() if line.strip()]
+    return [s for s in _SENTENCE_END.split(text) if s]
+
+def _split_words(unit, count_tokens, size):
+    # Dernier recours (phrase ou ligne plus longue que max_tokens) : paquets de mots
+    parts, current = [], []
+    for word in unit.split():
+        if current and count_tokens(" ".join(current + [word])) > size:
+            parts.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        parts.append(" ".join(current))
+    return parts
+
+def split_text(text, count_tokens, kind="text", target=TARGET_TOKENS,
+               max_tokens=MAX_TOKENS, overlap=OVERLAP_TOKENS):
+    """
+    Découpe un bloc en morceaux d'environ 'target' tokens (jamais plus de
+    'max_tokens'), chaque morceau reprenant les dernières unités du précédent
+    jusqu'à 'overlap' tokens.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    sep = "\n" if kind == "code" else " "
+    units = []
+    for unit in _units(text, kind):
+        units += [unit] if count_tokens(unit) <= max_tokens else _split_words(unit, count_tokens, overlap or target)
+
+    pieces, current = [], []
+    for unit in units:
+        if current and count_tokens(sep.join(current + [unit])) > target:
+            pieces.append(sep.join(current))
+            # Recouvrement : dernières unités du morceau précédent
+            tail = []
+            for prev in reversed(current):
+                if count_tokens(sep.join([prev] + tail + [unit])) > max_tokens or \
+                        count_tokens(sep.join([prev] + tail)) > overlap:
+                    break
+                tail.insert(0, prev)
+            current = tail
+        current.append(unit)
+    if current:
+        pieces.append(sep.join(current))
+    return pieces
+
+def chunk_blocks(blocks, count_tokens, target=TARGET_TOKENS, max_tokens=MAX_TOKENS,
+                 overlap=OVERLAP_TOKENS, min_tokens=MIN_TOKENS):
+    """
+    blocks : [{"heading", "text", "kind"}] dans l'ordre du document.
+    Fusionne les blocs consécutifs d'une même section jusqu'à 'target' tokens,
+    découpe les blocs trop longs avec recouvrement et rattache un reliquat
+    de moins de 'min_tokens' au chunk précédent de la section s'il tient.
+    Retourne [{"heading", "text", "tokens"}].
+    """
+    chunks = []
+    current = None
+
+    def flush():
+        if current is None:
+            return
+        text = "\n".join(current["texts"])
+        previous = chunks[-1] if chunks else None
+        tokens = count_tokens(text)
+        if (tokens < min_tokens and previous is not None and previous["heading"] == current["heading"]
+                and count_tokens(previous["text"] + "\n" + text) <= max_tokens):
+            previous["text"] += "\n" + text
+            previous["tokens"] = count_tokens(previous["text"])
+        else:
+            chunks.append({"heading": current["heading"], "text": text, "tokens": tokens})
+
+    for block in blocks:
+        text = block["text"].strip()
+        if not text:
+            continue
+        for piece in split_text(text, count_tokens, block.get("kind", "text"), target, max_tokens, overlap):
+            tokens = count_tokens(piece)
+            if (current is not None and current["heading"] == block["heading"]
+                    and current["tokens"] + tokens <= target):
+                current["texts"].append(piece)
+                current["tokens"] += tokens
+                continue
+            flush()
+            current = {"heading": block["heading"], "texts": [piece], "tokens": tokens}
+    flush()
+    return chunks
@@ -12,6 +12,49 @@ load_dotenv()
 # Fix pour l'import des modules locaux
 sys.path.append(os.getcwd())
 from llm.client import OllamaClient
+from reranker_server import MODEL_NAME, load_tokenizer, tokenizer_version, encode_passages
+from RAG.chunker import (CHUNKER_VERSION, TARGET_TOKENS, MAX_TOKENS, OVERLAP_TOKENS,
+                         chunk_blocks, make_token_counter)
+
+# Token ids des chunks pour le reranker, par version de tokenizer :
+# au reranking, seule la question reste à tokeniser
+CHUNK_TOKENS_DDL = """
+    CREATE TABLE IF NOT EXISTS chunk_tokens (
+        document_id bigint NOT NULL,
+        tokenizer_version text NOT NULL,
+        token_ids integer[] NOT NULL,
+        PRIMARY KEY (document_id, tokenizer_version)
+    );
+"""
+TOKENS_BATCH = 256
+
+
+def store_chunk_tokens(cur, model_name=MODEL_NAME, tokenizer=None):
+    """Tokenise les chunks sans token_ids pour la version courante du tokenizer."""
+    tokenizer = tokenizer or load_tokenizer(model_name)
+    if tokenizer is None:
+        print("⚠️ Tokenizer indisponible : token_ids non pré-calculés")
+        return 0
+    version = tokenizer_version(tokenizer, model_name)
+    cur.execute(CHUNK_TOKENS_DDL)
+    cur.execute("""
+        SELECT d.id, d.content
+        FROM documents d
+        WHERE NOT EXISTS (
+            SELECT 1 FROM chunk_tokens t
+            WHERE t.document_id = d.id AND t.tokenizer_version = %s
+        );
+    """, (version,))
+    rows = cur.fetchall()
+    for start in range(0, len(rows), TOKENS_BATCH):
+        batch = rows[start:start + TOKENS_BATCH]
+        ids = encode_passages(tokenizer, [content for _, content in batch])
+        cur.executemany(
+            "INSERT INTO chunk_tokens (document_id, tokenizer_version, token_ids) VALUES (%s, %s, %s)",
+            [(doc_id, version, token_ids) for (doc_id, _), token_ids in zip(batch, ids)]
+        )
+    print(f"🔤 Token ids ({version}) : {len(rows)} chunks tokenisés")
+    return len(rows)
 
 
 def run_ingestion():
@@ -34,6 +77,11 @@ def run_ingestion():
 
     print(f"🔍 Scan terminé : {len(files)} fichiers détectés dans le dossier cible.")
 
+    # Tailles de chunk mesurées avec le tokenizer du reranker (sinon ~4 caractères/token)
+    tokenizer = load_tokenizer()
+    count_tokens = make_token_counter(tokenizer)
+    print(f"✂️  Chunker v{CHUNKER_VERSION} : cible {TARGET_TOKENS} tokens, max {MAX_TOKENS}, recouvrement {OVERLAP_TOKENS}")
+
     try:
         conn = psycopg2.connect(
             dbname=os.getenv("DB_NAME"),
@@ -45,7 +93,8 @@ def run_ingestion():
         cur = conn.cursor()
         
         print("🧹 Nettoyage de la table documents...")
-        cur.execute("TRUNCATE TABLE documents RESTART IDENTITY;")
+        cur.execute(CHUNK_TOKENS_DDL)
+        cur.execute("TRUNCATE TABLE documents, chunk_tokens RESTART IDENTITY;")
         
         total_chunks = 0
         
@@ -64,26 +113,52 @@ def run_ingestion():
 
                 chunks_count_before = total_chunks
 
-                # 1️⃣ Extraction VariableList (Termes techniques)
+                # 1️⃣ Extraction VariableList (Termes techniques) : un terme par chunk,
+                # découpé avec recouvrement si la définition dépasse MAX_TOKENS
+                definitions = []
                 for vlist in soup.find_all('div', class_='variablelist'):
                     items = vlist.find_all(['dt', 'dd'])
                     for i in range(0, len(items) - 1, 2):
                         term = items[i].get_text(strip=True)
                         definition = items[i+1].get_text(separator=' ', strip=True)
-                        
-                        content = (
-                            f"Context: {parent_chapter} > {page_title}\n"
-                            f"Term: {term}\n"
-                            f"Definition: {definition}"
-                        )
+                        definitions.append({"heading": term, "text": definition, "kind": "text"})
+
+                # 2️⃣ Extraction Paragraphes & Blocs de Code, rattachés au titre de
+                # section le plus proche ; les petits paragraphes voisins sont fusionnés
+                contents = []
+                for p in soup.find_all(['p', 'pre']):
+                    if not p.find_parent('div', class_='variablelist'):
+                        heading_tag = p.find_previous(['h1', 'h2', 'h3', 'h4'])
+                        heading = heading_tag.get_text(strip=True) if heading_tag else page_title
+                        if p.name == 'pre':
+                            contents.append({"heading": heading, "text": p.get_text(), "kind": "code"})
+                        else:
+                            contents.append({"heading": heading, "text": p.get_text(separator=' ', strip=True),
+                                             "kind": "text"})
+
+                for doc_type, blocks in (("definition", definitions), ("content", contents)):
+                    for chunk in chunk_blocks(blocks, count_tokens):
+                        if doc_type == "definition":
+                            content = (
+                                f"Context: {parent_chapter} > {page_title}\n"
+                                f"Term: {chunk['heading']}\n"
+                                f"Definition: {chunk['text']}"
+                            )
+                        else:
+                            content = (
+                                f"Context: {parent_chapter} > {page_title} > {chunk['heading']}\n"
+                                f"Content: {chunk['text']}"
+                            )
 
                         meta = {
                             "source": fname,
                             "title": page_title,
-                            "section": term,
-                            "type": "definition"
+                            "section": chunk["heading"],
+                            "type": doc_type,
+                            "tokens": chunk["tokens"],
+                            "chunker_version": CHUNKER_VERSION
                         }
-                        
+
                         emb = ai.get_embedding(content)
 
                         cur.execute(
@@ -95,36 +170,9 @@ def run_ingestion():
                         )
                         total_chunks += 1
 
-                # 2️⃣ Extraction Paragraphes & Blocs de Code
-                for p in soup.find_all(['p', 'pre']):
-                    if not p.find_parent('div', class_='variablelist'):
-                        text = p.get_text(separator=' ', strip=True)
-                        if len(text) > 80:
-                            content = (
-                                f"Context: {parent_chapter} > {page_title}\n"
-                                f"Content: {text}"
-                            )
-
-                            meta = {
-                                "source": fname,
-                                "title": page_title,
-                                "section": "General",
-                                "type": "content"
-                            }
-
-                            emb = ai.get_embedding(content)
-
-                            cur.execute(
-                                """
-                                INSERT INTO documents (source, content, metadata, embedding)
-                                VALUES (%s, %s, %s, %s)
-                                """,
-                                (f_path, content, dumps(meta), emb)
-                            )
-                            total_chunks += 1
-
                 print(f"✅ {fname.ljust(30)} | +{total_chunks - chunks_count_before} chunks")
 
+        store_chunk_tokens(cur, tokenizer=tokenizer)
         conn.commit()
         print(f"\n🚀 Ingestion réussie ! Total : {total_chunks} chunks insérés.")
         
@@ -148,6 +196,26 @@ def run_ingestion():
         conn.close()
 
 
+def run_tokens_only():
+    """Complète chunk_tokens sans réingérer (ex. après changement de modèle de reranking)."""
+    conn = psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT")
+    )
+    try:
+        with conn.cursor() as cur:
+            store_chunk_tokens(cur)
+        conn.commit()
+    finally:
+        conn.close()
+
+
 if __name__ == "__main__":
-    run_ingestion()
+    if "--tokens-only" in sys.argv:
+        run_tokens_only()
+    else:
+        run_ingestion()
 
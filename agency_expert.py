@@ -3,22 +3,52 @@ import sys
 import time
 import psycopg2
 from dotenv import load_dotenv
-from sentence_transformers import CrossEncoder
 
 # Path pour llm.client
 sys.path.append(os.getcwd())
 from llm.client import OllamaClient
+from reranker_server import RerankerClient
 
 load_dotenv()
 
+# Reranking adaptatif : candidats vectoriels rerankés par tours de
+# RERANK_ROUND, arrêt dès que top_k chunks dépassent seuil + marge
+CANDIDATE_POOL = 20
+RERANK_ROUND = 8
+RERANK_MARGIN = 0.2
+
+def rerank_adaptive(reranker, query, candidates, top_k=3, threshold=0.3,
+                    round_size=RERANK_ROUND, margin=RERANK_MARGIN, tokenizer_version=None):
+    """
+    Reranke les candidats (déjà triés par distance vectorielle) par tours.
+    Retourne [(score, candidat)] pour les candidats évalués, du meilleur au
+    moins bon. Les suivants ne sont pas rerankés quand les premiers suffisent.
+    Un 4e champ du candidat (token_ids pré-calculés) est transmis au reranker
+    avec tokenizer_version : seule la question est alors tokenisée.
+    """
+    scored = []
+    for start in range(0, len(candidates), round_size):
+        batch = candidates[start:start + round_size]
+        if tokenizer_version:
+            scores = reranker.predict([[query, c[0], c[3] if len(c) > 3 else None] for c in batch],
+                                      tokenizer_version=tokenizer_version)
+        else:
+            scores = reranker.predict([[query, c[0]] for c in batch])
+        scored.extend(zip((float(s) for s in scores), batch))
+        confident = sum(1 for score, _ in scored if score > threshold + margin)
+        if confident >= top_k:
+            break
+    return sorted(scored, key=lambda x: x[0], reverse=True)
+
 class DBAgencyExpert:
     def __init__(self):
         print("⚙️  Initialisation de l'expert (CPU Reranker + Fast LLM)...")
         self.ai = OllamaClient()
         self.fast_model = os.getenv("FAST_MODEL")
         
-        # Chargement du reranker sur CPU
-        self.reranker = CrossEncoder('BAAI/bge-reranker-base', device='cpu')
+        # Reranker partagé (reranker_server.py) : modèle chargé une seule fois,
+        # hors de ce processus, au premier scoring
+        self.reranker = RerankerClient()
         
         self.db_params = {
             "dbname": os.getenv("DB_NAME"),
@@ -28,40 +58,59 @@ class DBAgencyExpert:
             "port": os.getenv("DB_PORT")
         }
 
-    def ask(self, query):
+    def tokenizer_version(self):
+        """Version du tokenizer du reranker (clé de chunk_tokens), None si indisponible."""
+        try:
+            return self.reranker.tokenizer_version()
+        except Exception as e:
+            print(f"⚠️ Version du tokenizer indisponible : {e}")
+            return None
+
+    def retrieve(self, query, top_k=3, threshold=0.3):
+        """
+        Recherche vectorielle + reranking, sans génération.
+        Retourne {"chunks": [{"text", "title", "section", "score"}], "best_score", "timings"}.
+        Lève une exception si la base est inaccessible.
+        """
         start_time = time.time()
 
         # 1. RETRIEVAL (Vector Search)
         print(f"\n🔍 Recherche vectorielle pour : {query}")
+        conn = psycopg2.connect(**self.db_params)
         try:
-            conn = psycopg2.connect(**self.db_params)
             cur = conn.cursor()
-            
             query_emb = self.ai.get_embedding(query)
-            cur.execute("""
-                SELECT content, metadata->>'title', metadata->>'section'
-                FROM documents
-                ORDER BY embedding <=> %s::vector
-                LIMIT 20;
-            """, (query_emb,))
+            version = self.tokenizer_version()
+            if version:
+                # token_ids pré-calculés à l'ingestion (RAG/ingest.py), si présents
+                cur.execute("""
+                    SELECT d.content, d.metadata->>'title', d.metadata->>'section', t.token_ids
+                    FROM documents d
+                    LEFT JOIN chunk_tokens t
+                      ON t.document_id = d.id AND t.tokenizer_version = %s
+                    ORDER BY d.embedding <=> %s::vector
+                    LIMIT %s;
+                """, (version, query_emb, CANDIDATE_POOL))
+            else:
+                cur.execute("""
+                    SELECT content, metadata->>'title', metadata->>'section'
+                    FROM documents
+                    ORDER BY embedding <=> %s::vector
+                    LIMIT %s;
+                """, (query_emb, CANDIDATE_POOL))
             candidates = cur.fetchall()
             cur.close()
+        finally:
             conn.close()
-        except Exception as e:
-            return f"❌ Erreur DB: {e}"
-        
-        t_retrieval = time.time() - start_time
 
+        t_retrieval = time.time() - start_time
         if not candidates:
-            return "Désolé, la recherche vectorielle n'a retourné aucun candidat."
+            return {"chunks": [], "best_score": None, "timings": {"retrieval": t_retrieval}}
 
-        # 2. RERANKING (BGE Cross-Encoder)
-        print(f"⚖️  Reranking de {len(candidates)} chunks...")
-        pairs = [[query, c[0]] for c in candidates]
-        scores = self.reranker.predict(pairs)
-        
-        # Fusion et tri par score décroissant
-        scored_docs = sorted(zip(scores, candidates), key=lambda x: x[0], reverse=True)
+        # 2. RERANKING (BGE Cross-Encoder), par tours avec arrêt anticipé
+        scored_docs = rerank_adaptive(self.reranker, query, candidates, top_k, threshold,
+                                      tokenizer_version=version)
+        print(f"⚖️  Reranking de {len(scored_docs)}/{len(candidates)} chunks...")
         
         # --- DEBUG : Affichage des Top Scores ---
         print("📊 Top 5 scores BGE détectés :")
@@ -70,26 +119,45 @@ class DBAgencyExpert:
             print(f"   [{i+1}] Score: {s:.4f} | {c[1][:40]} > {c[2]}")
 
         # Seuil abaissé à 0.3 pour capturer plus de contexte technique
-        threshold = 0.3
-        top_chunks = [doc for score, doc in scored_docs if score > threshold][:3]
-        
+        chunks = [
+            {"text": c[0], "title": c[1], "section": c[2], "score": float(score)}
+            for score, c in scored_docs if score > threshold
+        ][:top_k]
         t_rerank = time.time() - (start_time + t_retrieval)
+        return {
+            "chunks": chunks,
+            "best_score": float(scored_docs[0][0]),
+            "reranked": len(scored_docs),
+            "timings": {"retrieval": t_retrieval, "rerank": t_rerank},
+        }
+
+    def ask(self, query):
+        start_time = time.time()
+        threshold = 0.3
+        try:
+            found = self.retrieve(query, threshold=threshold)
+        except Exception as e:
+            return f"❌ Erreur DB: {e}"
+
+        if found["best_score"] is None:
+            return "Désolé, la recherche vectorielle n'a retourné aucun candidat."
 
         # 3. GENERATION (LLM)
+        top_chunks = found["chunks"]
         if not top_chunks:
             # On affiche quand même le meilleur score pour comprendre le refus
-            best_score = scored_docs[0][0]
-            return f"Désolé, je n'ai pas trouvé assez d'informations pertinentes (Meilleur score BGE: {best_score:.4f}, Seuil: {threshold})."
+            return f"Désolé, je n'ai pas trouvé assez d'informations pertinentes (Meilleur score BGE: {found['best_score']:.4f}, Seuil: {threshold})."
 
-        context = "\n---\n".join([f"DOC: {c[1]} > {c[2]}\n{c[0]}" for c in top_chunks])
+        context = "\n---\n".join([f"DOC: {c['title']} > {c['section']}\n{c['text']}" for c in top_chunks])
         
         print(f"🧠 Génération avec {self.fast_model}...")
         response = self.ai.chat(query, context=context, model=self.fast_model)
         
         t_total = time.time() - start_time
+        timings = found["timings"]
 
         # Statistiques de performance
-        print(f"\n⏱️  Perfs : Retrieval {t_retrieval:.2f}s | Rerank {t_rerank:.2f}s | Total {t_total:.2f}s")
+        print(f"\n⏱️  Perfs : Retrieval {timings['retrieval']:.2f}s | Rerank {timings['rerank']:.2f}s | Total {t_total:.2f}s")
         return response
 
 if __name__ == "__main__":
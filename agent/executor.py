@@ -3,89 +3,242 @@ import shlex
 import os
 import json
 import shutil
+import codecs
+import selectors
+import signal
+import threading
+import time
 
 # Imports v1.2.1
 from runtime.registry import get_binary_path
+from runtime.sandbox_pool import SandboxPool, SandboxHelperError, SandboxUnavailable, HELPER_PATH
+from runtime.sandbox_profiles import get_profile
 from runtime.audit import log_execution
-from security.allowlist import is_tool_allowed
+from runtime.parsers import parse_output
+from runtime.result_cache import ResultCache, DEFAULT_TTL
+from security.allowlist import is_tool_allowed, is_read_only_invocation, get_tool_metadata
 from security.safety import is_safe, get_unsafe_reason
 
 USE_SANDBOX = os.environ.get("AGENT_SANDBOX", "1") == "1"
+# Réutilisation de namespaces bwrap pré-créés (cf. runtime/sandbox_pool.py)
+USE_SANDBOX_POOL = os.environ.get("AGENT_SANDBOX_POOL", "0") == "1"
+_sandbox_pools = {}
+_pool_lock = threading.Lock()
 
-def build_bwrap_command(command: str) -> list:
+COMMAND_TIMEOUT = 45  # secondes
+# Volume max conservé en mémoire par flux ; le reste est drainé (et relayé
+# au consommateur du flux si spill est demandé)
+MAX_OUTPUT_BYTES = int(os.environ.get("AGENT_MAX_OUTPUT_BYTES", 1024 * 1024))
+READ_CHUNK_SIZE = 64 * 1024
+CANCEL_POLL_INTERVAL = 0.2  # secondes entre deux vérifications d'annulation
+EXIT_CODE_TIMEOUT = 124
+EXIT_CODE_CANCELLED = 130
+TRUNCATION_MARKER = "\n... [output truncated after {} bytes] ...\n"
+
+# Cache TTL opt-in des commandes en lecture seule (métadonnées de l'allowlist)
+RESULT_CACHE = None
+if os.environ.get("AGENT_RESULT_CACHE", "0") == "1":
+    RESULT_CACHE = ResultCache(
+        max_entries=int(os.environ.get("AGENT_RESULT_CACHE_MAX_ENTRIES", 256)),
+        max_bytes=int(os.environ.get("AGENT_RESULT_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+    )
+
+def resolve_argv(command: str) -> list:
     """
-    Construit la commande bwrap pour isoler l'exécution.
+    Découpe la commande et remplace l'alias par le chemin absolu.
     Résout le binaire via le registry (prioritaire) ou le PATH.
     """
     args = shlex.split(command)
     if not args:
         raise ValueError("Commande vide")
-    
+
     tool_name = args[0]
 
-    # 1. Résolution du chemin (Priorité au Registry pour psql-18, etc.)
-    resolved_path = get_binary_path(tool_name) or shutil.which(tool_name)
-        
-    if not resolved_path:
+    # Résolution du chemin (Priorité au Registry pour psql-18, etc.)
+    profile = get_profile(tool_name)
+    if not profile:
+        raise RuntimeError(f"Tool '{tool_name}' not found on system registry or PATH.")
+
+    args[0] = profile["path"]
+    return args
+
+def build_bwrap_command(command: str) -> list:
+    """
+    Construit la commande bwrap pour isoler l'exécution.
+    Le préfixe bwrap (montages) est précompilé par outil : seule la
+    concaténation avec les arguments reste à faire ici.
+    """
+    args = shlex.split(command)
+    if not args:
+        raise ValueError("Commande vide")
+
+    profile = get_profile(args[0])
+    if not profile:
+        raise RuntimeError(f"Tool '{args[0]}' not found on system registry or PATH.")
+
+    return profile["argv_prefix"] + [profile["path"]] + args[1:]
+
+def get_sandbox_pool(tool_name: str):
+    """
+    Pool de sandboxes chauds d'un outil, créé au premier usage
+    (AGENT_SANDBOX_POOL=1). Les helpers reprennent le profil bwrap de l'outil
+    (cf. sandbox_profiles) : pas de montages ni de /tmp partagés entre outils.
+    Le pool est recréé quand le profil change (nouveau registry).
+    """
+    profile = get_profile(tool_name)
+    if not profile:
         raise RuntimeError(f"Tool '{tool_name}' not found on system registry or PATH.")
+    helper_dir = os.path.dirname(HELPER_PATH)
+    prefix = profile["argv_prefix"] + ["--ro-bind", helper_dir, helper_dir]
+    with _pool_lock:
+        pool = _sandbox_pools.get(tool_name)
+        if pool is not None and pool.bwrap_prefix != prefix:
+            pool.close()
+            pool = None
+        if pool is None:
+            pool = SandboxPool(prefix, bind_dirs={os.path.dirname(profile["path"])})
+            _sandbox_pools[tool_name] = pool
+        return pool
+
+def _resolve_command(command: str) -> list:
+    """Résout le binaire et applique le sandbox si actif."""
+    if USE_SANDBOX:
+        return build_bwrap_command(command)
+    cmd_list = shlex.split(command)
+    resolved = get_binary_path(cmd_list[0]) or shutil.which(cmd_list[0])
+    if resolved:
+        cmd_list[0] = resolved
+    return cmd_list
 
-    # On récupère le dossier du binaire pour l'autoriser dans le sandbox
-    tool_dir = os.path.dirname(resolved_path)
-    
-    # 2. Construction des arguments Bubblewrap
-    cmd = [
-        "bwrap",
-        "--unshare-all",
-        "--die-with-parent",
-        "--new-session",
-        "--proc", "/proc",
-        "--dev", "/dev",
-        "--ro-bind", "/usr", "/usr",
-        "--ro-bind", "/bin", "/bin",
-        "--ro-bind", "/lib", "/lib",
-        "--ro-bind", "/lib64", "/lib64",
-        "--ro-bind", "/etc", "/etc",
-        "--ro-bind", "/usr/bin", "/usr/bin",
-        "--ro-bind", tool_dir, tool_dir,  # Autorise le dossier spécifique du binaire
-        "--tmpfs", "/tmp",
-    ]
-
-    # 3. Montage du socket PostgreSQL pour permettre la connexion locale (UDS)
-    if os.path.exists("/var/run/postgresql"):
-        cmd += ["--ro-bind", "/var/run/postgresql", "/var/run/postgresql"]
-
-    # Remplacement de l'alias par le chemin absolu résolu
-    args[0] = resolved_path
-    cmd += args
-    return cmd
-
-def run_command(command: str) -> dict:
-    """
-    Point d'entrée principal : Sécurité -> Sandbox -> Audit.
+def _run_pooled(command: str, plan_id: str = None, max_bytes: int = None,
+                timeout: float = None, cancel_event=None):
     """
+    Exécution via un sandbox chaud du pool. Retourne None si l'outil n'est
+    pas couvert par les montages du pool ou si aucun helper ne démarre
+    (l'appelant repasse par bwrap).
+    """
+    args = resolve_argv(command)
+    pool = get_sandbox_pool(shlex.split(command)[0])
+    if os.path.dirname(args[0]) not in pool.bind_dirs:
+        return None
+
+    timeout = COMMAND_TIMEOUT if timeout is None else timeout
+    max_bytes = MAX_OUTPUT_BYTES if max_bytes is None else max_bytes
+    executed_cmd_str = "bwrap-pool " + " ".join(args)
+    try:
+        reply = pool.run(args, timeout, max_bytes, cancel_event)
+        if reply is None:
+            reply = {"stdout": "", "stderr": "\nError: Process cancelled", "exit_code": EXIT_CODE_CANCELLED}
+    except SandboxUnavailable:
+        return None  # Rien n'a été envoyé au helper : repli sûr sur bwrap
+    except SandboxHelperError as e:
+        # Pas de relance automatique : la commande a pu s'exécuter
+        reply = {"stdout": "", "stderr": f"Sandbox pool error: {e}", "exit_code": -1}
+
+    parsed = None
+    if reply["exit_code"] == 0 and not reply.get("truncated"):
+        parsed = parse_output(command, reply["stdout"])
+    log_execution(command, executed_cmd_str, reply["exit_code"], reply["stdout"], reply["stderr"],
+                  plan_id=plan_id, parsed=parsed)
+
+    result = {
+        "stdout": reply["stdout"],
+        "stderr": reply["stderr"],
+        "exit_code": reply["exit_code"],
+        "command_executed": executed_cmd_str
+    }
+    if reply.get("truncated"):
+        result["truncated"] = True
+    if parsed:
+        result["parsed"] = parsed
+    return result
+
+def _check_policy(command: str, plan_id: str = None):
+    """Allowlist + safety. Retourne un résultat de rejet, ou None si autorisé."""
     # --- 1. SÉCURITÉ : Allowlist ---
     if not is_tool_allowed(command):
         error_msg = "Tool not allowed in security policy."
-        log_execution(command, "REJECTED_BY_ALLOWLIST", -1, "", error_msg)
+        log_execution(command, "REJECTED_BY_ALLOWLIST", -1, "", error_msg, plan_id=plan_id)
         return {"stdout": "", "stderr": error_msg, "exit_code": -1}
 
     # --- 2. SÉCURITÉ : Safety Patterns ---
     if not is_safe(command):
         reason = get_unsafe_reason(command)
         error_msg = f"Unsafe command detected: {reason}"
-        log_execution(command, "REJECTED_BY_SAFETY", -1, "", error_msg)
+        log_execution(command, "REJECTED_BY_SAFETY", -1, "", error_msg, plan_id=plan_id)
         return {"stdout": "", "stderr": error_msg, "exit_code": -1}
 
+    return None
+
+class CommandCancelled(Exception):
+    """Levée quand l'appelant annule une commande en cours (plan annulé)."""
+
+def _kill_process_group(process):
+    """Tue le processus et ses descendants (session dédiée, cf. Popen)."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+    process.wait()
+
+def _read_pipes(process, deadline, timeout, cancel_event=None):
+    """
+    Lit stdout/stderr au fil de l'eau via selectors.
+    Génère des tuples (nom_du_flux, bytes) ; lève TimeoutExpired à l'échéance
+    et CommandCancelled si cancel_event est positionné.
+    """
+    sel = selectors.DefaultSelector()
+    sel.register(process.stdout, selectors.EVENT_READ, "stdout")
+    sel.register(process.stderr, selectors.EVENT_READ, "stderr")
+    try:
+        while sel.get_map():
+            if cancel_event is not None and cancel_event.is_set():
+                raise CommandCancelled()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(process.args, timeout)
+            if cancel_event is not None:
+                remaining = min(remaining, CANCEL_POLL_INTERVAL)
+            for key, _ in sel.select(timeout=remaining):
+                data = os.read(key.fileobj.fileno(), READ_CHUNK_SIZE)
+                if not data:
+                    sel.unregister(key.fileobj)
+                    continue
+                yield key.data, data
+    finally:
+        sel.close()
+
+def stream_command(command: str, plan_id: str = None, max_bytes: int = None,
+                   spill: bool = False, timeout: float = None, cancel_event=None):
+    """
+    Exécution en flux : génère ("stdout" | "stderr", texte) au fil de la
+    lecture, puis ("exit", résultat) en dernier.
+    Chaque flux conservé (résultat, audit) est plafonné à max_bytes
+    (marqueur de troncature ajouté) ; avec spill=True la sortie complète est
+    tout de même relayée au consommateur du flux, sans rien écrire sur l'hôte.
+    timeout (défaut COMMAND_TIMEOUT) et cancel_event (threading.Event)
+    tuent tout le groupe de processus lancé. Si le consommateur abandonne le
+    générateur (client SSE déconnecté), la commande est tuée et auditée
+    comme annulée.
+    """
+    rejected = _check_policy(command, plan_id)
+    if rejected:
+        yield "exit", rejected
+        return
+
+    max_bytes = MAX_OUTPUT_BYTES if max_bytes is None else max_bytes
+    timeout = COMMAND_TIMEOUT if timeout is None else timeout
+    kept = {"stdout": [], "stderr": []}
+    sizes = {"stdout": 0, "stderr": 0}
+    decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in kept}
+    # Décodeurs du flux complet relayé (spill), indépendants du plafond
+    spill_decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in kept} if spill else {}
+    truncated = False
+    process = None
+
     executed_cmd_str = command
     try:
-        if USE_SANDBOX:
-            cmd_list = build_bwrap_command(command)
-        else:
-            cmd_list = shlex.split(command)
-            resolved = get_binary_path(cmd_list[0]) or shutil.which(cmd_list[0])
-            if resolved:
-                cmd_list[0] = resolved
-        
+        cmd_list = _resolve_command(command)
         executed_cmd_str = " ".join(cmd_list)
 
         # --- 3. EXÉCUTION ---
@@ -93,28 +246,151 @@ def run_command(command: str) -> dict:
             cmd_list,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True
+            bufsize=0,
+            start_new_session=True  # Groupe dédié : kill de toute la descendance
         )
+        deadline = time.monotonic() + timeout
+        for name, data in _read_pipes(process, deadline, timeout, cancel_event):
+            room = max_bytes - sizes[name]
+            sizes[name] += len(data)
+            text = ""
+            if room > 0:  # Au-delà du plafond : on draine sans conserver
+                text = decoders[name].decode(data[:room])
+                if len(data) > room:
+                    truncated = True
+                    text += decoders[name].decode(b"", final=True) + TRUNCATION_MARKER.format(max_bytes)
+                kept[name].append(text)
+            if spill:
+                text = spill_decoders[name].decode(data)
+            if text:
+                yield name, text
+        for name, decoder in spill_decoders.items():
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield name, tail
 
-        stdout, stderr = process.communicate(timeout=45) # Timeout de sécurité
-        exit_code = process.returncode
+        # Pipes fermés : le processus doit encore se terminer avant l'échéance
+        exit_code = process.wait(timeout=max(deadline - time.monotonic(), 0))
+        stdout, stderr = "".join(kept["stdout"]), "".join(kept["stderr"])
 
     except subprocess.TimeoutExpired:
-        process.kill()
-        stdout, stderr = process.communicate()
-        exit_code = 124
-        stderr = (stderr or "") + "\nError: Process timed out (45s)"
+        _kill_process_group(process)
+        stdout, stderr = "".join(kept["stdout"]), "".join(kept["stderr"])
+        exit_code = EXIT_CODE_TIMEOUT
+        stderr += f"\nError: Process timed out ({timeout:g}s)"
+    except CommandCancelled:
+        _kill_process_group(process)
+        stdout, stderr = "".join(kept["stdout"]), "".join(kept["stderr"])
+        exit_code = EXIT_CODE_CANCELLED
+        stderr += "\nError: Process cancelled"
+    except GeneratorExit:
+        # Consommateur parti en cours de route (ex: client SSE déconnecté) :
+        # la commande a tourné, elle doit apparaître dans l'audit
+        if process and process.poll() is None:
+            _kill_process_group(process)
+        log_execution(command, executed_cmd_str, EXIT_CODE_CANCELLED, "".join(kept["stdout"]),
+                      "".join(kept["stderr"]) + "\nError: Stream consumer disconnected", plan_id=plan_id)
+        raise
     except Exception as e:
-        stdout = ""
+        stdout = "".join(kept["stdout"])
         stderr = str(e)
         exit_code = -1
+    finally:
+        if process and process.poll() is None:
+            _kill_process_group(process)
+
+    # Sortie structurée (JSON pgbackrest/patronictl, tableaux psql...)
+    parsed = parse_output(command, stdout) if exit_code == 0 and not truncated else None
 
     # --- 4. AUDIT : Enregistrement SQLite ---
-    log_execution(command, executed_cmd_str, exit_code, stdout, stderr)
+    log_execution(command, executed_cmd_str, exit_code, stdout, stderr, plan_id=plan_id, parsed=parsed)
 
-    return {
+    result = {
         "stdout": stdout,
         "stderr": stderr,
         "exit_code": exit_code,
         "command_executed": executed_cmd_str
     }
+    if truncated:
+        result["truncated"] = True
+        result["output_bytes"] = dict(sizes)
+    if parsed:
+        result["parsed"] = parsed
+    yield "exit", result
+
+def _cache_key(command: str):
+    """
+    (clé, ttl) si la commande est éligible au cache de résultats : outil et
+    sous-commande déclarés 'read_only' dans l'allowlist. Sinon (None, 0).
+    """
+    try:
+        args = resolve_argv(command)
+    except Exception:
+        return None, 0
+    tool_name = os.path.basename(args[0])
+    if not is_read_only_invocation(tool_name, args[1:]):
+        return None, 0
+    ttl = get_tool_metadata(tool_name).get("cache_ttl", DEFAULT_TTL)
+    return tuple(args), ttl
+
+def run_command(command: str, plan_id: str = None, on_chunk=None,
+                max_bytes: int = None, spill: bool = False,
+                timeout: float = None, cancel_event=None) -> dict:
+    """
+    Point d'entrée principal : Sécurité -> (Cache) -> Sandbox -> Audit.
+    plan_id rattache l'entrée d'audit au plan appelant (filtre /audit).
+    on_chunk(flux, texte) est appelé à chaque lecture (ex: relais SSE) ;
+    spill=True exige on_chunk, seul destinataire de la sortie au-delà de max_bytes.
+    """
+    if spill and on_chunk is None:
+        raise ValueError("spill=True requires an on_chunk consumer")
+    cache_key, ttl = _cache_key(command) if RESULT_CACHE is not None and not spill else (None, 0)
+    if cache_key:
+        rejected = _check_policy(command, plan_id)
+        if rejected:
+            return rejected
+        cached = RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            log_execution(command, cached.get("command_executed", command), cached["exit_code"],
+                          cached["stdout"], cached["stderr"], plan_id=plan_id,
+                          parsed=cached.get("parsed"), cache_hit=True)
+            cached["cache_hit"] = True
+            if on_chunk:
+                for name in ("stdout", "stderr"):
+                    if cached[name]:
+                        on_chunk(name, cached[name])
+            return cached
+
+    result = _execute(command, plan_id=plan_id, on_chunk=on_chunk, max_bytes=max_bytes,
+                      spill=spill, timeout=timeout, cancel_event=cancel_event)
+
+    if cache_key and result.get("exit_code") == 0 and not result.get("truncated"):
+        RESULT_CACHE.put(cache_key, result, ttl)
+    return result
+
+def _execute(command: str, plan_id: str = None, on_chunk=None,
+             max_bytes: int = None, spill: bool = False,
+             timeout: float = None, cancel_event=None) -> dict:
+    """Exécution effective (pool de sandboxes ou flux), sans cache."""
+    # Le pool renvoie la sortie d'un bloc : réservé aux appels sans flux
+    if USE_SANDBOX and USE_SANDBOX_POOL and on_chunk is None and not spill:
+        rejected = _check_policy(command, plan_id)
+        if rejected:
+            return rejected
+        try:
+            result = _run_pooled(command, plan_id=plan_id, max_bytes=max_bytes,
+                                 timeout=timeout, cancel_event=cancel_event)
+        except Exception as e:
+            result = {"stdout": "", "stderr": str(e), "exit_code": -1}
+            log_execution(command, command, -1, "", str(e), plan_id=plan_id)
+        if result is not None:
+            return result
+
+    result = None
+    for name, payload in stream_command(command, plan_id=plan_id, max_bytes=max_bytes, spill=spill,
+                                        timeout=timeout, cancel_event=cancel_event):
+        if name == "exit":
+            result = payload
+        elif on_chunk:
+            on_chunk(name, payload)
+    return result
@@ -1,13 +1,42 @@
 # agent/orchestrator.py
 import time
+import uuid
+import queue
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from executor import run_command
-from security.allowlist import is_tool_allowed
+from executor import run_command, COMMAND_TIMEOUT
+from security.allowlist import is_tool_allowed, is_read_only_invocation
 from security.safety import is_safe
-from runtime.audit import log_execution
+from runtime import sql_pool
 
 MAX_PLAN_DURATION = 60  # secondes
+MAX_GENERATION_DURATION = 300  # secondes de génération du plan en mode incrémental
+MAX_PARALLEL_STEPS = 4  # étapes indépendantes exécutées simultanément
+KILL_GRACE_PERIOD = 5   # secondes laissées aux étapes tuées pour rendre leur résultat
+STREAM_POLL_INTERVAL = 0.1  # attente d'une nouvelle étape pendant la génération
+
+# Plans en cours : plan_id -> threading.Event (positionné = annulation demandée)
+ACTIVE_PLANS = {}
+_active_lock = threading.Lock()
+
+def cancel_plan(plan_id):
+    """Demande l'annulation d'un plan en cours. Retourne False si inconnu."""
+    with _active_lock:
+        event = ACTIVE_PLANS.get(plan_id)
+    if event is None:
+        return False
+    event.set()
+    return True
+
+def step_timeout(step, remaining):
+    """Budget d'une étape : min(timeout de l'étape, budget restant du plan)."""
+    try:
+        wanted = float(step.get("timeout") or COMMAND_TIMEOUT)
+    except (TypeError, ValueError):
+        wanted = COMMAND_TIMEOUT
+    return max(min(wanted, remaining), 0)
 
 def build_command(tool, args, binaries_registry):
     """
@@ -21,82 +50,267 @@ def build_command(tool, args, binaries_registry):
     # Construction de la ligne de commande
     return " ".join([path] + [str(a) for a in args])
 
-def run_plan(plan, binaries_registry):
+def step_dependencies(steps):
+    """
+    Retourne {index: set(index des dépendances)}.
+    Sans aucun 'depends_on' dans le plan, on conserve l'ordre séquentiel
+    historique (chaque étape dépend de la précédente).
+    """
+    if not any(step.get("depends_on") for step in steps):
+        return {i: ({i - 1} if i > 0 else set()) for i in range(len(steps))}
+
+    ids = {str(step.get("id", f"step_{i}")): i for i, step in enumerate(steps)}
+    deps = {}
+    for i, step in enumerate(steps):
+        wanted = step.get("depends_on") or []
+        if isinstance(wanted, str):
+            wanted = [wanted]
+        # Les références inconnues (étape filtrée par validate_plan) sont ignorées
+        deps[i] = {ids[str(d)] for d in wanted if str(d) in ids and ids[str(d)] != i}
+    return deps
+
+def prepare_step(step, binaries_registry):
+    """Contrôles avant exécution. Retourne (commande, None) ou (None, erreur)."""
+    tool = step.get("tool")
+    args = step.get("args", [])
+
+    if not tool:
+        return None, "Missing tool in step"
+
+    # 1. Validation de la allowlist (toujours par précaution)
+    if not is_tool_allowed(tool):
+        msg = f"Tool not allowed: {tool}"
+        logging.warning(msg)
+        return None, msg
+
+    # 2. Résolution du chemin et construction
+    cmd = build_command(tool, args, binaries_registry)
+
+    # 3. Validation Safety (Check injections, etc.)
+    if not is_safe(cmd):
+        msg = f"Unsafe command blocked by safety engine: {cmd}"
+        logging.warning(msg)
+        return None, msg
+
+    return cmd, None
+
+def run_step(step, cmd, plan_id=None, timeout=None, cancel_event=None):
+    """
+    Exécute une étape préparée. Les étapes 'psql -c' passent par le pool
+    de connexions en lecture seule quand il est activé (résultat structuré
+    columns/rows), avec repli sur le binaire psql sinon.
+    """
+    if step.get("tool") == "psql":
+        settings = sql_pool.get_settings()
+        parsed = sql_pool.parse_psql_args(step.get("args", [])) if settings["enabled"] else None
+        if parsed:
+            result = sql_pool.run_sql(cmd, parsed, plan_id=plan_id, timeout=timeout, cancel_event=cancel_event)
+            if result is not None:
+                return result
+    return run_command(cmd, plan_id=plan_id, timeout=timeout, cancel_event=cancel_event)
+
+def compact_result(result):
+    """
+    Résultat gardé dans l'historique du plan : quand une sortie structurée
+    sans perte ('parsed', lossless) existe, stdout et columns/rows en double
+    sont retirés. Un tableau aligné reparsé garde son stdout.
+    """
+    if not (result.get("parsed") or {}).get("lossless"):
+        return result
+    compact = {k: v for k, v in result.items() if k not in ("stdout", "columns", "rows")}
+    compact["stdout_bytes"] = len(result.get("stdout", "").encode("utf-8"))
+    return compact
+
+def can_start_early(step):
+    """Étape lançable avant la fin de la génération : lecture seule, sans dépendance."""
+    return not step.get("depends_on") and is_read_only_invocation(
+        step.get("tool", ""), [str(a) for a in step.get("args", [])])
+
+def ready_during_generation(i, steps, done, running):
     """
-    Exécute un plan validé, étape par étape, avec garde-fous.
+    Étape i lançable pendant la génération, avec les mêmes règles que le plan
+    complet (step_dependencies) : tant qu'aucune étape reçue ne déclare
+    'depends_on', le plan est séquentiel (l'étape précédente doit être finie).
+    """
+    if not can_start_early(steps[i]):
+        return False
+    if any(step.get("depends_on") for step in steps):
+        return True
+    return not running and (i == 0 or i - 1 in done)
+
+def _feed_steps(step_stream, feed, stop):
+    """Thread : recopie les étapes produites par le planner dans la file."""
+    try:
+        for step in step_stream:
+            if stop.is_set():
+                break
+            feed.put(("step", step))
+        feed.put(("end", None))
+    except Exception as e:
+        feed.put(("error", str(e)))
+
+def run_plan(plan, binaries_registry, plan_id=None, step_stream=None):
+    """
+    Exécute un plan validé avec garde-fous.
+    Les étapes déclarant 'depends_on' forment un graphe : toute étape dont
+    les dépendances sont terminées est lancée, jusqu'à MAX_PARALLEL_STEPS
+    en parallèle. Sans 'depends_on', l'exécution reste séquentielle.
+    Chaque étape reçoit min(son timeout, budget restant du plan) ; à
+    l'échéance de MAX_PLAN_DURATION ou sur cancel_plan(plan_id), les
+    processus en cours sont tués.
+    Chaque exécution est auditée sous plan_id (généré si absent).
+
+    Avec step_stream (étapes validées au fil de la génération du LLM), les
+    étapes en lecture seule sans dépendance partent sans attendre la fin,
+    selon les mêmes règles d'ordre (cf. ready_during_generation) ; les
+    autres attendent le plan complet. La génération est bornée par
+    MAX_GENERATION_DURATION ; le budget MAX_PLAN_DURATION court dès le
+    lancement de la première étape, génération comprise.
     """
     state = {
+        "plan_id": plan_id or uuid.uuid4().hex,
         "history": [],
         "errors": [],
         "start_time": time.time()
     }
+    cancel_event = threading.Event()
+    with _active_lock:
+        ACTIVE_PLANS[state["plan_id"]] = cancel_event
 
-    # Le registre passé ici est registry["binaries"]
-    for i, step in enumerate(plan.get("steps", [])):
-        # Limitation du nombre d'étapes
-        if i >= plan.get("max_steps", 5):
-            break
-
-        # Check Timeout Global
-        if time.time() - state["start_time"] > MAX_PLAN_DURATION:
-            state["errors"].append("Plan aborted: timeout")
-            break
-
-        tool = step.get("tool")
-        args = step.get("args", [])
-
-        if not tool:
-            state["errors"].append("Missing tool in step")
-            if step.get("on_error") == "abort": break
-            continue
-
-        # 1. Validation de la allowlist (toujours par précaution)
-        if not is_tool_allowed(tool):
-            msg = f"Tool not allowed: {tool}"
-            logging.warning(msg)
-            state["errors"].append(msg)
-            if step.get("on_error") == "abort": break
-            continue
-
-        # 2. Résolution du chemin et construction
-        cmd = build_command(tool, args, binaries_registry)
-
-        # 3. Validation Safety (Check injections, etc.)
-        if not is_safe(cmd):
-            msg = f"Unsafe command blocked by safety engine: {cmd}"
-            logging.warning(msg)
-            state["errors"].append(msg)
-            if step.get("on_error") == "abort": break
-            continue
-
-        logging.info(f"[PLAN-STEP] Executing: {cmd}")
-        
-        # 4. Exécution réelle
-        result = run_command(cmd)
-
-        # Audit System
-        try:
-            log_execution(
-                command=cmd,
-                executed_command=result.get("command_executed", cmd),
-                exit_code=result.get("exit_code", -1),
-                stdout=result.get("stdout", ""),
-                stderr=result.get("stderr", "")
-            )
-        except Exception as e:
-            logging.error(f"Audit log failed in plan: {e}")
-
-        # Historique pour le client
-        state["history"].append({
-            "step": step,
-            "command": cmd,
-            "result": result
-        })
-
-        # Gestion des erreurs d'exécution
-        if result.get("exit_code", 0) != 0:
-            if step.get("on_error") == "abort":
+    # Limitation du nombre d'étapes
+    max_steps = plan.get("max_steps", 5)
+    generating = step_stream is not None
+    steps = [] if generating else plan.get("steps", [])[:max_steps]
+    deps = {} if generating else step_dependencies(steps)
+    pending = set(range(len(steps)))
+    done = set()
+    running = {}
+    entries = []
+    aborted = False
+    plan_deadline = None  # Fixée au lancement de la première étape
+
+    stop_feed = threading.Event()
+    feed = queue.Queue()
+    generation_deadline = time.time() + MAX_GENERATION_DURATION
+    if generating:
+        threading.Thread(target=_feed_steps, args=(step_stream, feed, stop_feed), daemon=True).start()
+
+    def accept(kind, item):
+        nonlocal generating, deps
+        if kind == "step":
+            if len(steps) < max_steps:
+                steps.append(item)
+                pending.add(len(steps) - 1)
+            return
+        if kind == "error":
+            state["errors"].append(f"Plan generation failed: {item}")
+        # Plan complet : graphe définitif (les étapes déjà lancées sont hors de pending)
+        generating = False
+        deps = step_dependencies(steps)
+
+    def collect(finished):
+        nonlocal aborted
+        for future in finished:
+            i, cmd = running.pop(future)
+            step = steps[i]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"stdout": "", "stderr": str(e), "exit_code": -1}
+            done.add(i)
+
+            # Historique pour le client (sortie brute retirée si elle est structurée)
+            entries.append((i, {
+                "step": step,
+                "command": cmd,
+                "result": compact_result(result)
+            }))
+
+            # Gestion des erreurs d'exécution
+            if result.get("exit_code", 0) != 0 and step.get("on_error") == "abort" and not cancel_event.is_set():
                 state["errors"].append(f"Step {i} failed, aborting plan.")
+                aborted = True
+
+    # Le registre passé ici est registry["binaries"]
+    pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_STEPS)
+    try:
+        while pending or running or generating:
+            if generating:
+                try:
+                    while generating:
+                        accept(*feed.get_nowait())
+                except queue.Empty:
+                    pass
+
+            # Annulation client ou Timeout Global (génération comprise) : on tue ce qui tourne
+            remaining = MAX_PLAN_DURATION if plan_deadline is None else plan_deadline - time.time()
+            timed_out = "Plan aborted: timeout" if remaining <= 0 else None
+            if generating and not timed_out and time.time() >= generation_deadline:
+                timed_out = "Plan aborted: generation timeout"
+            if cancel_event.is_set() or timed_out:
+                state["errors"].append("Plan cancelled" if cancel_event.is_set() else timed_out)
+                cancel_event.set()
+                if running:
+                    finished, _ = wait(list(running), timeout=KILL_GRACE_PERIOD)
+                    collect(finished)
                 break
 
+            # Lancement de toutes les étapes prêtes (rien de nouveau après un abort)
+            for i in sorted(pending):
+                if aborted or len(running) >= MAX_PARALLEL_STEPS:
+                    break
+                if not (ready_during_generation(i, steps, done, running) if generating else deps[i] <= done):
+                    continue
+                pending.discard(i)
+                step = steps[i]
+                cmd, error = prepare_step(step, binaries_registry)
+                if error:
+                    state["errors"].append(error)
+                    done.add(i)
+                    if step.get("on_error") == "abort":
+                        aborted = True
+                    continue
+
+                logging.info(f"[PLAN-STEP] Executing: {cmd}")
+                if plan_deadline is None:
+                    plan_deadline = time.time() + MAX_PLAN_DURATION
+                # 4. Exécution réelle (l'audit est écrit par run_command)
+                future = pool.submit(
+                    run_step, step, cmd,
+                    plan_id=state["plan_id"],
+                    timeout=step_timeout(step, remaining),
+                    cancel_event=cancel_event
+                )
+                running[future] = (i, cmd)
+
+            if not running:
+                if aborted:
+                    break
+                if generating:
+                    try:
+                        accept(*feed.get(timeout=STREAM_POLL_INTERVAL))
+                    except queue.Empty:
+                        pass
+                    continue
+                if pending and not any(deps[i] <= done for i in pending):
+                    state["errors"].append("Plan aborted: unresolvable step dependencies")
+                    break
+                continue
+
+            # Les étapes déjà lancées vont à leur terme, même après un abort
+            wait_timeout = STREAM_POLL_INTERVAL if generating else remaining
+            finished, _ = wait(list(running), timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            collect(finished)
+        else:
+            # Annulation arrivée pendant la dernière étape
+            if cancel_event.is_set():
+                state["errors"].append("Plan cancelled")
+    finally:
+        stop_feed.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        with _active_lock:
+            ACTIVE_PLANS.pop(state["plan_id"], None)
+
+    # Historique dans l'ordre du plan, quel que soit l'ordre de complétion
+    state["history"] = [entry for _, entry in sorted(entries, key=lambda e: e[0])]
     return state
@@ -5,12 +5,17 @@ import os
 import sys
 
 from runtime.llm_client import MockLLM, OllamaClient
-from runtime.discovery import load_config, get_registry
+from runtime.discovery import load_config
+from runtime.registry import get_registry, get_registry_fingerprint
+from runtime.plan_cache import get_plan_cache, get_settings as get_plan_cache_settings, plan_cache_key
+from runtime.prompt_budget import budget_prompt_parts, count_tokens
+from runtime.plan_schema import plan_schema, step_schema, validate, repair_plan, repair_step
 from security.allowlist import is_tool_allowed
 from security.safety import is_safe
 
 MAX_STEPS_PER_PLAN = 5
 MAX_JSON_CHARS = 20000
+MAX_STEP_RETRIES = 2  # Étapes invalides re-demandées au LLM, une fois chacune
 
 def get_llm_client():
     cfg = load_config().get("llm", {})
@@ -18,13 +23,15 @@ def get_llm_client():
     if provider == "ollama":
         return OllamaClient(
             url=cfg.get("url", "http://10.214.0.8:11434"),
-            model=cfg.get("model", "qwen2.5:7b-instruct-q4_K_M")
+            model=cfg.get("model", "qwen2.5:7b-instruct-q4_K_M"),
+            keep_alive=cfg.get("keep_alive", "30m"),
+            num_ctx=cfg.get("num_ctx")
         )
     return MockLLM()
 
-def call_llm(prompt: str) -> str:
+def call_llm(prompt: str, system: str | None = None, format: dict | None = None) -> str:
     ai = get_llm_client()
-    return ai.chat(prompt)
+    return ai.chat(prompt, system=system, format=format)
 
 def extract_json(raw: str) -> str:
     if not raw: raise ValueError("Empty response")
@@ -34,53 +41,299 @@ def extract_json(raw: str) -> str:
     if start == -1 or end == -1: raise ValueError("No JSON found")
     return cleaned[start:end+1]
 
-def build_planner_prompt(question, registry_binaries, tools_help, rag_context, pg_version, mode):
-    docs_context = ""
-    for name, help_text in tools_help.items():
-        docs_context += f"--- LOCAL TOOL: {name} ---\n{help_text[:800]}\n\n"
+# Préfixe système par empreinte du registry : identique d'une requête à
+# l'autre, il reste dans le cache KV d'Ollama (seule la suite est recalculée)
+_system_prefixes = {}
 
-    return f"""You are a PostgreSQL Expert Worker.
-Respond ONLY in JSON.
-PG_VERSION: {pg_version} | MODE: {mode}
+def parse_llm_json(raw: str) -> dict:
+    """Sortie contrainte : JSON direct ; sinon extraction (anciens modèles, balises)."""
+    if raw and len(raw) > MAX_JSON_CHARS:
+        raise ValueError("LLM output too large")
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        data = json.loads(extract_json(raw))
+    if not isinstance(data, dict):
+        raise ValueError("LLM output is not a JSON object")
+    if "error" in data and "steps" not in data:
+        raise ValueError(data["error"])
+    return data
 
-QUESTION: "{question}"
+def fix_invalid_steps(plan: dict, registry_binaries: dict, system: str | None = None) -> dict:
+    """
+    Après réparation locale, seules les étapes encore non conformes au schéma
+    sont re-demandées au LLM (prompt court, schéma d'étape) ; les autres
+    restent telles quelles. Une étape toujours invalide est écartée.
+    """
+    schema = step_schema(registry_binaries)
+    retries = 0
+    fixed = []
+    for i, step in enumerate(plan["steps"]):
+        errors = validate(step, schema)
+        if errors and retries < MAX_STEP_RETRIES:
+            retries += 1
+            details = "; ".join(f"{'.'.join(map(str, path)) or 'step'}: {msg}" for path, msg in errors)
+            prompt = (f"This plan step is invalid ({details}).\n"
+                      f"STEP: {json.dumps(step, default=str)}\n"
+                      f"Return ONLY the corrected step as a JSON object.")
+            try:
+                step = repair_step(parse_llm_json(call_llm(prompt, system=system, format=schema)), i)
+                errors = validate(step, schema)
+            except Exception as e:
+                errors = [((), str(e))]
+        if errors:
+            logging.warning(f"Dropping invalid plan step {i}: {errors}")
+            continue
+        fixed.append(step)
+    plan["steps"] = fixed
+    return plan
 
-OFFICIAL DOCUMENTATION (From Agency RAG):
-{rag_context}
+def build_system_prefix(registry_binaries, fingerprint=None):
+    """Partie statique du prompt : rôle, règles et catalogue compact des outils."""
+    if fingerprint is not None and fingerprint in _system_prefixes:
+        return _system_prefixes[fingerprint]
+    prefix = f"""You are a PostgreSQL Expert Worker.
+Respond ONLY in JSON.
 
-LOCAL BINARIES (Discovery):
-{docs_context}
+LOCAL BINARIES (Discovery): {', '.join(sorted(registry_binaries))}
 
 STRICT RULES:
 1. If the OFFICIAL DOCUMENTATION describes a tool you don't have in LOCAL BINARIES, return "goal": "MISSING_TOOL: [name]" and empty steps [].
 2. NEVER use 'ls' for system tasks. If 'df' is missing, report it.
+3. Give each step an "id". Steps that need another step's result declare "depends_on": [ids]; independent steps omit it and run in parallel.
 """
+    if fingerprint is not None:
+        _system_prefixes.clear()  # Un seul registry actif à la fois
+        _system_prefixes[fingerprint] = prefix
+    return prefix
+
+def build_planner_prompt(question, tools_help, rag_context, pg_version, mode):
+    """Partie variable du prompt, envoyée après le préfixe système."""
+    # tools_help ne contient que les aides retenues par le budget (voir prompt_budget)
+    docs_context = ""
+    for name, help_text in tools_help.items():
+        docs_context += f"--- LOCAL TOOL: {name} ---\n{help_text}\n\n"
+
+    return f"""PG_VERSION: {pg_version} | MODE: {mode}
+
+LOCAL TOOL HELP:
+{docs_context}
+OFFICIAL DOCUMENTATION (From Agency RAG):
+{rag_context}
+
+QUESTION: "{question}"
+"""
+
+def is_step_allowed(step: dict, registry_binaries: dict) -> bool:
+    """Règles de validate_plan pour une étape : binaire connu, allowlist, safety."""
+    tool = step.get("tool", "").split('/')[-1]
+    if tool in registry_binaries and is_tool_allowed(tool):
+        path = registry_binaries[tool]
+        cmd = " ".join([str(path)] + [str(a) for a in step.get("args", [])])
+        if is_safe(cmd):
+            step["tool"] = tool
+            return True
+    return False
 
 def validate_plan(plan: dict, registry_binaries: dict) -> dict:
     if "steps" not in plan: plan["steps"] = []
-    safe_steps = []
-    for step in plan["steps"]:
-        tool = step.get("tool", "").split('/')[-1]
-        if tool in registry_binaries and is_tool_allowed(tool):
-            path = registry_binaries[tool]
-            cmd = " ".join([str(path)] + [str(a) for a in step.get("args", [])])
-            if is_safe(cmd):
-                step["tool"] = tool
-                safe_steps.append(step)
+    safe_steps = [step for step in plan["steps"] if is_step_allowed(step, registry_binaries)]
     plan["steps"] = safe_steps[:MAX_STEPS_PER_PLAN]
+
+    # Une dépendance vers une étape rejetée ne doit pas bloquer le plan
+    kept_ids = {str(s.get("id")) for s in plan["steps"] if s.get("id") is not None}
+    for step in plan["steps"]:
+        if "depends_on" in step:
+            wanted = step["depends_on"] if isinstance(step["depends_on"], list) else [step["depends_on"]]
+            step["depends_on"] = [d for d in wanted if str(d) in kept_ids]
     return plan
 
-def plan_actions(question, rag_context="No context provided", pg_version="unknown", mode="readonly"):
+def prepare_planning(question, rag_context, pg_version, mode):
+    """
+    Étapes communes à plan_actions et PlanStream : registry, clé de cache,
+    plan en cache éventuel, prompt budgété. Retourne un dict de contexte.
+    """
     # Plus besoin d'expert_rag ici ! On utilise le rag_context reçu par l'API
     registry_data = get_registry()
     registry_binaries = registry_data.get("binaries", {})
+
+    # Plans validés réutilisés tant que question/contexte/registry sont identiques
+    cache = get_plan_cache()
+    fingerprint = get_registry_fingerprint()
+    ctx = {
+        "binaries": registry_binaries,
+        "cache": cache,
+        "cache_key": plan_cache_key(question, mode, rag_context, fingerprint, pg_version),
+        "cached": None,
+    }
+    if cache is not None:
+        cached = cache.get(ctx["cache_key"])
+        if cached is not None:
+            cached["cache_hit"] = True
+            ctx["cached"] = cached
+            return ctx
+
     rich_help = {t['name']: t.get('help_doc', 'No help') for t in registry_data.get("tools", [])}
+    ctx["system"] = build_system_prefix(registry_binaries, fingerprint)
+    prefix_tokens = count_tokens(ctx["system"])
+    tools_help, rag_context, prompt_stats = budget_prompt_parts(question, rich_help, rag_context,
+                                                                reserved_tokens=prefix_tokens)
+
+    ctx["prompt"] = build_planner_prompt(question, tools_help, rag_context, pg_version, mode)
+    prompt_stats["prefix_tokens"] = prefix_tokens
+    prompt_stats["prompt_tokens"] = prompt_stats["prefix_tokens"] + count_tokens(ctx["prompt"])
+    logging.info(f"Planner prompt: {prompt_stats['prompt_tokens']} tokens "
+                 f"(static prefix {prompt_stats['prefix_tokens']}) "
+                 f"{prompt_stats['tools_selected']}/{prompt_stats['tools_total']} tools, "
+                 f"RAG {prompt_stats['rag_tokens']} tokens")
+    ctx["prompt_stats"] = prompt_stats
+    return ctx
 
-    prompt = build_planner_prompt(question, registry_binaries, rich_help, rag_context, pg_version, mode)
+def remember_plan(ctx, plan):
+    # On ne mémorise que des plans exploitables (au moins une étape validée)
+    if ctx["cache"] is not None and plan["steps"]:
+        ctx["cache"].put(ctx["cache_key"], plan, ttl=get_plan_cache_settings()["ttl"])
+
+def plan_actions(question, rag_context="No context provided", pg_version="unknown", mode="readonly"):
+    ctx = prepare_planning(question, rag_context, pg_version, mode)
+    if ctx["cached"] is not None:
+        return ctx["cached"]
+    registry_binaries = ctx["binaries"]
 
     try:
-        raw = call_llm(prompt)
-        plan = json.loads(extract_json(raw))
-        return validate_plan(plan, registry_binaries)
+        raw = call_llm(ctx["prompt"], system=ctx["system"], format=plan_schema(registry_binaries))
+        plan = repair_plan(parse_llm_json(raw))
+        plan = fix_invalid_steps(plan, registry_binaries, ctx["system"])
+        plan = validate_plan(plan, registry_binaries)
     except Exception as e:
-        return {"goal": f"Error: {str(e)}", "steps": []}
+        return {"goal": f"Error: {str(e)}", "steps": [], "prompt_stats": ctx["prompt_stats"]}
+    plan["prompt_stats"] = ctx["prompt_stats"]
+    remember_plan(ctx, plan)
+    return plan
+
+# ------------------------------------------------------------
+# Planification incrémentale (génération en streaming)
+# ------------------------------------------------------------
+def stream_llm(prompt: str, system: str | None = None, format: dict | None = None):
+    """Fragments de texte du LLM ; réponse d'un bloc si le client ne streame pas."""
+    ai = get_llm_client()
+    if hasattr(ai, "stream_chat"):
+        yield from ai.stream_chat(prompt, system=system, format=format)
+    else:
+        yield ai.chat(prompt, system=system, format=format)
+
+class StepStreamParser:
+    """
+    Parseur JSON incrémental : renvoie chaque objet du tableau "steps" dès
+    que son accolade fermante arrive, sans attendre la fin du plan.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None
+        self.key = None
+        self.steps_depth = None  # profondeur du tableau "steps" une fois ouvert
+        self.step_start = None
+
+    def feed(self, text):
+        self.buffer += text
+        steps = []
+        buf = self.buffer
+        for i in range(self.pos, len(buf)):
+            ch = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self.last_string = buf[self.string_start + 1:i]
+                continue
+            if ch == '"':
+                self.in_string = True
+                self.string_start = i
+            elif ch == ":" and self.depth == 1:
+                self.key = self.last_string
+            elif ch in "{[":
+                if ch == "[" and self.depth == 1 and self.key == "steps":
+                    self.steps_depth = 2
+                elif ch == "{" and self.steps_depth is not None and self.depth == self.steps_depth:
+                    self.step_start = i
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if ch == "}" and self.step_start is not None and self.depth == self.steps_depth:
+                    try:
+                        steps.append(json.loads(buf[self.step_start:i + 1]))
+                    except ValueError:
+                        logging.warning("Unparsable streamed step skipped")
+                    self.step_start = None
+                elif ch == "]" and self.steps_depth is not None and self.depth == self.steps_depth - 1:
+                    self.steps_depth = None
+        self.pos = len(buf)
+        return steps
+
+class PlanStream:
+    """
+    Itérable des étapes validées (schéma + règles de validate_plan) au fil de
+    la génération, pour run_plan(step_stream=...). Une fois l'itération
+    terminée, .plan contient le plan final, comme plan_actions.
+    """
+
+    def __init__(self, question, rag_context="No context provided", pg_version="unknown", mode="readonly"):
+        self.args = (question, rag_context, pg_version, mode)
+        self.plan = None
+
+    def __iter__(self):
+        ctx = prepare_planning(*self.args)
+        if ctx["cached"] is not None:
+            self.plan = ctx["cached"]
+            yield from self.plan["steps"]
+            return
+
+        binaries = ctx["binaries"]
+        schema = step_schema(binaries)
+        # Après une étape invalide, les suivantes sont retenues jusqu'à sa
+        # reprise : elles sortent dans l'ordre du plan, comme avec plan_actions
+        accepted, held = [], []
+
+        def accept(step):
+            if len(accepted) >= MAX_STEPS_PER_PLAN or not is_step_allowed(step, binaries):
+                return False
+            accepted.append(step)
+            return True
+
+        parser = StepStreamParser()
+        try:
+            for chunk in stream_llm(ctx["prompt"], system=ctx["system"], format=plan_schema(binaries)):
+                for step in parser.feed(chunk):
+                    step = repair_step(step, len(accepted) + len(held))
+                    if held or validate(step, schema):
+                        held.append(step)  # Reprises en fin de génération
+                    elif accept(step):
+                        yield step
+        except Exception as e:
+            self.plan = {"goal": f"Error: {str(e)}", "steps": accepted, "prompt_stats": ctx["prompt_stats"]}
+            raise
+
+        try:
+            goal = parse_llm_json(parser.buffer).get("goal", "")
+        except Exception:
+            goal = ""
+        if held:
+            # Les étapes déjà acceptées sont valides : seules les retenues changent
+            fixed = fix_invalid_steps({"steps": accepted + held}, binaries, ctx["system"])["steps"]
+            for step in fixed[len(accepted):]:
+                if accept(step):
+                    yield step
+
+        plan = validate_plan({"goal": goal if isinstance(goal, str) else str(goal), "steps": accepted}, binaries)
+        plan["prompt_stats"] = ctx["prompt_stats"]
+        remember_plan(ctx, plan)
+        self.plan = plan
@@ -1,6 +1,17 @@
 import sqlite3
 import os
-from datetime import datetime
+import json
+import zlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# zstd est optionnel : meilleur ratio/vitesse, sinon repli sur zlib (stdlib)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 AUDIT_DB_PATH = "/opt/pgagent/runtime/audit.db"
 
@@ -8,10 +19,71 @@ AUDIT_DB_PATH = "/opt/pgagent/runtime/audit.db"
 if not os.path.exists("/opt/pgagent"):
     AUDIT_DB_PATH = os.path.join(os.path.dirname(__file__), "audit.db")
 
+# --- Bornes de stockage (surchargeables par variables d'environnement) ---
+# Taille max conservée par flux (stdout/stderr) : on garde le début et la fin
+AUDIT_MAX_OUTPUT_BYTES = int(os.environ.get("AUDIT_MAX_OUTPUT_BYTES", 64 * 1024))
+# Au-delà de ce seuil, la sortie est compressée dans une colonne BLOB
+AUDIT_COMPRESS_MIN_BYTES = int(os.environ.get("AUDIT_COMPRESS_MIN_BYTES", 4 * 1024))
+# Rétention : âge max des lignes et volume total max des sorties stockées
+AUDIT_RETENTION_DAYS = int(os.environ.get("AUDIT_RETENTION_DAYS", 30))
+AUDIT_MAX_TOTAL_BYTES = int(os.environ.get("AUDIT_MAX_TOTAL_BYTES", 256 * 1024 * 1024))
+# La rotation tourne toutes les N insertions (0 = désactivée)
+AUDIT_PRUNE_EVERY = int(os.environ.get("AUDIT_PRUNE_EVERY", 500))
+
+CODEC = "zstd" if zstandard else "zlib"
+TRUNCATION_MARKER = "\n... [audit: {} bytes truncated] ...\n"
+
+_inserts_since_prune = 0
+
+# Lot d'audit en cours (audit_batch) : les lignes sont accumulées puis
+# écrites en une seule transaction à la sortie du bloc
+_current_batch = contextvars.ContextVar("audit_batch", default=None)
+
+INSERT_SQL = (
+    "INSERT INTO audit_logs (timestamp, command, executed_command, exit_code, stdout, stderr, "
+    "codec, stdout_z, stderr_z, stdout_len, stderr_len, tool, plan_id, parsed, parsed_z, cache_hit) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Colonnes ajoutées après la v1.2.1 (migration à chaud des bases existantes)
+EXTRA_COLUMNS = {
+    "codec": "TEXT",
+    "stdout_z": "BLOB",
+    "stderr_z": "BLOB",
+    "stdout_len": "INTEGER",
+    "stderr_len": "INTEGER",
+    "tool": "TEXT",
+    "plan_id": "TEXT",
+    "parsed": "TEXT",
+    "parsed_z": "BLOB",
+    "cache_hit": "INTEGER DEFAULT 0",
+}
+
+# Index pour /audit : chaque filtre est couplé à id pour la pagination keyset
+AUDIT_INDEXES = {
+    "idx_audit_timestamp": "timestamp",
+    "idx_audit_exit_code": "exit_code, id",
+    "idx_audit_tool": "tool, id",
+    "idx_audit_plan_id": "plan_id, id",
+}
+
+# Colonnes renvoyées par défaut (sans les sorties volumineuses)
+SUMMARY_COLUMNS = [
+    "id", "timestamp", "tool", "plan_id", "command", "executed_command",
+    "exit_code", "stdout_len", "stderr_len", "cache_hit",
+]
+MAX_PAGE_SIZE = 500
+
 def init_db():
     """Crée la table d'audit si elle n'existe pas."""
     os.makedirs(os.path.dirname(AUDIT_DB_PATH), exist_ok=True)
     with sqlite3.connect(AUDIT_DB_PATH) as conn:
+        # Doit précéder la création de la table pour être pris en compte ;
+        # une base existante ne change de mode qu'après un VACUUM complet (une fois)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("VACUUM")
+        conn.execute("PRAGMA journal_mode = WAL")
         conn.execute("""
             CREATE TABLE IF NOT EXISTS audit_logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -23,25 +95,263 @@ def init_db():
                 stderr TEXT
             )
         """)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(audit_logs)")}
+        for name, col_type in EXTRA_COLUMNS.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE audit_logs ADD COLUMN {name} {col_type}")
+
+        # Rattrapage du nom d'outil pour les lignes antérieures à la colonne
+        legacy = conn.execute("SELECT id, command FROM audit_logs WHERE tool IS NULL").fetchall()
+        conn.executemany(
+            "UPDATE audit_logs SET tool = ? WHERE id = ?",
+            [(extract_tool_name(command), row_id) for row_id, command in legacy]
+        )
+        for index_name, columns in AUDIT_INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON audit_logs ({columns})")
+
+def extract_tool_name(command):
+    """Nom court de l'outil (ex: /usr/bin/ls -l -> ls)."""
+    parts = (command or "").strip().split()
+    return os.path.basename(parts[0]) if parts else ""
+
+def truncate_output(text, max_bytes=None):
+    """Tronque une sortie en conservant la tête et la queue."""
+    if not text:
+        return text or ""
+    max_bytes = AUDIT_MAX_OUTPUT_BYTES if max_bytes is None else max_bytes
+    raw = text.encode("utf-8", errors="replace")
+    if max_bytes <= 0 or len(raw) <= max_bytes:
+        return text
+    half = max_bytes // 2
+    head = raw[:half].decode("utf-8", errors="ignore")
+    tail = raw[len(raw) - half:].decode("utf-8", errors="ignore")
+    return head + TRUNCATION_MARKER.format(len(raw) - 2 * half) + tail
+
+def compress_output(text):
+    """Retourne (texte, blob) : le blob est rempli si la sortie dépasse le seuil."""
+    raw = (text or "").encode("utf-8", errors="replace")
+    if len(raw) < AUDIT_COMPRESS_MIN_BYTES:
+        return text, None
+    if zstandard:
+        return None, zstandard.ZstdCompressor(level=3).compress(raw)
+    return None, zlib.compress(raw, 6)
+
+def decompress_output(blob, codec):
+    """Inverse de compress_output."""
+    if blob is None:
+        return None
+    if codec == "zstd":
+        if not zstandard:
+            return "[audit: zstd payload, install 'zstandard' to read it]"
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raw = zlib.decompress(blob)
+    return raw.decode("utf-8", errors="replace")
+
+def _decode_row(row):
+    """Reconstitue stdout/stderr en clair et masque les colonnes techniques."""
+    log = dict(row)
+    for stream in ("stdout", "stderr", "parsed"):
+        blob = log.pop(f"{stream}_z", None)
+        if blob is not None:
+            log[stream] = decompress_output(blob, log.get("codec"))
+    if log.get("parsed"):
+        log["parsed"] = json.loads(log["parsed"])
+    log.pop("codec", None)
+    return log
+
+def _audit_row(command, executed_command, exit_code, stdout, stderr, plan_id, parsed, cache_hit):
+    stdout_len = len((stdout or "").encode("utf-8", errors="replace"))
+    stderr_len = len((stderr or "").encode("utf-8", errors="replace"))
+    stderr_txt, stderr_z = compress_output(truncate_output(stderr))
+    stdout_txt, stdout_z, parsed_txt, parsed_z = None, None, None, None
+    parsed_json = json.dumps(parsed, separators=(",", ":"), default=str) if parsed is not None else None
+    # Sortie structurée sans perte : elle remplace stdout au lieu de s'y ajouter,
+    # tant qu'elle tient dans le plafond par flux (sinon stdout tronqué seul)
+    if parsed_json is not None and parsed.get("lossless"):
+        if AUDIT_MAX_OUTPUT_BYTES <= 0 or len(parsed_json.encode("utf-8")) <= AUDIT_MAX_OUTPUT_BYTES:
+            parsed_txt, parsed_z = compress_output(parsed_json)
+        else:
+            stdout_txt, stdout_z = compress_output(truncate_output(stdout))
+    else:
+        stdout_txt, stdout_z = compress_output(truncate_output(stdout))
+        if parsed_json is not None:
+            parsed_txt, parsed_z = compress_output(parsed_json)
+    codec = CODEC if any(z is not None for z in (stdout_z, stderr_z, parsed_z)) else None
+    return (datetime.now().isoformat(), command, executed_command, exit_code, stdout_txt, stderr_txt,
+            codec, stdout_z, stderr_z, stdout_len, stderr_len, extract_tool_name(command), plan_id,
+            parsed_txt, parsed_z, int(bool(cache_hit)))
+
+def _write_rows(rows):
+    global _inserts_since_prune
+    with sqlite3.connect(AUDIT_DB_PATH) as conn:
+        conn.executemany(INSERT_SQL, rows)
+
+    _inserts_since_prune += len(rows)
+    if AUDIT_PRUNE_EVERY and _inserts_since_prune >= AUDIT_PRUNE_EVERY:
+        _inserts_since_prune = 0
+        prune_logs()
 
-def log_execution(command, executed_command, exit_code, stdout, stderr):
-    """Enregistre une exécution dans la base SQLite."""
+def _write_batched(batch, row):
+    """
+    Écriture groupée : la ligne est écrite tout de suite, avec celles des
+    autres threads du lot arrivées pendant l'écriture en cours (rien n'attend
+    la fin du lot : un arrêt brutal ne perd que les lignes en vol).
+    """
+    with batch["lock"]:
+        batch["rows"].append(row)
+        if batch["writing"]:
+            return  # L'écrivain en cours la prendra au tour suivant
+        batch["writing"] = True
     try:
-        with sqlite3.connect(AUDIT_DB_PATH) as conn:
-            conn.execute(
-                "INSERT INTO audit_logs (timestamp, command, executed_command, exit_code, stdout, stderr) VALUES (?, ?, ?, ?, ?, ?)",
-                (datetime.now().isoformat(), command, executed_command, exit_code, stdout, stderr)
-            )
+        while True:
+            with batch["lock"]:
+                rows, batch["rows"] = batch["rows"], []
+                if not rows:
+                    batch["writing"] = False
+                    return
+            _write_rows(rows)
+    except Exception:
+        with batch["lock"]:
+            batch["writing"] = False
+        raise
+
+def log_execution(command, executed_command, exit_code, stdout, stderr, plan_id=None, parsed=None,
+                  cache_hit=False):
+    """
+    Enregistre une exécution dans la base SQLite.
+    parsed : sortie structurée (runtime/parsers.py), stockée en JSON compact.
+    cache_hit : résultat servi par le cache de l'executor (pas de processus lancé).
+    Dans un bloc audit_batch(), les lignes concurrentes partagent une transaction.
+    """
+    try:
+        row = _audit_row(command, executed_command, exit_code, stdout, stderr, plan_id, parsed, cache_hit)
+        batch = _current_batch.get()
+        if batch is not None:
+            _write_batched(batch, row)
+            return
+        _write_rows([row])
     except Exception as e:
         # On utilise print ici car le logger de server.py n'est pas forcément importé ici
         print(f"CRITICAL: Failed to write audit log: {e}")
 
+@contextmanager
+def audit_batch():
+    """
+    Regroupe les log_execution concurrents du bloc (cf. _write_batched).
+    Les threads lancés dans le bloc doivent exécuter leur tâche dans une
+    copie du contexte (contextvars.copy_context().run) pour y participer.
+    """
+    batch = {"rows": [], "lock": threading.Lock(), "writing": False}
+    token = _current_batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _current_batch.reset(token)
+        if batch["rows"]:
+            try:
+                _write_rows(batch["rows"])
+            except Exception as e:
+                print(f"CRITICAL: Failed to write audit batch: {e}")
+
+def prune_logs(max_age_days=None, max_total_bytes=None):
+    """
+    Rotation de la table d'audit : supprime les lignes plus vieilles que
+    max_age_days, puis les plus anciennes tant que le volume stocké dépasse
+    max_total_bytes. Retourne le nombre de lignes supprimées.
+    """
+    max_age_days = AUDIT_RETENTION_DAYS if max_age_days is None else max_age_days
+    max_total_bytes = AUDIT_MAX_TOTAL_BYTES if max_total_bytes is None else max_total_bytes
+    deleted = 0
+    try:
+        with sqlite3.connect(AUDIT_DB_PATH) as conn:
+            if max_age_days and max_age_days > 0:
+                cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat()
+                deleted += conn.execute("DELETE FROM audit_logs WHERE timestamp < ?", (cutoff,)).rowcount
+
+            if max_total_bytes and max_total_bytes > 0:
+                # Parcours du plus récent au plus ancien : on garde ce qui tient dans le budget
+                cursor = conn.execute("""
+                    SELECT id,
+                           COALESCE(LENGTH(stdout), 0) + COALESCE(LENGTH(stderr), 0)
+                         + COALESCE(LENGTH(stdout_z), 0) + COALESCE(LENGTH(stderr_z), 0)
+                         + COALESCE(LENGTH(parsed), 0) + COALESCE(LENGTH(parsed_z), 0)
+                         + COALESCE(LENGTH(command), 0) + COALESCE(LENGTH(executed_command), 0)
+                    FROM audit_logs ORDER BY id DESC
+                """)
+                total = 0
+                cutoff_id = None
+                for row_id, size in cursor:
+                    total += size
+                    if total > max_total_bytes:
+                        cutoff_id = row_id
+                        break
+                if cutoff_id is not None:
+                    deleted += conn.execute("DELETE FROM audit_logs WHERE id <= ?", (cutoff_id,)).rowcount
+
+        if deleted:
+            # Hors transaction : rend les pages libérées au système de fichiers
+            with sqlite3.connect(AUDIT_DB_PATH) as conn:
+                conn.execute("PRAGMA incremental_vacuum")
+    except Exception as e:
+        print(f"CRITICAL: Failed to prune audit log: {e}")
+    return deleted
+
 def get_last_logs(limit=10):
     """Récupère les derniers logs pour l'API /audit."""
     try:
         with sqlite3.connect(AUDIT_DB_PATH) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.execute("SELECT * FROM audit_logs ORDER BY id DESC LIMIT ?", (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+            return [_decode_row(row) for row in cursor.fetchall()]
     except Exception:
         return []
+
+def query_logs(limit=50, before_id=None, since=None, until=None, tool=None,
+               exit_code=None, plan_id=None, include_output=False):
+    """
+    Recherche paginée (keyset sur id décroissant) pour l'API /audit.
+    'since' / 'until' sont des horodatages ISO 8601 comparés lexicalement.
+    Retourne {"logs": [...], "next_cursor": id ou None}.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    clauses, params = [], []
+    if before_id is not None:
+        clauses.append("id < ?")
+        params.append(int(before_id))
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        clauses.append("timestamp < ?")
+        params.append(until)
+    if tool:
+        clauses.append("tool = ?")
+        params.append(tool)
+    if exit_code is not None:
+        clauses.append("exit_code = ?")
+        params.append(int(exit_code))
+    if plan_id:
+        clauses.append("plan_id = ?")
+        params.append(plan_id)
+
+    columns = "*" if include_output else ", ".join(SUMMARY_COLUMNS)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"SELECT {columns} FROM audit_logs {where} ORDER BY id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    with sqlite3.connect(AUDIT_DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(sql, params).fetchall()
+
+    has_more = len(rows) > limit
+    logs = [_decode_row(row) for row in rows[:limit]]
+    return {
+        "logs": logs,
+        "next_cursor": logs[-1]["id"] if has_more else None
+    }
+
+if __name__ == "__main__":
+    # Utilisable en tâche planifiée (cron / systemd timer)
+    init_db()
+    print(f"Pruned {prune_logs()} audit rows from {AUDIT_DB_PATH}")
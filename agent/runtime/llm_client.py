@@ -3,11 +3,13 @@ import requests
 import re
 
 class BaseLLMClient:
-    def chat(self, prompt: str, model: str | None = None) -> str:
+    def chat(self, prompt: str, model: str | None = None, system: str | None = None,
+             format: dict | str | None = None) -> str:
         raise NotImplementedError
 
 class MockLLM(BaseLLMClient):
-    def chat(self, prompt: str, model: str | None = None) -> str:
+    def chat(self, prompt: str, model: str | None = None, system: str | None = None,
+             format: dict | str | None = None) -> str:
         # Simule une réponse instantanée et valide
         return json.dumps({
             "goal": "Vérification des sauvegardes (Mode Mock)",
@@ -24,23 +26,73 @@ class MockLLM(BaseLLMClient):
             ]
         })
 
+    def stream_chat(self, prompt: str, model: str | None = None, system: str | None = None,
+                    format: dict | str | None = None):
+        # Même réponse, découpée comme le ferait une génération en streaming
+        text = self.chat(prompt, model=model, system=system, format=format)
+        for i in range(0, len(text), 16):
+            yield text[i:i + 16]
+
 class OllamaClient(BaseLLMClient):
-    def __init__(self, url: str, model: str):
+    def __init__(self, url: str, model: str, keep_alive: str | None = "30m", num_ctx: int | None = None):
         self.url = url
         self.model = model
+        # keep_alive garde le modèle (et son cache KV) chargé entre deux plans ;
+        # un num_ctx fixe évite un rechargement qui viderait ce cache
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.last_stats = {}
 
-    def chat(self, prompt: str, model: str | None = None) -> str:
+    def _payload(self, prompt, model, system, format, stream):
+        # format : "json" ou un JSON Schema (sortie contrainte côté Ollama)
         payload = {
             "model": model or self.model,
             "prompt": prompt,
-            "stream": False,
-            "format": "json"
+            "stream": stream,
+            "format": format or "json"
         }
+        # Préfixe statique en premier : Ollama réutilise le KV du préfixe commun
+        if system:
+            payload["system"] = system
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        if self.num_ctx:
+            payload["options"] = {"num_ctx": int(self.num_ctx)}
+        return payload
+
+    def _record_stats(self, data):
+        # Coût du prefill : permet de mesurer la réutilisation du préfixe
+        self.last_stats = {k: data.get(k) for k in
+                           ("prompt_eval_count", "prompt_eval_duration", "eval_count", "total_duration")}
+
+    def stream_chat(self, prompt: str, model: str | None = None, system: str | None = None,
+                    format: dict | str | None = None):
+        """Fragments de la réponse au fil de la génération (exceptions propagées)."""
+        payload = self._payload(prompt, model, system, format, stream=True)
+        with requests.post(f"{self.url}/api/generate", json=payload, stream=True, timeout=1800) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    self._record_stats(data)
+                    break
+
+    def chat(self, prompt: str, model: str | None = None, system: str | None = None,
+             format: dict | str | None = None) -> str:
+        payload = self._payload(prompt, model, system, format, stream=False)
         try:
             # Timeout de 180s pour les CPU lents
             r = requests.post(f"{self.url}/api/generate", json=payload, timeout=1800)
             r.raise_for_status()
-            response_data = r.json().get("response", "")
+            data = r.json()
+            self._record_stats(data)
+            response_data = data.get("response", "")
             
             # Nettoyage si le modèle renvoie des balises Markdown
             cleaned = re.sub(r'```json\s*', '', response_data)
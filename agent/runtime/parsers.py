@@ -0,0 +1,169 @@
+import csv
+import io
+import json
+import os
+import re
+import shlex
+import time
+from datetime import datetime
+
+# Registre des parseurs : outil -> [(prédicat sur les arguments, parseur, sans perte)]
+# Le premier prédicat vrai l'emporte. Un parseur reçoit stdout et renvoie
+# une liste d'enregistrements (dicts), ou lève une exception.
+# Seule une sortie "sans perte" (JSON, CSV, séparateur connu) peut remplacer
+# stdout dans l'historique du plan et dans l'audit.
+PARSERS = {}
+PSQL_FOOTER = re.compile(r"^\((\d+) rows?\)$")
+
+def register(tool, when, lossless=False):
+    """Décorateur : associe un parseur à un outil et à un motif d'arguments."""
+    def wrap(func):
+        PARSERS.setdefault(tool, []).append((when, func, lossless))
+        return func
+    return wrap
+
+def _has_option(args, *forms):
+    """Vrai si l'une des formes ('--output=json', ('-f', 'json')...) est présente."""
+    for form in forms:
+        if isinstance(form, tuple):
+            flag, value = form
+            for i, arg in enumerate(args[:-1]):
+                if arg == flag and args[i + 1] == value:
+                    return True
+        elif form in args:
+            return True
+    return False
+
+# ------------------------------------------------------------
+# pgbackrest
+# ------------------------------------------------------------
+@register("pgbackrest", when=lambda args: "info" in args and _has_option(args, "--output=json", ("--output", "json")))
+def parse_pgbackrest_info(stdout):
+    """Une ligne par stanza, avec la dernière sauvegarde et son âge."""
+    records = []
+    now = time.time()
+    for stanza in json.loads(stdout):
+        backups = stanza.get("backup", [])
+        last = backups[-1] if backups else None
+        last_stop = last["timestamp"]["stop"] if last else None
+        records.append({
+            "stanza": stanza.get("name"),
+            "status_code": stanza.get("status", {}).get("code"),
+            "status": stanza.get("status", {}).get("message"),
+            "backup_count": len(backups),
+            "last_backup_label": last.get("label") if last else None,
+            "last_backup_type": last.get("type") if last else None,
+            "last_backup_stop": datetime.fromtimestamp(last_stop).isoformat() if last_stop else None,
+            "last_backup_age_s": int(now - last_stop) if last_stop else None,
+            "last_backup_size": last.get("info", {}).get("size") if last else None,
+            "last_backup_repo_size": last.get("info", {}).get("repository", {}).get("size") if last else None,
+        })
+    return records
+
+# ------------------------------------------------------------
+# patronictl
+# ------------------------------------------------------------
+def _snake(key):
+    return key.strip().lower().replace(" ", "_")
+
+@register("patronictl", when=lambda args: "list" in args and _has_option(
+    args, ("-f", "json"), ("--format", "json"), "--format=json"), lossless=True)
+def parse_patronictl_list(stdout):
+    """Membres du cluster avec des clés normalisées (member, role, state, lag_in_mb...)."""
+    return [{_snake(k): v for k, v in member.items()} for member in json.loads(stdout)]
+
+# ------------------------------------------------------------
+# psql
+# ------------------------------------------------------------
+def _psql_tuples_only(args):
+    return "-t" in args or "--tuples-only" in args
+
+@register("psql", when=lambda args: "--csv" in args, lossless=True)
+def parse_psql_csv(stdout):
+    rows = list(csv.reader(io.StringIO(stdout)))
+    if not rows:
+        return []
+    header, body = rows[0], rows[1:]
+    return [dict(zip(header, row)) for row in body]
+
+def _strip_footer(lines):
+    """
+    Retire le pied de page psql exact ("(3 rows)" / "(1 row)" ; une donnée
+    "(...)" est conservée). Retourne (lignes, nombre de lignes annoncé ou None).
+    """
+    while lines and not lines[-1].strip():
+        lines.pop()
+    match = PSQL_FOOTER.match(lines[-1].strip()) if lines else None
+    if not match:
+        return lines, None
+    lines.pop()
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return lines, int(match.group(1))
+
+def _split_rows(header, body, count, strip=False):
+    """
+    Découpe les lignes sur '|'. Une valeur contenant '|' ou un retour à la
+    ligne fausserait les enregistrements : on lève plutôt que de les rendre
+    (cellules ou lignes en nombre différent de l'en-tête ou du pied de page).
+    """
+    records = []
+    for line in body:
+        cells = line.split("|")
+        if len(cells) != len(header):
+            raise ValueError("Ambiguous psql row: separator or newline inside a value")
+        records.append(dict(zip(header, [c.strip() for c in cells] if strip else cells)))
+    if count is not None and count != len(records):
+        raise ValueError(f"psql announced {count} rows, parsed {len(records)}")
+    return records
+
+@register("psql", when=lambda args: ("-A" in args or "--no-align" in args) and not _psql_tuples_only(args),
+          lossless=True)
+def parse_psql_unaligned(stdout):
+    lines, count = _strip_footer(stdout.splitlines())
+    if not lines:
+        return []
+    header = lines[0].split("|")
+    return _split_rows(header, lines[1:], count)
+
+@register("psql", when=lambda args: "-c" in args or "--command" in args or any(a.startswith("--command=") for a in args))
+def parse_psql_aligned(stdout):
+    """Sortie alignée par défaut : en-tête, ligne de tirets, colonnes séparées par ' | '."""
+    lines = stdout.splitlines()
+    sep_index = next((i for i, l in enumerate(lines) if l and set(l.strip()) <= set("-+") and "-" in l), None)
+    if sep_index is None or sep_index == 0:
+        raise ValueError("Not an aligned psql table")
+    header = [h.strip() for h in lines[sep_index - 1].split("|")]
+    body, count = _strip_footer(lines[sep_index + 1:])
+    if count is None:
+        raise ValueError("Aligned psql table without row count footer")
+    return _split_rows(header, body, count, strip=True)
+
+def rows_to_records(columns, rows):
+    """Résultat du pool SQL (columns/rows) -> enregistrements."""
+    return [dict(zip(columns, row)) for row in rows]
+
+def parse_output(command, stdout):
+    """
+    Applique le parseur correspondant à la commande.
+    Retourne {"parser": nom, "records": [...], "lossless": bool} ou None (pas
+    de parseur, sortie vide ou illisible : le stdout brut reste la référence).
+    """
+    if not stdout or not stdout.strip():
+        return None
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return None
+    if not args:
+        return None
+    tool, args = os.path.basename(args[0]), args[1:]
+    if _psql_tuples_only(args) and tool == "psql":
+        return None  # Sans en-tête, pas de noms de colonnes fiables
+    for when, parser, lossless in PARSERS.get(tool, []):
+        if when(args):
+            try:
+                return {"parser": parser.__name__, "records": parser(stdout), "lossless": lossless}
+            except Exception:
+                return None
+    return None
@@ -0,0 +1,50 @@
+import hashlib
+import json
+import re
+import threading
+
+from runtime.discovery import load_config
+from runtime.result_cache import ResultCache
+
+DEFAULT_TTL = 300  # secondes
+DEFAULT_MAX_ENTRIES = 128
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_settings():
+    """Section 'plan_cache' de config.json."""
+    cfg = load_config().get("plan_cache", {})
+    return {
+        "enabled": bool(cfg.get("enabled", True)),
+        "ttl": float(cfg.get("ttl", DEFAULT_TTL)),
+        "max_entries": int(cfg.get("max_entries", DEFAULT_MAX_ENTRIES)),
+    }
+
+def get_plan_cache():
+    """Cache des plans validés, créé au premier usage (None si désactivé)."""
+    global _cache
+    settings = get_settings()
+    if not settings["enabled"]:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(max_entries=settings["max_entries"])
+        return _cache
+
+def normalize_question(question):
+    """Casse, espaces et ponctuation finale n'influencent pas la clé."""
+    text = re.sub(r"\s+", " ", (question or "").strip().lower())
+    return text.rstrip(" ?!.")
+
+def plan_cache_key(question, mode, rag_context, registry_fingerprint, pg_version="unknown"):
+    """
+    Clé : question normalisée + mode + empreinte du contexte RAG + empreinte
+    des binaires du registry. Un refresh du registry invalide donc les plans.
+    """
+    if not isinstance(rag_context, str):
+        rag_context = json.dumps(rag_context, sort_keys=True, default=str)
+    rag_hash = hashlib.sha256((rag_context or "").encode("utf-8")).hexdigest()
+    material = "\x1f".join([normalize_question(question), mode or "", pg_version or "",
+                            rag_hash, registry_fingerprint or ""])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
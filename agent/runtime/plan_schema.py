@@ -0,0 +1,106 @@
+import os
+import shlex
+
+# Sous-ensemble de JSON Schema envoyé à Ollama (champ 'format') et vérifié
+# localement par validate() : type, properties, required, items, enum.
+ON_ERROR_VALUES = ["continue", "abort"]
+
+STEP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": ["string", "integer"]},
+        "tool": {"type": "string"},
+        "args": {"type": "array", "items": {"type": "string"}},
+        "intent": {"type": "string"},
+        "on_error": {"type": "string", "enum": ON_ERROR_VALUES},
+        "depends_on": {"type": "array", "items": {"type": ["string", "integer"]}},
+    },
+    "required": ["id", "tool", "args"],
+}
+
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "goal": {"type": "string"},
+        "steps": {"type": "array", "items": STEP_SCHEMA},
+    },
+    "required": ["goal", "steps"],
+}
+
+_TYPES = {
+    "object": dict, "array": list, "string": str,
+    "integer": int, "number": (int, float), "boolean": bool,
+}
+
+def step_schema(tools=None):
+    """Schéma d'une étape ; 'tools' restreint le champ tool aux binaires connus."""
+    schema = {**STEP_SCHEMA, "properties": dict(STEP_SCHEMA["properties"])}
+    if tools:
+        schema["properties"]["tool"] = {"type": "string", "enum": sorted(tools)}
+    return schema
+
+def plan_schema(tools=None):
+    return {**PLAN_SCHEMA, "properties": {**PLAN_SCHEMA["properties"],
+                                          "steps": {"type": "array", "items": step_schema(tools)}}}
+
+def _type_ok(value, expected):
+    expected = expected if isinstance(expected, list) else [expected]
+    for name in expected:
+        # bool est un int en Python : on ne l'accepte pas comme entier
+        if isinstance(value, _TYPES[name]) and not (isinstance(value, bool) and name != "boolean"):
+            return True
+    return False
+
+def validate(value, schema, path=()):
+    """Retourne la liste des erreurs [(chemin, message)] ; vide si conforme."""
+    if "type" in schema and not _type_ok(value, schema["type"]):
+        return [(path, f"expected {schema['type']}")]
+    if "enum" in schema and value not in schema["enum"]:
+        return [(path, f"must be one of {schema['enum']}")]
+    errors = []
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append((path + (key,), "required"))
+        for key, sub in schema.get("properties", {}).items():
+            if key in value:
+                errors += validate(value[key], sub, path + (key,))
+    elif isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            errors += validate(item, schema["items"], path + (i,))
+    return errors
+
+def repair_step(step, index):
+    """
+    Corrections locales sans rappel au LLM : args en chaîne, valeurs non
+    textuelles, chemin complet de l'outil, on_error inconnu, id manquant.
+    """
+    if not isinstance(step, dict):
+        return step
+    if isinstance(step.get("args"), str):
+        try:
+            step["args"] = shlex.split(step["args"])
+        except ValueError:
+            step["args"] = step["args"].split()
+    elif "args" not in step:
+        step["args"] = []
+    if isinstance(step.get("args"), list):
+        step["args"] = [a if isinstance(a, str) else str(a) for a in step["args"]]
+    if isinstance(step.get("tool"), str):
+        step["tool"] = os.path.basename(step["tool"].strip())
+    if "on_error" in step and step["on_error"] not in ON_ERROR_VALUES:
+        step["on_error"] = "abort" if str(step["on_error"]).lower() in ("stop", "fail", "abort") else "continue"
+    if "id" not in step:
+        step["id"] = f"step_{index}"
+    if isinstance(step.get("depends_on"), (str, int)) and not isinstance(step.get("depends_on"), bool):
+        step["depends_on"] = [step["depends_on"]]
+    return step
+
+def repair_plan(plan):
+    """Répare le plan en place ; goal/steps manquants reçoivent une valeur neutre."""
+    if not isinstance(plan.get("goal"), str):
+        plan["goal"] = str(plan.get("goal") or "")
+    if not isinstance(plan.get("steps"), list):
+        plan["steps"] = []
+    plan["steps"] = [repair_step(step, i) for i, step in enumerate(plan["steps"])]
+    return plan
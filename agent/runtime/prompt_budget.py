@@ -0,0 +1,160 @@
+import os
+import re
+import logging
+import threading
+
+# tokenizers est optionnel : sans lui, estimation à ~4 caractères par token
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+from runtime.discovery import load_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKENIZER = "/opt/pgagent/config/tokenizer.json"
+MAX_PROMPT_TOKENS = 3000
+MAX_TOOLS = 4
+TOOL_HELP_TOKENS = 200
+RAG_TOKENS = 1200
+CHARS_PER_TOKEN = 4
+RAG_SEPARATOR = "\n---\n"  # Séparateur des chunks produit par l'agence
+
+_tokenizer = {"loaded": False, "instance": None}
+_tokenizer_lock = threading.Lock()
+
+def get_settings():
+    """Section 'prompt_budget' de config.json."""
+    cfg = load_config().get("prompt_budget", {})
+    return {
+        "tokenizer": cfg.get("tokenizer", DEFAULT_TOKENIZER),
+        "max_prompt_tokens": int(cfg.get("max_prompt_tokens", MAX_PROMPT_TOKENS)),
+        "max_tools": int(cfg.get("max_tools", MAX_TOOLS)),
+        "tool_help_tokens": int(cfg.get("tool_help_tokens", TOOL_HELP_TOKENS)),
+        "rag_tokens": int(cfg.get("rag_tokens", RAG_TOKENS)),
+    }
+
+def get_tokenizer():
+    """
+    Tokenizer du modèle (fichier tokenizer.json local, ou dossier le contenant),
+    chargé une seule fois. Jamais de téléchargement : l'agent peut être sans
+    accès réseau. None si indisponible : on retombe sur l'estimation.
+    """
+    with _tokenizer_lock:
+        if not _tokenizer["loaded"]:
+            _tokenizer["loaded"] = True
+            source = get_settings()["tokenizer"]
+            if source and os.path.isdir(source):
+                source = os.path.join(source, "tokenizer.json")
+            if Tokenizer is not None and source and not os.path.isfile(source):
+                logger.info(f"Tokenizer file '{source}' not found, using char estimate")
+            elif Tokenizer is not None and source:
+                try:
+                    _tokenizer["instance"] = Tokenizer.from_file(source)
+                except Exception as e:
+                    logger.warning(f"Tokenizer '{source}' unavailable ({e}), using char estimate")
+        return _tokenizer["instance"]
+
+def count_tokens(text):
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+def truncate_to_tokens(text, max_tokens):
+    """Coupe le texte à max_tokens tokens (frontière de token exacte si possible)."""
+    if not text or max_tokens <= 0:
+        return ""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    encoding = tokenizer.encode(text, add_special_tokens=False)
+    if len(encoding.ids) <= max_tokens:
+        return text
+    return text[:encoding.offsets[max_tokens - 1][1]]
+
+# ------------------------------------------------------------
+# Sélection des aides d'outils
+# ------------------------------------------------------------
+def _words(text):
+    return set(re.findall(r"[a-z0-9_]{3,}", (text or "").lower()))
+
+def rank_tools(question, tools_help, max_tools=MAX_TOOLS):
+    """
+    Classe les aides d'outils par pertinence pour la question : outil cité
+    nommément, puis recouvrement lexical question / aide. Les outils sans
+    aucun rapport sont écartés.
+    """
+    question_lower = (question or "").lower()
+    question_words = _words(question)
+    scored = []
+    for name, help_text in tools_help.items():
+        score = len(question_words & _words(help_text))
+        if name.lower() in question_lower:
+            score += 100
+        if score > 0:
+            scored.append((score, name))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [name for _, name in scored[:max_tools]]
+
+# ------------------------------------------------------------
+# Contexte RAG
+# ------------------------------------------------------------
+def _rag_chunks(rag_context):
+    """Chunks (texte, score) : liste de dicts rerankés ou texte de l'agence."""
+    if isinstance(rag_context, list):
+        chunks = []
+        for chunk in rag_context:
+            if isinstance(chunk, dict):
+                text = chunk.get("text") or chunk.get("content") or ""
+                chunks.append((text, float(chunk.get("score", 0.0))))
+            else:
+                chunks.append((str(chunk), 0.0))
+        return sorted(chunks, key=lambda c: -c[1])
+    # Texte : les chunks arrivent déjà triés par l'agence
+    return [(part, 0.0) for part in str(rag_context or "").split(RAG_SEPARATOR) if part.strip()]
+
+def trim_rag_context(rag_context, max_tokens=RAG_TOKENS):
+    """Garde les meilleurs chunks dans le budget ; le dernier peut être tronqué."""
+    kept = []
+    remaining = max_tokens
+    for text, _ in _rag_chunks(rag_context):
+        if remaining <= 0:
+            break
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            text = truncate_to_tokens(text, remaining)
+            tokens = remaining
+        kept.append(text)
+        remaining -= tokens
+    return RAG_SEPARATOR.join(kept)
+
+def budget_prompt_parts(question, tools_help, rag_context, settings=None, reserved_tokens=0):
+    """
+    Réduit les parties variables du prompt au budget configuré ;
+    reserved_tokens (préfixe système statique) est déduit du plafond global.
+    Retourne (aides retenues, contexte RAG réduit, statistiques en tokens).
+    """
+    settings = settings or get_settings()
+    selected = {}
+    help_tokens = 0
+    for name in rank_tools(question, tools_help, settings["max_tools"]):
+        text = truncate_to_tokens(tools_help[name], settings["tool_help_tokens"])
+        selected[name] = text
+        help_tokens += count_tokens(text)
+
+    # Le RAG ne prend que ce qui reste sous le plafond global
+    rag_budget = min(settings["rag_tokens"],
+                     max(0, settings["max_prompt_tokens"] - reserved_tokens - help_tokens))
+    rag = trim_rag_context(rag_context, rag_budget)
+    stats = {
+        "tools_total": len(tools_help),
+        "tools_selected": len(selected),
+        "tool_help_tokens": help_tokens,
+        "rag_tokens": count_tokens(rag),
+        "tokenizer": "tokenizers" if get_tokenizer() is not None else "chars/4",
+    }
+    return selected, rag, stats
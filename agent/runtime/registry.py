@@ -1,5 +1,7 @@
 import json
 import os
+import hashlib
+import threading
 # Import absolu pour la structure v1.2.1
 from runtime.discovery import discover_binaries
 
@@ -9,23 +11,51 @@ REGISTRY_FILE = "/opt/pgagent/runtime/registry.json"
 if not os.path.exists("/opt/pgagent"):
     REGISTRY_FILE = os.path.join(os.path.dirname(__file__), "registry.json")
 
+# Cache mémoire du fichier, invalidé par son mtime (un stat par appel)
+_cache = {"mtime": None, "data": None, "fingerprint": None}
+_cache_lock = threading.Lock()
+
+def _fingerprint(data):
+    """Empreinte stable des binaires résolus (nom -> chemin)."""
+    binaries = json.dumps(data.get("binaries", {}), sort_keys=True)
+    return hashlib.sha256(binaries.encode("utf-8")).hexdigest()[:16]
+
 def refresh_registry():
     """Scanne et force la mise à jour du fichier registry.json."""
     data = discover_binaries()
     os.makedirs(os.path.dirname(REGISTRY_FILE), exist_ok=True)
     with open(REGISTRY_FILE, "w") as f:
         json.dump(data, f, indent=4)
+    with _cache_lock:
+        _cache.update(mtime=os.stat(REGISTRY_FILE).st_mtime_ns, data=data, fingerprint=_fingerprint(data))
     return data
 
 def get_registry():
-    """Retourne le contenu complet du registry pour l'agence."""
-    if not os.path.exists(REGISTRY_FILE):
+    """
+    Retourne le contenu complet du registry pour l'agence.
+    Le dictionnaire est partagé (cache) : ne pas le modifier.
+    """
+    try:
+        mtime = os.stat(REGISTRY_FILE).st_mtime_ns
+    except FileNotFoundError:
         return refresh_registry()
+    with _cache_lock:
+        if _cache["mtime"] == mtime:
+            return _cache["data"]
     try:
         with open(REGISTRY_FILE, "r") as f:
-            return json.load(f)
+            data = json.load(f)
     except Exception:
         return {"binaries": {}}
+    with _cache_lock:
+        _cache.update(mtime=mtime, data=data, fingerprint=_fingerprint(data))
+    return data
+
+def get_registry_fingerprint():
+    """Empreinte des binaires du registry courant (change à chaque refresh utile)."""
+    get_registry()
+    with _cache_lock:
+        return _cache["fingerprint"]
 
 def get_binary_path(tool_name):
     """Récupère le chemin d'un binaire depuis le registry."""
@@ -0,0 +1,68 @@
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_TTL = 5  # secondes
+
+
+class ResultCache:
+    """
+    Cache LRU à durée de vie pour les résultats de commandes en lecture seule.
+    Borné en nombre d'entrées et en volume (taille JSON des résultats).
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # clé -> (expiration, taille, résultat)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Retourne une copie du résultat encore valide, sinon None."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._evict(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[2])
+
+    def put(self, key, result, ttl=DEFAULT_TTL):
+        size = len(json.dumps(result, default=str))
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self._evict(key)
+            self.entries[key] = (time.monotonic() + ttl, size, copy.deepcopy(result))
+            self.total_bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                self._evict(next(iter(self.entries)))
+
+    def _evict(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,133 @@
+"""
+Processus auxiliaire exécuté À L'INTÉRIEUR d'un sandbox bwrap déjà créé.
+Il reçoit des argv sur un socket (fd hérité), exécute chaque commande dans
+ce namespace et renvoie le résultat. Voir runtime/sandbox_pool.py.
+
+Protocole : messages JSON préfixés par leur longueur (4 octets big-endian).
+  requête  : {"argv": [...], "timeout": 45, "max_bytes": 1048576}
+  réponse  : {"stdout": "...", "stderr": "...", "exit_code": 0, "truncated": false}
+
+La sortie est lue au fil de l'eau et plafonnée à max_bytes par flux (le
+reste est drainé sans être conservé), comme executor.stream_command.
+Chaque commande reçoit son propre TMPDIR, supprimé ensuite.
+
+Volontairement limité à la stdlib : il tourne avec le python3 du système.
+"""
+import json
+import os
+import selectors
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+HEADER = struct.Struct(">I")
+TRUNCATION_MARKER = "\n... [output truncated after {} bytes] ...\n"
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def recv_exact(sock, size):
+    buf = b""
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+def recv_message(sock):
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    body = recv_exact(sock, HEADER.unpack(header)[0])
+    return json.loads(body) if body is not None else None
+
+def send_message(sock, payload):
+    body = json.dumps(payload).encode("utf-8")
+    sock.sendall(HEADER.pack(len(body)) + body)
+
+def cap(raw, truncated, max_bytes):
+    text = bytes(raw).decode("utf-8", errors="ignore" if truncated else "replace")
+    return text + TRUNCATION_MARKER.format(max_bytes) if truncated else text
+
+def read_capped(process, deadline, max_bytes, kept, truncated):
+    """Lit stdout/stderr jusqu'à EOF en ne gardant que max_bytes par flux."""
+    sel = selectors.DefaultSelector()
+    sel.register(process.stdout, selectors.EVENT_READ, "stdout")
+    sel.register(process.stderr, selectors.EVENT_READ, "stderr")
+    try:
+        while sel.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(process.args, remaining)
+            for key, _ in sel.select(timeout=remaining):
+                data = os.read(key.fileobj.fileno(), READ_CHUNK_SIZE)
+                if not data:
+                    sel.unregister(key.fileobj)
+                    continue
+                buf = kept[key.data]
+                room = max_bytes - len(buf)
+                if room > 0:
+                    buf += data[:room]
+                if len(data) > room:
+                    truncated[key.data] = True
+    finally:
+        sel.close()
+
+def execute(request):
+    timeout = request.get("timeout", 45)
+    max_bytes = request.get("max_bytes", 1024 * 1024)
+    tmpdir = tempfile.mkdtemp(prefix="pgagent-")
+    try:
+        process = subprocess.Popen(
+            request["argv"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=dict(os.environ, TMPDIR=tmpdir),
+            start_new_session=True
+        )
+    except Exception as e:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return {"stdout": "", "stderr": str(e), "exit_code": -1}
+
+    kept = {"stdout": bytearray(), "stderr": bytearray()}
+    truncated = {"stdout": False, "stderr": False}
+    deadline = time.monotonic() + timeout
+    suffix = ""
+    try:
+        read_capped(process, deadline, max_bytes, kept, truncated)
+        exit_code = process.wait(timeout=max(deadline - time.monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        exit_code = 124
+        suffix = f"\nError: Process timed out ({timeout:g}s)"
+    finally:
+        process.stdout.close()
+        process.stderr.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {
+        "stdout": cap(kept["stdout"], truncated["stdout"], max_bytes),
+        "stderr": cap(kept["stderr"], truncated["stderr"], max_bytes) + suffix,
+        "exit_code": exit_code,
+        "truncated": truncated["stdout"] or truncated["stderr"]
+    }
+
+def main():
+    fd = int(sys.argv[sys.argv.index("--fd") + 1])
+    sock = socket.socket(fileno=fd)
+    # Signal "prêt" : le namespace est monté et l'interpréteur chargé
+    send_message(sock, {"ready": True})
+    while True:
+        request = recv_message(sock)
+        if request is None:
+            break
+        send_message(sock, execute(request))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+import queue
+import select
+import socket
+import subprocess
+import threading
+import time
+import logging
+
+from runtime.sandbox_helper import send_message, recv_message
+
+HELPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_helper.py")
+# Interpréteur disponible dans le sandbox (seul /usr est monté, pas de venv)
+SANDBOX_PYTHON = os.environ.get("AGENT_SANDBOX_PYTHON", "/usr/bin/python3")
+
+POOL_SIZE = int(os.environ.get("AGENT_SANDBOX_POOL_SIZE", 2))
+# Un helper est recyclé après N commandes (état résiduel dans /tmp, fuites...)
+POOL_MAX_USES = int(os.environ.get("AGENT_SANDBOX_POOL_MAX_USES", 50))
+SPAWN_TIMEOUT = 10   # secondes pour qu'un helper signale qu'il est prêt
+REPLY_GRACE = 5      # marge au-delà du timeout de la commande
+CANCEL_POLL_INTERVAL = 0.2
+
+logger = logging.getLogger(__name__)
+
+
+class SandboxHelperError(RuntimeError):
+    """Le helper n'a pas répondu correctement (il est alors détruit)."""
+
+
+class SandboxUnavailable(SandboxHelperError):
+    """Aucun helper n'a pu démarrer : la commande n'a pas été envoyée."""
+
+
+class SandboxHelper:
+    """Un namespace bwrap déjà créé, piloté via un socketpair."""
+
+    def __init__(self, bwrap_prefix):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        argv = list(bwrap_prefix) + [SANDBOX_PYTHON, HELPER_PATH, "--fd", str(child.fileno())]
+        self.process = subprocess.Popen(
+            argv,
+            pass_fds=(child.fileno(),),
+            stdin=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        child.close()
+        self.sock = parent
+        self.uses = 0
+        self.sock.settimeout(SPAWN_TIMEOUT)
+        try:
+            ready = recv_message(self.sock)
+        except OSError as e:
+            ready = None
+            logger.warning(f"Sandbox helper failed to start: {e}")
+        if not ready or not ready.get("ready"):
+            self.kill()
+            raise SandboxHelperError("Sandbox helper did not start")
+
+    def run(self, argv, timeout, max_bytes, cancel_event=None):
+        self.uses += 1
+        deadline = time.monotonic() + timeout + REPLY_GRACE
+        try:
+            self.sock.settimeout(None)
+            send_message(self.sock, {"argv": argv, "timeout": timeout, "max_bytes": max_bytes})
+            # Attente de la réponse en surveillant l'annulation
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SandboxHelperError("Sandbox helper reply timed out")
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                readable, _, _ = select.select([self.sock], [], [], min(remaining, CANCEL_POLL_INTERVAL))
+                if readable:
+                    break
+            self.sock.settimeout(remaining)
+            reply = recv_message(self.sock)
+        except OSError as e:
+            raise SandboxHelperError(str(e))
+        if reply is None:
+            raise SandboxHelperError("Sandbox helper closed the connection")
+        return reply
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        try:
+            self.sock.close()
+        finally:
+            if self.process.poll() is None:
+                # Tuer le helper (PID 1 du namespace) emporte ses enfants
+                self.process.kill()
+                self.process.wait()
+
+
+class SandboxPool:
+    """
+    Pool de helpers pré-lancés. Chaque commande réutilise un namespace déjà
+    monté au lieu de payer un 'bwrap --unshare-all' complet.
+    """
+
+    def __init__(self, bwrap_prefix, bind_dirs=(), size=POOL_SIZE, max_uses=POOL_MAX_USES):
+        self.bwrap_prefix = list(bwrap_prefix)
+        self.bind_dirs = set(bind_dirs)  # Dossiers de binaires montés dans les helpers
+        self.size = size
+        self.max_uses = max_uses
+        self.idle = queue.LifoQueue()
+        self.closed = False
+        for _ in range(size):
+            self._spawn_async()
+
+    def _spawn(self):
+        try:
+            helper = SandboxHelper(self.bwrap_prefix)
+        except Exception as e:
+            logger.warning(f"Sandbox pool spawn failed: {e}")
+            return
+        if self.closed:
+            helper.kill()
+        else:
+            self.idle.put(helper)
+
+    def _spawn_async(self):
+        # Pré-fork hors du chemin critique de la requête
+        threading.Thread(target=self._spawn, daemon=True).start()
+
+    def _acquire(self):
+        try:
+            helper = self.idle.get_nowait()
+            if helper.alive():
+                return helper
+            helper.kill()
+            self._spawn_async()
+        except queue.Empty:
+            pass
+        # Pool vide (démarrage, rafale) : lancement synchrone
+        try:
+            return SandboxHelper(self.bwrap_prefix)
+        except Exception as e:
+            raise SandboxUnavailable(str(e))
+
+    def _release(self, helper):
+        if self.closed or helper.uses >= self.max_uses or not helper.alive():
+            helper.kill()
+            if not self.closed:
+                self._spawn_async()
+            return
+        if self.idle.qsize() >= self.size:
+            helper.kill()
+            return
+        self.idle.put(helper)
+
+    def run(self, argv, timeout, max_bytes, cancel_event=None):
+        """
+        Exécute argv dans un helper chaud. Retourne la réponse du helper,
+        ou None si cancel_event a été positionné (le helper est alors tué).
+        Lève SandboxUnavailable si aucun helper ne démarre (rien n'a été
+        exécuté : l'appelant peut repasser par bwrap).
+        """
+        helper = self._acquire()
+        try:
+            reply = helper.run(argv, timeout, max_bytes, cancel_event)
+        except SandboxHelperError:
+            helper.kill()
+            self._spawn_async()
+            raise
+        if reply is None:
+            helper.kill()
+            self._spawn_async()
+            return None
+        self._release(helper)
+        return reply
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().kill()
+            except queue.Empty:
+                break
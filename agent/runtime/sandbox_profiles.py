@@ -0,0 +1,90 @@
+import os
+import shutil
+import threading
+
+from runtime.registry import get_registry, get_registry_fingerprint
+
+PG_SOCKET_DIR = "/var/run/postgresql"
+
+# Montages communs à tous les outils (lecture seule)
+BASE_RO_BINDS = ["/usr", "/bin", "/lib", "/lib64", "/etc", "/usr/bin"]
+
+# Montages propres à chaque outil : (option bwrap, chemin). Ajoutés
+# seulement si le chemin existe au moment de la compilation du profil.
+TOOL_EXTRA_BINDS = {
+    "pgbackrest": [
+        ("--ro-bind", "/etc/pgbackrest"),
+        ("--ro-bind", "/var/lib/pgbackrest"),
+    ],
+    "patronictl": [("--ro-bind", "/etc/patroni")],
+    "patroni": [("--ro-bind", "/etc/patroni")],
+    "repmgr": [("--ro-bind", "/etc/repmgr")],
+}
+
+# Profils compilés : nom d'outil -> {"path": ..., "argv_prefix": [...]}
+_compiled = {"fingerprint": None, "profiles": {}}
+_lock = threading.Lock()
+
+def bwrap_prefix(bind_dirs, extra_binds=(), ro_binds=None) -> list:
+    """
+    Arguments bwrap communs à toutes les exécutions isolées.
+    bind_dirs : dossiers supplémentaires montés en lecture seule (binaires).
+    extra_binds : montages propres à l'outil, [(option, chemin)].
+    ro_binds : remplace BASE_RO_BINDS pour un profil plus restreint.
+    """
+    cmd = [
+        "bwrap",
+        "--unshare-all",
+        "--die-with-parent",
+        "--new-session",
+        "--proc", "/proc",
+        "--dev", "/dev",
+    ]
+    for path in (BASE_RO_BINDS if ro_binds is None else ro_binds):
+        cmd += ["--ro-bind", path, path]
+    for bind_dir in bind_dirs:
+        cmd += ["--ro-bind", bind_dir, bind_dir]  # Autorise le dossier spécifique du binaire
+    for option, path in extra_binds:
+        cmd += [option, path, path]
+    cmd += ["--tmpfs", "/tmp"]
+
+    # Montage du socket PostgreSQL pour permettre la connexion locale (UDS)
+    if os.path.exists(PG_SOCKET_DIR):
+        cmd += ["--ro-bind", PG_SOCKET_DIR, PG_SOCKET_DIR]
+    return cmd
+
+def compile_profile(tool_name, path):
+    """Précalcule le préfixe argv bwrap complet d'un outil."""
+    extra = [(opt, p) for opt, p in TOOL_EXTRA_BINDS.get(tool_name, []) if os.path.exists(p)]
+    return {
+        "path": path,
+        "argv_prefix": bwrap_prefix([os.path.dirname(path)], extra)
+    }
+
+def compile_profiles(binaries):
+    """Compile un profil par binaire du registry."""
+    return {name: compile_profile(name, path) for name, path in binaries.items()}
+
+def get_profile(tool_name):
+    """
+    Profil sandbox d'un outil. Les profils sont recompilés uniquement quand
+    l'empreinte du registry change ; un outil hors registry est résolu via
+    le PATH une fois puis mis en cache. Retourne None si introuvable.
+    """
+    registry = get_registry()
+    fingerprint = get_registry_fingerprint()
+    with _lock:
+        if _compiled["fingerprint"] != fingerprint:
+            _compiled["profiles"] = compile_profiles(registry.get("binaries", {}))
+            _compiled["fingerprint"] = fingerprint
+        profile = _compiled["profiles"].get(tool_name)
+    if profile is not None:
+        return profile
+
+    resolved = shutil.which(tool_name)
+    if not resolved:
+        return None
+    profile = compile_profile(os.path.basename(resolved), resolved)
+    with _lock:
+        _compiled["profiles"][tool_name] = profile
+    return profile
@@ -0,0 +1,246 @@
+import os
+import threading
+import logging
+import datetime
+import decimal
+
+# psycopg2 est optionnel : sans lui, les étapes psql passent par le sous-processus
+try:
+    import psycopg2
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+from runtime.audit import log_execution
+from runtime.parsers import rows_to_records
+from runtime.discovery import load_config
+
+logger = logging.getLogger(__name__)
+
+SQL_POOL_SIZE = 4
+MAX_POOLS = 8  # Un pool par cible (-h/-U/-d...) : nombre borné
+STATEMENT_TIMEOUT_MS = 15000
+MAX_ROWS = 1000
+EXIT_CODE_SQL_ERROR = 1  # psql renvoie 1 sur erreur SQL (ON_ERROR_STOP)
+EXIT_CODE_CANCELLED = 130  # Même convention que l'executor
+
+# Options psql compatibles avec une exécution via le pool.
+# Toute autre option (\copy, -f, -v...) => repli sur le binaire psql.
+CONN_FLAGS = {
+    "-d": "dbname", "--dbname": "dbname",
+    "-U": "user", "--username": "user",
+    "-h": "host", "--host": "host",
+    "-p": "port", "--port": "port",
+}
+SQL_FLAGS = {"-c", "--command"}
+FORMAT_FLAGS = {"-A", "--no-align", "-t", "--tuples-only", "-X", "--no-psqlrc",
+                "-q", "--quiet", "-w", "--no-password"}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_settings():
+    """Section 'sql_pool' de config.json (AGENT_SQL_POOL=1 force l'activation)."""
+    cfg = load_config().get("sql_pool", {})
+    enabled = cfg.get("enabled", False) or os.environ.get("AGENT_SQL_POOL") == "1"
+    return {
+        "enabled": bool(enabled) and psycopg2 is not None,
+        "size": int(cfg.get("size", SQL_POOL_SIZE)),
+        "max_pools": int(cfg.get("max_pools", MAX_POOLS)),
+        "statement_timeout_ms": int(cfg.get("statement_timeout_ms", STATEMENT_TIMEOUT_MS)),
+        "defaults": {k: cfg[k] for k in ("host", "port", "user", "dbname") if cfg.get(k)},
+    }
+
+def has_multiple_statements(sql):
+    """
+    True si le SQL contient un ';' hors chaînes/commentaires suivi d'autre chose :
+    un 'COMMIT; SET ...' sortirait de la transaction en lecture seule.
+    """
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch in ("'", '"'):
+            end = sql.find(ch, i + 1)
+            while end != -1 and sql[end + 1:end + 2] == ch:  # '' ou "" échappés
+                end = sql.find(ch, end + 2)
+            if end == -1:
+                return True  # Chaîne non fermée : on laisse psql trancher
+            i = end + 1
+        elif sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = n if end == -1 else end + 1
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            if end == -1:
+                return True
+            i = end + 2
+        elif ch == "$":
+            tag_end = sql.find("$", i + 1)
+            tag = sql[i:tag_end + 1] if tag_end != -1 else ""
+            if tag and (tag == "$$" or tag[1:-1].replace("_", "a").isalnum()) and not tag[1].isdigit():
+                end = sql.find(tag, tag_end + 1)
+                if end == -1:
+                    return True
+                i = end + len(tag)
+            else:
+                i += 1
+        elif ch == ";":
+            return sql[i + 1:].strip() != ""
+        else:
+            i += 1
+    return False
+
+def parse_psql_args(args):
+    """
+    Analyse les arguments d'une étape psql.
+    Retourne {"sql", "conn", "tuples_only"} si l'étape se résume à un
+    unique -c avec des options de connexion/format, sinon None.
+    """
+    sql = None
+    conn = {}
+    tuples_only = False
+    args = [str(a) for a in args]
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        flag, _, inline = arg.partition("=") if arg.startswith("--") else (arg, "", "")
+        if flag in SQL_FLAGS or flag in CONN_FLAGS:
+            if inline:
+                value = inline
+            elif i + 1 < len(args):
+                i += 1
+                value = args[i]
+            else:
+                return None
+            if flag in SQL_FLAGS:
+                if sql is not None:
+                    return None  # Plusieurs -c : on laisse psql gérer
+                sql = value
+            else:
+                conn[CONN_FLAGS[flag]] = value
+        elif arg in FORMAT_FLAGS:
+            tuples_only = tuples_only or arg in ("-t", "--tuples-only")
+        else:
+            return None
+        i += 1
+    if not sql or sql.lstrip().startswith("\\"):
+        return None  # Méta-commandes psql (\dt...) non supportées
+    if has_multiple_statements(sql):
+        return None  # Plusieurs requêtes : jamais sur une connexion du pool
+    return {"sql": sql, "conn": conn, "tuples_only": tuples_only}
+
+def _get_pool(conn_params, settings):
+    key = tuple(sorted(conn_params.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if len(_pools) >= settings["max_pools"]:
+                raise RuntimeError(f"too many SQL pools ({len(_pools)})")
+            pool = psycopg2.pool.ThreadedConnectionPool(
+                0, settings["size"],
+                application_name="pgagent",
+                options=(
+                    "-c default_transaction_read_only=on "
+                    f"-c statement_timeout={settings['statement_timeout_ms']}"
+                ),
+                **conn_params
+            )
+            _pools[key] = pool
+        return pool
+
+def _jsonable(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time, datetime.timedelta)):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return value
+    return str(value)
+
+def render_unaligned(columns, rows, tuples_only=False):
+    """Rendu texte façon 'psql -A' pour les consommateurs de stdout."""
+    lines = [] if tuples_only else ["|".join(columns)]
+    for row in rows:
+        lines.append("|".join("" if v is None else str(v) for v in row))
+    if not tuples_only:
+        lines.append(f"({len(rows)} row{'s' if len(rows) != 1 else ''})")
+    return "\n".join(lines) + "\n"
+
+def run_sql(command, parsed, plan_id=None, timeout=None, cancel_event=None):
+    """
+    Exécute le SQL d'une étape psql sur une connexion du pool (lecture seule).
+    Retourne un résultat au format run_command enrichi de 'columns'/'rows',
+    ou None si la connexion est impossible (l'appelant repasse par psql).
+    """
+    settings = get_settings()
+    conn_params = dict(settings["defaults"], **parsed["conn"])
+    try:
+        pool = _get_pool(conn_params, settings)
+        conn = pool.getconn()
+    except Exception as e:
+        logger.warning(f"SQL pool unavailable ({e}), falling back to psql")
+        return None
+
+    executed = "sql-pool " + " ".join(f"{k}={v}" for k, v in sorted(conn_params.items()))
+    timeout_ms = settings["statement_timeout_ms"]
+    if timeout is not None:
+        timeout_ms = max(1, min(timeout_ms, int(timeout * 1000)))
+
+    # Annulation du plan => annulation de la requête côté serveur
+    done = threading.Event()
+    if cancel_event is not None:
+        def watch():
+            while not done.wait(0.2):
+                if cancel_event.is_set():
+                    conn.cancel()
+                    return
+        threading.Thread(target=watch, daemon=True).start()
+
+    result = {"stdout": "", "stderr": "", "exit_code": 0, "command_executed": executed}
+    broken = False
+    try:
+        conn.set_session(readonly=True, autocommit=False)
+        with conn.cursor() as cur:
+            # Un SELECT fige le snapshot : plus de 'SET transaction_read_only = off' possible
+            # (une seule requête par étape, cf. has_multiple_statements)
+            cur.execute("SELECT set_config('statement_timeout', %s, true)", (str(timeout_ms),))
+            cur.execute(parsed["sql"])
+            if cur.description is not None:
+                columns = [d[0] for d in cur.description]
+                rows = [[_jsonable(v) for v in row] for row in cur.fetchmany(MAX_ROWS + 1)]
+                if len(rows) > MAX_ROWS:
+                    rows = rows[:MAX_ROWS]
+                    result["truncated"] = True
+                result["columns"] = columns
+                result["rows"] = rows
+                result["parsed"] = {"parser": "sql_pool", "records": rows_to_records(columns, rows),
+                                    "lossless": True}
+                result["stdout"] = render_unaligned(columns, rows, parsed["tuples_only"])
+            else:
+                result["stdout"] = (cur.statusmessage or "") + "\n"
+    except psycopg2.Error as e:
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        result["exit_code"] = EXIT_CODE_CANCELLED if cancelled else EXIT_CODE_SQL_ERROR
+        result["stderr"] = f"ERROR:  {str(e).strip()}"
+        broken = conn.closed != 0
+    finally:
+        done.set()
+        try:
+            conn.rollback()  # Rien à valider : lecture seule
+        except Exception:
+            broken = True
+        pool.putconn(conn, close=broken)
+
+    log_execution(command, executed, result["exit_code"], result["stdout"], result["stderr"],
+                  plan_id=plan_id, parsed=result.get("parsed"))
+    return result
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Mesure le prefill Ollama par requête : ancien prompt (question et RAG en
+tête) contre préfixe système stable + partie variable.
+
+Usage (depuis agent/) :
+    python3 scripts/bench_prompt_prefix.py [-n 5] [--url http://...] [--model ...]
+"""
+import argparse
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from planner import build_planner_prompt, build_system_prefix
+from runtime.discovery import load_config
+from runtime.llm_client import OllamaClient
+from runtime.prompt_budget import budget_prompt_parts
+from runtime.registry import get_registry, get_registry_fingerprint
+
+QUESTIONS = [
+    "Check available disk space",
+    "Is the last pgbackrest backup older than 24 hours?",
+    "Which node is the patroni leader?",
+    "List the largest tables in the postgres database",
+    "Is the local PostgreSQL instance accepting connections?",
+]
+
+
+def summarize(label, stats):
+    counts = [s["prompt_eval_count"] or 0 for s in stats]
+    durations = [(s["prompt_eval_duration"] or 0) / 1e6 for s in stats]
+    print(f"{label:<8} prompt_eval_count mean {statistics.mean(counts):7.1f} | "
+          f"prefill mean {statistics.mean(durations):8.1f} ms")
+
+def run(client, layout, runs, registry):
+    binaries = registry.get("binaries", {})
+    rich_help = {t["name"]: t.get("help_doc", "No help") for t in registry.get("tools", [])}
+    system = build_system_prefix(binaries, get_registry_fingerprint())
+    stats = []
+    for i in range(runs):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        tools_help, rag, _ = budget_prompt_parts(question, rich_help, "No context provided")
+        variable = build_planner_prompt(question, tools_help, rag, "unknown", "readonly")
+        if layout == "prefix":
+            client.chat(variable, system=system)
+        else:
+            # Ancienne disposition : le contenu variable précède les règles
+            client.chat(variable + "\n" + system)
+        stats.append(client.last_stats)
+    return stats
+
+def main():
+    cfg = load_config().get("llm", {})
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--url", default=cfg.get("url", "http://10.214.0.8:11434"))
+    parser.add_argument("--model", default=cfg.get("model", "qwen2.5:7b-instruct-q4_K_M"))
+    opts = parser.parse_args()
+
+    client = OllamaClient(opts.url, opts.model, keep_alive="30m", num_ctx=cfg.get("num_ctx"))
+    registry = get_registry()
+    print(f"Benchmark prefill {opts.model} ({opts.runs} requests per layout)")
+    client.chat("ping")  # Échauffement : modèle chargé
+    summarize("legacy", run(client, "legacy", opts.runs, registry))
+    summarize("prefix", run(client, "prefix", opts.runs, registry))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Compare la latence par commande : bwrap neuf à chaque appel
+(build_bwrap_command) contre le pool de sandboxes chauds.
+
+Usage (depuis agent/) :
+    python3 scripts/bench_sandbox.py [-n 50] [commande...]
+    python3 scripts/bench_sandbox.py -n 100 psql --version
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from executor import build_bwrap_command, get_sandbox_pool, resolve_argv
+
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    print(f"{label:<12} mean {statistics.mean(samples):8.2f} ms | "
+          f"p50 {statistics.median(samples):8.2f} ms | p95 {p95:8.2f} ms")
+
+def bench_fresh(command, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(build_bwrap_command(command), capture_output=True, timeout=45)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def bench_pool(command, runs):
+    pool = get_sandbox_pool(command.split()[0])
+    args = resolve_argv(command)
+    pool.run(args, 45, 1024 * 1024)  # Échauffement : au moins un helper prêt
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        pool.run(args, 45, 1024 * 1024)
+        samples.append((time.perf_counter() - start) * 1000)
+    pool.close()
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--runs", type=int, default=50)
+    parser.add_argument("command", nargs="*", default=["ls", "/"])
+    opts = parser.parse_args()
+    command = " ".join(opts.command)
+
+    print(f"Benchmark '{command}' ({opts.runs} runs)")
+    summarize("bwrap", bench_fresh(command, opts.runs))
+    summarize("pool", bench_pool(command, opts.runs))
+
+if __name__ == "__main__":
+    main()
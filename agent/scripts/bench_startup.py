@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Mesure le coût d'import de server.py (python -X importtime) et liste les
+modules les plus lents. Avec --max-ms, code retour 1 si le seuil est dépassé
+(suivi en CI des régressions de démarrage).
+
+Usage (depuis agent/) :
+    python3 scripts/bench_startup.py [--top 15] [--max-ms 300] [--module server]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    """[(cumulé µs, propre µs, module)] pour un import à froid de 'module'."""
+    env = dict(os.environ, PYTHONPATH=AGENT_DIR, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=AGENT_DIR, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        sys.exit(f"Import of '{module}' failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        # "import time:   self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative), int(own), name.rstrip()))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="server")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, help="Seuil d'import total (ms)")
+    opts = parser.parse_args()
+
+    rows = import_times(opts.module)
+    total = next((c for c, _, name in rows if name.strip() == opts.module), sum(o for _, o, _ in rows))
+    print(f"import {opts.module}: {total / 1000:.1f} ms ({len(rows)} modules)")
+    for cumulative, own, name in sorted(rows, reverse=True)[:opts.top]:
+        print(f"  {cumulative / 1000:8.1f} ms cumul | {own / 1000:7.1f} ms propre | {name.strip()}")
+
+    if opts.max_ms is not None and total / 1000 > opts.max_ms:
+        print(f"FAIL: {total / 1000:.1f} ms > {opts.max_ms} ms")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,18 @@ import logging
 
 ALLOWLIST_PATH = os.path.join(os.path.dirname(__file__), "allowed_tools.json")
 
+# Cache du fichier invalidé par mtime : les modifications restent prises en
+# compte à chaud sans relire le JSON à chaque commande
+_cache = {"mtime": None, "config": None}
+
+def _load_allowlist_file():
+    mtime = os.stat(ALLOWLIST_PATH).st_mtime_ns
+    if _cache["mtime"] != mtime:
+        with open(ALLOWLIST_PATH, "r") as f:
+            config = json.load(f)
+        _cache.update(mtime=mtime, config=config)
+    return _cache["config"]
+
 def load_allowed_tools():
     """Charge la liste des outils autorisés avec sécurité."""
     if not os.path.exists(ALLOWLIST_PATH):
@@ -11,13 +23,46 @@ def load_allowed_tools():
         return {"psql", "pg_dump", "patronictl", "ls"}
     
     try:
-        with open(ALLOWLIST_PATH, "r") as f:
-            config = json.load(f)
+        config = _load_allowlist_file()
         return set(config.get("allowed_tools", []))
     except Exception as e:
         logging.error(f"Error loading allowlist: {e}")
         return set()
 
+def get_tool_metadata(tool_name: str) -> dict:
+    """Métadonnées d'un outil ('tool_metadata' de l'allowlist), {} si absentes."""
+    try:
+        return _load_allowlist_file().get("tool_metadata", {}).get(tool_name, {})
+    except Exception:
+        return {}
+
+def is_read_only_invocation(tool_name: str, args: list) -> bool:
+    """
+    Vrai si l'invocation correspond à une sous-commande déclarée 'read_only'
+    (ex: 'patronictl -c x.yml list'). Les valeurs des 'value_flags' sont
+    ignorées pour retrouver la sous-commande ; '*' couvre tout l'outil.
+    """
+    meta = get_tool_metadata(tool_name)
+    patterns = meta.get("read_only", [])
+    if "*" in patterns:
+        return True
+    value_flags = set(meta.get("value_flags", []))
+    positional = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+            continue
+        if arg.startswith("-"):
+            skip = arg in value_flags
+            continue
+        positional.append(arg)
+    for pattern in patterns:
+        words = pattern.split()
+        if words and positional[:len(words)] == words:
+            return True
+    return False
+
 # Chargement initial
 ALLOWED_TOOLS = load_allowed_tools()
 
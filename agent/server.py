@@ -1,22 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import json
 import os
 import logging
 import time
 import sys
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
-# Imports structure v1.2.1
-from executor import run_command
-from security.allowlist import is_tool_allowed, extract_tool
-from security.safety import is_safe, get_unsafe_reason
-from runtime.audit import get_last_logs, log_execution, init_db
+# Imports structure v1.2.1 (modules légers uniquement : démarrage rapide)
+from runtime.audit import init_db, query_logs, audit_batch
 from runtime.registry import refresh_registry, get_registry
-from runtime.toolbox import ToolboxManager
 
-# --- IMPORTS PLANNER & ORCHESTRATOR ---
+# Planner (requests, tokenizers), orchestrator (psycopg2) et executor sont
+# importés au premier usage dans les routes, et préchargés en arrière-plan
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from planner import plan_actions
-from orchestrator import run_plan
+LAZY_MODULES = ("executor", "orchestrator", "planner")
 
 # ------------------------------------------------------------
 # Configuration
@@ -30,6 +29,11 @@ except Exception:
 
 PORT = int(os.environ.get("AGENT_PORT", CONFIG.get("port", 5050)))
 
+# /exec_batch : bornes par requête
+MAX_BATCH_COMMANDS = 50
+MAX_BATCH_CONCURRENCY = 8
+BATCH_CONCURRENCY = int(CONFIG.get("exec_batch", {}).get("concurrency", 4))
+
 # ------------------------------------------------------------
 # Logging
 # ------------------------------------------------------------
@@ -41,6 +45,29 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
+# ------------------------------------------------------------
+# Démarrage en arrière-plan : discovery + préchargement des modules
+# ------------------------------------------------------------
+READY = threading.Event()
+STARTUP = {"started_at": time.time(), "ready_at": None, "error": None}
+
+def warm_up():
+    """Scan du registry puis import des modules lourds ; /ready passe à 200 ensuite."""
+    try:
+        refresh_registry()
+        for name in LAZY_MODULES:
+            __import__(name)
+        # Tokenizer du budget de prompt chargé ici plutôt qu'au premier plan
+        from runtime.prompt_budget import get_tokenizer
+        get_tokenizer()
+    except Exception as e:
+        STARTUP["error"] = str(e)
+        logging.exception("Background startup failed")
+    finally:
+        STARTUP["ready_at"] = time.time()
+        READY.set()
+        logging.info(f"Agent ready in {STARTUP['ready_at'] - STARTUP['started_at']:.2f}s")
+
 def check_auth(req):
     expected = os.environ.get("AGENT_TOKEN", "123") # "123" par défaut pour tes tests
     auth = req.headers.get("Authorization", "")
@@ -53,13 +80,26 @@ app = Flask(__name__)
 
 @app.route("/health", methods=["GET"])
 def health():
+    """Liveness : répond dès que le port est ouvert."""
     return jsonify({
         "status": "ok",
         "service": "pg-ai-agent",
         "version": "1.2.1",
+        "ready": READY.is_set(),
         "timestamp": time.time()
     })
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness : 503 tant que le registry n'est pas rescanné."""
+    if not READY.is_set():
+        return jsonify({"ready": False, "uptime": time.time() - STARTUP["started_at"]}), 503
+    return jsonify({
+        "ready": True,
+        "startup_seconds": round(STARTUP["ready_at"] - STARTUP["started_at"], 3),
+        "error": STARTUP["error"]
+    })
+
 @app.route("/registry", methods=["GET"])
 def get_agent_registry():
     if not check_auth(request):
@@ -76,10 +116,17 @@ def plan_and_exec():
     # NOUVEAU : On récupère le contexte RAG envoyé par la VM-Agency
     rag_context = data.get("rag_context", "No official documentation provided.")
     mode = data.get("mode", "readonly")
+    # Identifiant fourni par le client pour pouvoir annuler via /plan_cancel
+    plan_id = data.get("plan_id")
+    # Exécution pendant la génération (étapes en lecture seule lancées au fil de l'eau)
+    incremental = data.get("incremental", CONFIG.get("planner", {}).get("incremental", False))
 
     if not question:
         return jsonify({"error": "Missing 'question'"}), 400
 
+    from planner import plan_actions, PlanStream
+    from orchestrator import run_plan
+
     try:
         # 1. Récupération du registre (Discovery dynamique)
         registry = get_registry()
@@ -94,29 +141,149 @@ def plan_and_exec():
         # 3. Préparation des métadonnées
         pg_version = "unknown" # On pourrait extraire 'postgres --version' du registry ici
 
-        # 4. Génération du plan
-        # MODIFICATION : On passe rag_context au planner
+        if incremental:
+            # 4+5. Génération en streaming, exécution recouvrant la génération
+            stream = PlanStream(question, rag_context=rag_context, pg_version=pg_version, mode=mode)
+            state = run_plan({}, registry.get("binaries", {}), plan_id=plan_id, step_stream=stream)
+            plan = stream.plan or {"goal": "Error: plan generation interrupted", "steps": [
+                entry["step"] for entry in state["history"]]}
+        else:
+            # 4. Génération du plan
+            # MODIFICATION : On passe rag_context au planner
+            plan = plan_actions(
+                question=question,
+                rag_context=rag_context, # Injecté depuis la VM-Agency
+                pg_version=pg_version,
+                mode=mode
+            )
+
+            # 5. Exécution sécurisée du plan
+            state = run_plan(plan, registry.get("binaries", {}), plan_id=plan_id)
+
+        return jsonify({
+            "question": question,
+            "plan": plan,
+            "state": state
+        })
+
+    except Exception as e:
+        logging.exception("Plan/Exec failed")
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/plan", methods=["POST"])
+def plan_only():
+    """Génère et valide un plan sans l'exécuter (à diffuser ensuite via /exec_plan)."""
+    if not check_auth(request):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    data = request.get_json() or {}
+    question = data.get("question")
+    if not question:
+        return jsonify({"error": "Missing 'question'"}), 400
+
+    from planner import plan_actions
+
+    try:
         plan = plan_actions(
             question=question,
-            rag_context=rag_context, # Injecté depuis la VM-Agency
-            pg_version=pg_version,
-            mode=mode
+            rag_context=data.get("rag_context", "No official documentation provided."),
+            pg_version=data.get("pg_version", "unknown"),
+            mode=data.get("mode", "readonly")
         )
+        return jsonify({"question": question, "plan": plan})
+    except Exception as e:
+        logging.exception("Plan failed")
+        return jsonify({"error": str(e)}), 500
 
-        # 5. Exécution sécurisée du plan
-        state = run_plan(plan, registry.get("binaries", {}))
+@app.route("/exec_plan", methods=["POST"])
+def exec_plan():
+    """
+    Exécute un plan construit ailleurs (agence, autre agent).
+    Le plan repasse par validate_plan avec le registry, l'allowlist et les
+    règles safety de cette machine : les étapes refusées sont signalées
+    (rejected_steps), les entrées qui ne sont pas des étapes aussi, par
+    position (invalid_entries).
+    """
+    if not check_auth(request):
+        return jsonify({"error": "Unauthorized"}), 401
 
+    data = request.get_json() or {}
+    plan = data.get("plan")
+    if not isinstance(plan, dict) or not isinstance(plan.get("steps"), list):
+        return jsonify({"error": "Missing or invalid 'plan'"}), 400
+
+    from planner import validate_plan
+    from runtime.plan_schema import repair_plan
+    from orchestrator import run_plan
+
+    try:
+        registry = get_registry()
+        if registry.get("has_conflicts"):
+            return jsonify({
+                "error": "VERSION_CONFLICT",
+                "details": registry.get("conflicts")
+            }), 409
+
+        # Entrées qui ne sont pas des étapes : signalées par position
+        invalid = [i for i, step in enumerate(plan["steps"]) if not isinstance(step, dict)]
+        plan = repair_plan({"goal": plan.get("goal", ""),
+                            "steps": [s for s in plan["steps"] if isinstance(s, dict)]})
+        # Ids relevés après repair_plan : les ids par défaut (step_<i>) y sont attribués
+        submitted = [step["id"] for step in plan["steps"]]
+        plan = validate_plan(plan, registry.get("binaries", {}))
+        kept = {str(step.get("id")) for step in plan["steps"]}
+        rejected = [sid for sid in submitted if str(sid) not in kept]
+
+        state = run_plan(plan, registry.get("binaries", {}), plan_id=data.get("plan_id"))
         return jsonify({
-            "question": question,
             "plan": plan,
+            "rejected_steps": rejected,
+            "invalid_entries": invalid,
             "state": state
         })
+    except Exception as e:
+        logging.exception("Exec plan failed")
+        return jsonify({"error": str(e)}), 500
 
+@app.route("/plan_cancel/<plan_id>", methods=["POST"])
+def plan_cancel(plan_id):
+    """Annule un plan en cours : les processus de ses étapes sont tués."""
+    if not check_auth(request):
+        return jsonify({"error": "Unauthorized"}), 401
+    from orchestrator import cancel_plan
+    if not cancel_plan(plan_id):
+        return jsonify({"error": "Unknown or finished plan", "plan_id": plan_id}), 404
+    return jsonify({"status": "cancelling", "plan_id": plan_id})
+
+@app.route("/audit", methods=["GET"])
+def audit_logs():
+    """
+    Consultation paginée de l'audit.
+    Filtres : since, until (ISO 8601), tool, exit_code, plan_id.
+    Pagination : limit + cursor (valeur 'next_cursor' de la page précédente).
+    Les sorties stdout/stderr ne sont renvoyées qu'avec include_output=1.
+    """
+    if not check_auth(request):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    args = request.args
+    try:
+        page = query_logs(
+            limit=args.get("limit", 50, type=int),
+            before_id=args.get("cursor", type=int),
+            since=args.get("since"),
+            until=args.get("until"),
+            tool=args.get("tool"),
+            exit_code=args.get("exit_code", type=int),
+            plan_id=args.get("plan_id"),
+            include_output=args.get("include_output", "0") in ("1", "true")
+        )
     except Exception as e:
-        logging.exception("Plan/Exec failed")
+        logging.exception("Audit query failed")
         return jsonify({"error": str(e)}), 500
+    return jsonify(page)
 
-# Les autres routes (/exec, /audit, /explore) restent inchangées dans leur logique
+# Les autres routes (/exec, /explore) restent inchangées dans leur logique
 # mais s'appuieront sur le nouveau registry rafraîchi.
 
 @app.route("/exec", methods=["POST"])
@@ -125,13 +292,94 @@ def exec_command():
     if not check_auth(request): return jsonify({"error": "Unauthorized"}), 401
     data = request.get_json()
     command = data.get("command")
+    from executor import run_command
     # Utilisation du registry résolu pour l'exécution directe si besoin
     result = run_command(command)
     return jsonify(result)
 
+@app.route("/exec_batch", methods=["POST"])
+def exec_batch():
+    """
+    Plusieurs commandes en une requête : {"commands": [...], "concurrency": n}.
+    Chaque commande passe par run_command (allowlist, safety, sandbox) ;
+    résultats dans l'ordre des commandes, audits regroupés en transactions.
+    """
+    if not check_auth(request): return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json() or {}
+    commands = data.get("commands")
+    if not isinstance(commands, list) or not commands:
+        return jsonify({"error": "Missing 'commands' list"}), 400
+    if len(commands) > MAX_BATCH_COMMANDS:
+        return jsonify({"error": f"Too many commands (max {MAX_BATCH_COMMANDS})"}), 400
+    if not all(isinstance(c, str) and c.strip() for c in commands):
+        return jsonify({"error": "Each command must be a non-empty string"}), 400
+
+    try:
+        concurrency = int(data.get("concurrency", BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid 'concurrency'"}), 400
+    concurrency = max(1, min(concurrency, MAX_BATCH_CONCURRENCY, len(commands)))
+    from executor import run_command, COMMAND_TIMEOUT
+    timeout = data.get("timeout")
+    if timeout is not None:
+        try:
+            timeout = float(timeout)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid 'timeout'"}), 400
+        if not timeout > 0:
+            return jsonify({"error": "Invalid 'timeout'"}), 400
+        # Le client peut raccourcir le timeout de l'agent, jamais l'allonger
+        timeout = min(timeout, COMMAND_TIMEOUT)
+
+    def run_one(command):
+        try:
+            return run_command(command, timeout=timeout)
+        except Exception as e:
+            return {"stdout": "", "stderr": str(e), "exit_code": -1}
+
+    with audit_batch():
+        # Chaque tâche tourne dans une copie du contexte : ses audits rejoignent le lot
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, run_one, c) for c in commands]
+            results = [f.result() for f in futures]
+
+    return jsonify({"results": [dict(r, command=c) for c, r in zip(commands, results)]})
+
+@app.route("/exec_stream", methods=["POST"])
+def exec_command_stream():
+    """
+    Variante Server-Sent Events de /exec : la sortie est relayée au fil de
+    l'eau (événements 'stdout' / 'stderr'), puis un événement 'exit' porte
+    le résultat final. Options : max_bytes, spill (flux complet au-delà de max_bytes).
+    """
+    if not check_auth(request): return jsonify({"error": "Unauthorized"}), 401
+    data = request.get_json() or {}
+    command = data.get("command")
+    if not command:
+        return jsonify({"error": "Missing 'command'"}), 400
+    from executor import stream_command, MAX_OUTPUT_BYTES
+    max_bytes = data.get("max_bytes")
+    if max_bytes is not None:
+        # Validé avant l'ouverture du flux : une erreur ensuite le couperait en route
+        if isinstance(max_bytes, bool) or not isinstance(max_bytes, int) or max_bytes <= 0:
+            return jsonify({"error": "Invalid 'max_bytes'"}), 400
+        # Le client peut abaisser le plafond mémoire de l'agent, jamais le relever
+        max_bytes = min(max_bytes, MAX_OUTPUT_BYTES)
+
+    def events():
+        for name, payload in stream_command(
+            command,
+            max_bytes=max_bytes,
+            spill=bool(data.get("spill", False))
+        ):
+            yield f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream")
+
 if __name__ == "__main__":
     print("🔍 Initializing PgAgent v1.2.1...")
     init_db()
-    # On force un premier scan au démarrage
-    refresh_registry()
-    app.run(host="0.0.0.0", port=PORT)
+    # Premier scan en arrière-plan : le port est ouvert immédiatement,
+    # le registry précédent (registry.json) sert en attendant
+    threading.Thread(target=warm_up, name="startup", daemon=True).start()
+    app.run(host="0.0.0.0", port=PORT, threaded=True)
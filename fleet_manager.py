@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+
+# Parallélisme borné : au plus MAX_PARALLEL_HOSTS requêtes en vol
+MAX_PARALLEL_HOSTS = 8
+CONNECT_TIMEOUT = 5
+HOST_TIMEOUT = 300  # secondes de lecture par hôte (plan + exécution)
+STALE_BACKUP_HOURS = 24
+NO_CONTEXT = "No official documentation provided."
+
+def load_inventory(path):
+    """
+    Inventaire JSON : liste d'agents ou {"agents": [...]}.
+    Un agent est une URL ou {"name", "url", "token"}.
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("agents", [])
+    agents = []
+    for entry in data:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        agents.append({
+            "name": entry.get("name") or entry["url"],
+            "url": entry["url"].rstrip("/"),
+            "token": entry.get("token"),
+        })
+    return agents
+
+def is_usable_plan(plan):
+    """Plan diffusable : au moins une étape et pas un plan d'erreur du planner."""
+    if not isinstance(plan, dict) or not plan.get("steps"):
+        return False
+    return not str(plan.get("goal", "")).startswith("Error")
+
+class FleetManager:
+    """
+    Envoie une même question (ou requête) à tous les agents d'une flotte,
+    en parallèle borné, et restitue les résultats au fil de l'eau.
+    """
+
+    def __init__(self, agents, api_token=None, max_parallel=MAX_PARALLEL_HOSTS,
+                 host_timeout=HOST_TIMEOUT, rag_expert=None):
+        self.agents = agents
+        self.api_token = api_token
+        self.max_parallel = max_parallel
+        self.host_timeout = host_timeout
+        self.rag_expert = rag_expert  # DBAgencyExpert optionnel : RAG fait une seule fois
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(len(agents), 1), pool_maxsize=max_parallel)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _headers(self, agent):
+        return {
+            "Authorization": f"Bearer {agent.get('token') or self.api_token}",
+            "Content-Type": "application/json"
+        }
+
+    def _call(self, agent, method, path, payload=None):
+        start = time.time()
+        result = {"host": agent["name"], "url": agent["url"]}
+        try:
+            response = self.session.request(
+                method, f"{agent['url']}{path}", json=payload, headers=self._headers(agent),
+                timeout=(CONNECT_TIMEOUT, self.host_timeout)
+            )
+            result["status"] = response.status_code
+            result["response"] = response.json()
+            result["ok"] = response.ok
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+        result["elapsed"] = round(time.time() - start, 3)
+        return result
+
+    def broadcast(self, method, path, payload=None):
+        """Générateur : un résultat par hôte, dans l'ordre d'arrivée."""
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as pool:
+            futures = [pool.submit(self._call, agent, method, path, payload) for agent in self.agents]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def rag_context(self, question):
+        """Chunks rerankés calculés une seule fois pour toute la flotte."""
+        if self.rag_expert is None:
+            return NO_CONTEXT
+        try:
+            found = self.rag_expert.retrieve(question)
+        except Exception as e:
+            print(f"⚠️ [Fleet] RAG indisponible : {e}")
+            return NO_CONTEXT
+        return [
+            {"text": f"DOC: {c['title']} > {c['section']}\n{c['text']}", "score": c["score"]}
+            for c in found["chunks"]
+        ] or NO_CONTEXT
+
+    def ask(self, question, mode="readonly"):
+        """Question posée à chaque agent (/plan_exec), résultats au fil de l'eau."""
+        payload = {"question": question, "rag_context": self.rag_context(question), "mode": mode}
+        yield from self.broadcast("POST", "/plan_exec", payload)
+
+    def plan(self, question, mode="readonly", planner=None):
+        """
+        Plan généré une seule fois, par 'planner' (agent de l'inventaire) ou,
+        à défaut, par le premier agent qui répond.
+        """
+        payload = {"question": question, "rag_context": self.rag_context(question), "mode": mode}
+        errors = []
+        for agent in ([planner] if planner else self.agents):
+            result = self._call(agent, "POST", "/plan", payload)
+            plan = (result.get("response") or {}).get("plan") if result.get("ok") else None
+            if is_usable_plan(plan):
+                return plan
+            # Plan d'erreur renvoyé en 200 (LLM indisponible...) : agent suivant
+            reason = result.get("error") or (plan or {}).get("goal") or result.get("status")
+            errors.append(f"{agent['name']}: {reason}")
+        raise RuntimeError(f"No agent could build the plan ({'; '.join(errors)})")
+
+    def ask_once(self, question, mode="readonly", planner=None):
+        """Planifie une fois puis diffuse le plan (/exec_plan) : une seule génération LLM."""
+        plan = self.plan(question, mode, planner)
+        yield from self.broadcast("POST", "/exec_plan", {"plan": plan})
+
+# ------------------------------------------------------------
+# Agrégations
+# ------------------------------------------------------------
+def iter_step_records(results, tool):
+    """(hôte, enregistrement) pour chaque sortie structurée d'une étape 'tool'."""
+    for result in results:
+        state = (result.get("response") or {}).get("state") or {}
+        for entry in state.get("history", []):
+            if entry.get("step", {}).get("tool") != tool:
+                continue
+            parsed = entry.get("result", {}).get("parsed") or {}
+            for record in parsed.get("records", []):
+                yield result["host"], record
+
+def stale_backups(results, max_age_hours=STALE_BACKUP_HOURS):
+    """
+    Stanzas dont la dernière sauvegarde (pgbackrest info --output=json)
+    est plus vieille que max_age_hours, ou absente, ou en erreur.
+    """
+    stale = []
+    for host, record in iter_step_records(results, "pgbackrest"):
+        age = record.get("last_backup_age_s")
+        if age is None or age > max_age_hours * 3600 or record.get("status_code") not in (0, None):
+            stale.append({
+                "host": host,
+                "stanza": record.get("stanza"),
+                "last_backup_stop": record.get("last_backup_stop"),
+                "age_hours": round(age / 3600, 1) if age is not None else None,
+                "status": record.get("status"),
+            })
+    return stale
+
+def summarize(results):
+    ok = [r for r in results if r.get("ok")]
+    return {
+        "hosts": len(results),
+        "ok": len(ok),
+        "failed": sorted(r["host"] for r in results if not r.get("ok")),
+        "slowest": max((r["elapsed"] for r in results), default=0),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pose une question à toute une flotte de pg-agents")
+    parser.add_argument("inventory", help="Fichier JSON des agents")
+    parser.add_argument("question")
+    parser.add_argument("--token", default=os.getenv("AGENT_TOKEN"))
+    parser.add_argument("--parallel", type=int, default=MAX_PARALLEL_HOSTS)
+    parser.add_argument("--timeout", type=int, default=HOST_TIMEOUT)
+    parser.add_argument("--plan-per-host", action="store_true",
+                        help="Chaque agent planifie lui-même (/plan_exec) au lieu d'un plan diffusé")
+    parser.add_argument("--rag", action="store_true",
+                        help="Contexte documentaire (RAG + reranker) calculé une fois pour la flotte")
+    parser.add_argument("--stale-backups", type=float, metavar="HOURS",
+                        help="Liste les stanzas sans sauvegarde depuis HOURS heures")
+    opts = parser.parse_args()
+
+    rag_expert = None
+    if opts.rag:
+        # Import différé : psycopg2, dotenv et client Ollama seulement si demandé
+        from agency_expert import DBAgencyExpert
+        rag_expert = DBAgencyExpert()
+    fleet = FleetManager(load_inventory(opts.inventory), opts.token, opts.parallel, opts.timeout,
+                         rag_expert=rag_expert)
+    results = []
+    runs = fleet.ask(opts.question) if opts.plan_per_host else fleet.ask_once(opts.question)
+    for result in runs:
+        results.append(result)
+        status = "✅" if result.get("ok") else "❌"
+        print(f"{status} {result['host']} ({result['elapsed']}s) {result.get('error', '')}", flush=True)
+
+    print(json.dumps(summarize(results), indent=2))
+    if opts.stale_backups is not None:
+        print(json.dumps(stale_backups(results, opts.stale_backups), indent=2))
+    sys.exit(0 if all(r.get("ok") for r in results) else 1)
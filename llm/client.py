@@ -5,6 +5,16 @@ from dotenv import load_dotenv
 # Chargement du fichier .env situé à la racine du projet
 load_dotenv()
 
+# Prompt système statique, toujours envoyé en tête : son cache KV côté Ollama
+# reste valide d'une question à l'autre (seul le message utilisateur change)
+SYSTEM_PROMPT = (
+    "You are a PostgreSQL expert specialized in server administration. "
+    "Use the provided documentation context to answer the user's question accurately. "
+    "If the answer is not in the context, state that you don't know based on the current docs. "
+    "Maintain a professional and technical tone. "
+    "Always provide SQL examples or configuration parameters when relevant."
+)
+
 class OllamaClient:
     def __init__(self):
         # Récupération stricte des variables d'environnement
@@ -12,6 +22,10 @@ class OllamaClient:
         self.port = os.getenv("OLLAMA_PORT", "11434")
         self.embed_model = os.getenv("EMBEDDING_MODEL")
         self.default_gen_model = os.getenv("GENERATION_MODEL")
+        # Modèle gardé en mémoire entre deux requêtes ; num_ctx fixe = pas de rechargement
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        self.num_ctx = os.getenv("OLLAMA_NUM_CTX")
+        self.last_stats = {}
 
         # Validation de la configuration
         if not self.host:
@@ -42,33 +56,31 @@ class OllamaClient:
             print(f"❌ Error: A network error occurred: {e}")
         return None
 
-    def chat(self, user_prompt, context="", model=None):
+    def chat(self, user_prompt, context="", model=None, system=None):
         """Sends a prompt to the LLM with context and a technical system prompt."""
         target_model = model if model else self.default_gen_model
         url = f"{self.base_url}/chat"
         
-        # English system prompt for better model alignment with technical docs
-        system_content = (
-            "You are a PostgreSQL expert specialized in server administration. "
-            "Use the provided documentation context to answer the user's question accurately. "
-            "If the answer is not in the context, state that you don't know based on the current docs. "
-            "Maintain a professional and technical tone. "
-            "Always provide SQL examples or configuration parameters when relevant."
-        )
-        
+        # Static prefix first (system), variable content last (context + question)
         payload = {
             "model": target_model,
             "messages": [
-                {"role": "system", "content": system_content},
+                {"role": "system", "content": system or SYSTEM_PROMPT},
                 {"role": "user", "content": f"Context: {context}\n\nQuestion: {user_prompt}"}
             ],
-            "stream": False
+            "stream": False,
+            "keep_alive": self.keep_alive
         }
+        if self.num_ctx:
+            payload["options"] = {"num_ctx": int(self.num_ctx)}
         
         try:
             response = requests.post(url, json=payload, timeout=120) # Timeout plus long pour la génération
             response.raise_for_status()
-            return response.json()["message"]["content"]
+            data = response.json()
+            self.last_stats = {k: data.get(k) for k in
+                               ("prompt_eval_count", "prompt_eval_duration", "eval_count", "total_duration")}
+            return data["message"]["content"]
         
         except Exception as e:
             return f"⚠️ Error during LLM generation: {str(e)}"
@@ -1,7 +1,17 @@
 import os
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from agency_expert import DBAgencyExpert
 
+# Timeouts (connexion, lecture) : /plan_exec inclut la génération du plan sur CPU
+CONNECT_TIMEOUT = 5
+REGISTRY_TIMEOUT = (CONNECT_TIMEOUT, 15)
+PLAN_EXEC_TIMEOUT = (CONNECT_TIMEOUT, 600)
+REGISTRY_TTL = 60  # secondes
+NO_CONTEXT = "No official documentation provided."
+
 class PostgresExpertManager:
     def __init__(self, agent_url, api_token):
         self.rag_expert = DBAgencyExpert()
@@ -10,20 +20,67 @@ class PostgresExpertManager:
             "Authorization": f"Bearer {api_token}",
             "Content-Type": "application/json"
         }
+        # Session réutilisée : connexions HTTP keep-alive vers l'agent
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self._registry = None
+        self._registry_at = 0
+
+    def fetch_registry(self):
+        """Registry de l'agent, gardé REGISTRY_TTL secondes."""
+        if self._registry is not None and time.time() - self._registry_at < REGISTRY_TTL:
+            return self._registry
+        response = self.session.get(f"{self.agent_url}/registry", timeout=REGISTRY_TIMEOUT)
+        response.raise_for_status()
+        self._registry = response.json()
+        self._registry_at = time.time()
+        return self._registry
+
+    def retrieve_context(self, question):
+        """Chunks rerankés (sans génération) au format rag_context du planner."""
+        try:
+            found = self.rag_expert.retrieve(question)
+        except Exception as e:
+            print(f"⚠️ [Agency] RAG indisponible : {e}")
+            return NO_CONTEXT
+        if not found["chunks"]:
+            return NO_CONTEXT
+        return [
+            {
+                "text": f"DOC: {c['title']} > {c['section']}\n{c['text']}",
+                "title": c["title"],
+                "section": c["section"],
+                "score": c["score"],
+            }
+            for c in found["chunks"]
+        ]
 
     def resolve_and_execute(self, question):
-        # 1. On récupère la doc officielle via ton RAG + Reranker
+        # 1. Doc officielle via RAG + Reranker, registry de l'agent en parallèle
         print(f"🔍 [Agency] Recherche RAG pour : {question}")
-        rag_context = self.rag_expert.ask(question)
+        registry_future = self.executor.submit(self.fetch_registry)
+        rag_context = self.retrieve_context(question)
+
+        try:
+            registry = registry_future.result()
+        except Exception as e:
+            print(f"⚠️ [Agency] Registry indisponible : {e}")
+            registry = {}
+        if registry.get("has_conflicts"):
+            return {"error": "VERSION_CONFLICT", "details": registry.get("conflicts")}
 
-        # 2. On envoie tout au Planner de la VM-PG
+        # 2. On envoie les chunks au Planner de la VM-PG (pas de génération ici)
         payload = {
             "question": question,
             "rag_context": rag_context  # On injecte la doc ici
         }
 
         print(f"📡 [Agency] Envoi du contexte à la VM-PG...")
-        response = requests.post(f"{self.agent_url}/plan_exec", json=payload, headers=self.headers)
+        response = self.session.post(f"{self.agent_url}/plan_exec", json=payload, timeout=PLAN_EXEC_TIMEOUT)
         return response.json()
 
 if __name__ == "__main__":
@@ -0,0 +1,529 @@
+"""
+Serveur de reranking partagé (cross-encoder BGE) sur socket Unix.
+
+Le modèle n'est chargé qu'une fois, dans un seul processus, au premier
+scoring : les CLI et les workers de l'agence passent par RerankerClient,
+qui démarre le serveur s'il n'existe pas encore. Les paires des requêtes
+concurrentes sont regroupées par BatchScheduler (micro-batching).
+
+Protocole : messages JSON préfixés par leur longueur (4 octets big-endian).
+  requête  : {"op": "score", "pairs": [[question, passage(, token_ids)], ...],
+              "tokenizer_version": "..."}
+  réponse  : {"scores": [...]}  ou  {"error": "..."}
+  requête  : {"op": "ping"}  ->  {"model": "...", "loaded": true|false, "tokenizer_version": "..."}
+
+Les token_ids d'un passage (pré-calculés à l'ingestion, cf. RAG/ingest.py)
+ne sont utilisés que si tokenizer_version correspond au tokenizer du
+serveur : seule la question est alors tokenisée (et mise en cache).
+
+Usage : python3 reranker_server.py [--socket PATH] [--model NAME]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import fcntl
+import stat
+import socket
+import tempfile
+import struct
+import argparse
+import threading
+import subprocess
+import socketserver
+from concurrent.futures import Future
+
+
+def default_socket_dir():
+    """$XDG_RUNTIME_DIR (privé à l'utilisateur), sinon dossier par uid dans le tmp système."""
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return runtime_dir
+    return os.path.join(tempfile.gettempdir(), f"pgagency-reranker-{os.getuid()}")
+
+def ensure_socket_dir(socket_path):
+    """
+    Crée le dossier du socket (et du .lock) en 0700. Un dossier existant doit
+    appartenir à l'utilisateur et n'être ouvert ni au groupe ni aux autres,
+    sinon un tiers pourrait y substituer son propre socket.
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if directory != os.path.abspath(default_socket_dir()):
+        return  # Dossier fourni via RERANKER_SOCKET / --socket : droits gérés par l'admin
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"Unsafe reranker socket directory: {directory}")
+
+def socket_alive(socket_path):
+    """Vrai si un serveur répond sur ce socket (sinon socket orphelin)."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(1)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+SOCKET_PATH = os.getenv("RERANKER_SOCKET") or os.path.join(default_socket_dir(), "pgagency-reranker.sock")
+MODEL_NAME = os.getenv("RERANKER_MODEL", "BAAI/bge-reranker-base")
+IDLE_TIMEOUT = int(os.getenv("RERANKER_IDLE_TIMEOUT", 1800))  # secondes, 0 = jamais
+START_TIMEOUT = 30  # attente du socket après démarrage du serveur
+REQUEST_TIMEOUT = 120
+# Micro-batching : attente max pour regrouper les requêtes, taille max d'un
+# lot, et taille des sous-lots de longueurs voisines (moins de padding)
+BATCH_WAIT_MS = float(os.getenv("RERANKER_BATCH_WAIT_MS", 5))
+MAX_BATCH_PAIRS = int(os.getenv("RERANKER_MAX_BATCH", 128))
+BUCKET_SIZE = int(os.getenv("RERANKER_BUCKET_SIZE", 16))
+# Texte coupé avant tokenisation : max_length du modèle x ~4 caractères/token
+CHARS_PER_TOKEN = 4
+DEFAULT_MAX_LENGTH = 512
+QUERY_CACHE_SIZE = 256
+TOKENIZER_RETRY = 300  # secondes avant de retenter un tokenizer indisponible
+
+HEADER = struct.Struct(">I")
+
+# ------------------------------------------------------------
+# Tokenizer (partagé avec l'ingestion pour les token_ids pré-calculés)
+# ------------------------------------------------------------
+def load_tokenizer(model_name=MODEL_NAME):
+    """Tokenizer rapide du modèle (bibliothèque tokenizers), None si indisponible."""
+    try:
+        from tokenizers import Tokenizer
+        return Tokenizer.from_pretrained(model_name)
+    except Exception as e:
+        print(f"⚠️ Tokenizer {model_name} indisponible : {e}", flush=True)
+        return None
+
+def tokenizer_version(tokenizer, model_name=MODEL_NAME):
+    """Clé des token_ids stockés : nom du modèle + empreinte du vocabulaire."""
+    vocab = json.dumps(sorted(tokenizer.get_vocab().items()), separators=(",", ":"))
+    return f"{model_name}@{hashlib.sha256(vocab.encode('utf-8')).hexdigest()[:12]}"
+
+def encode_passages(tokenizer, texts, max_length=DEFAULT_MAX_LENGTH):
+    """Ids sans tokens spéciaux, bornés à max_length (le modèle n'en lira pas plus)."""
+    return [enc.ids[:max_length] for enc in tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+
+def recv_exact(sock, size):
+    buf = b""
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+def recv_message(sock):
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    body = recv_exact(sock, HEADER.unpack(header)[0])
+    return json.loads(body) if body is not None else None
+
+def send_message(sock, payload):
+    body = json.dumps(payload).encode("utf-8")
+    sock.sendall(HEADER.pack(len(body)) + body)
+
+# ------------------------------------------------------------
+# Modèle (chargé à la demande, une seule fois par processus)
+# ------------------------------------------------------------
+class LazyCrossEncoder:
+    def __init__(self, model_name=MODEL_NAME):
+        self.model_name = model_name
+        self.model = None
+        self.tokenizer = None
+        self.version = None
+        self.query_cache = {}
+        self._tokenizer_failed_at = float("-inf")
+        self._template = None
+        self._tokenizer_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def tokenizer_version(self):
+        """
+        Version du tokenizer (sans charger le modèle), None si indisponible.
+        Chargé hors du verrou du modèle ; un échec n'est retenté qu'après
+        TOKENIZER_RETRY secondes (hôte hors ligne : pas d'appel réseau à chaque requête).
+        """
+        if self.tokenizer is not None:
+            return self.version
+        with self._tokenizer_lock:
+            if self.tokenizer is None and time.time() - self._tokenizer_failed_at >= TOKENIZER_RETRY:
+                tokenizer = load_tokenizer(self.model_name)
+                if tokenizer is None:
+                    self._tokenizer_failed_at = time.time()
+                else:
+                    self.version = tokenizer_version(tokenizer, self.model_name)
+                    self.tokenizer = tokenizer
+        return self.version
+
+    def query_ids(self, query, max_tokens):
+        # Une même question est scorée contre tous les candidats : ids en cache
+        ids = self.query_cache.get(query)
+        if ids is None:
+            ids = self.tokenizer.encode(query, add_special_tokens=False).ids[:max_tokens]
+            if len(self.query_cache) >= QUERY_CACHE_SIZE:
+                self.query_cache.pop(next(iter(self.query_cache)))
+            self.query_cache[query] = ids
+        return ids
+
+    def load(self):
+        with self._lock:
+            if self.model is None:
+                # Import lourd (torch, transformers) différé au premier scoring
+                from sentence_transformers import CrossEncoder
+                print(f"⚙️  Chargement du reranker {self.model_name} (CPU)...", flush=True)
+                self.model = CrossEncoder(self.model_name, device="cpu")
+        return self.model
+
+    def max_chars(self):
+        model = self.load()
+        return (getattr(model, "max_length", None) or DEFAULT_MAX_LENGTH) * CHARS_PER_TOKEN
+
+    def predict(self, pairs, batch_size=BUCKET_SIZE):
+        """Paires [question, passage] ou [question, passage, token_ids du passage]."""
+        with_ids = [i for i, pair in enumerate(pairs) if len(pair) > 2 and pair[2]]
+        if with_ids and self.tokenizer_version() is None:
+            with_ids = []
+        id_set = set(with_ids)
+        text_idx = [i for i in range(len(pairs)) if i not in id_set]
+
+        scores = [None] * len(pairs)
+        if text_idx:
+            # Inutile de tokeniser au-delà de ce que le modèle lira
+            limit = self.max_chars()
+            texts = [[pairs[i][0][:limit], pairs[i][1][:limit]] for i in text_idx]
+            model = self.load()
+            with self._lock:
+                for i, score in zip(text_idx, model.predict(texts, batch_size=batch_size)):
+                    scores[i] = float(score)
+        for start in range(0, len(with_ids), batch_size):
+            chunk = with_ids[start:start + batch_size]
+            for i, score in zip(chunk, self._predict_ids([pairs[i] for i in chunk])):
+                scores[i] = score
+        return scores
+
+    def pair_template(self):
+        """
+        Tokens spéciaux d'une paire (question, passage), relevés une fois sur
+        l'encodage d'une paire témoin : {"prefix"|"middle"|"suffix": (ids, type_ids),
+        "query_type", "passage_type"}. Indépendant de la version de transformers.
+        """
+        if self._template is None:
+            probe = self.tokenizer.encode("a", "b")
+            parts = {"prefix": ([], []), "middle": ([], []), "suffix": ([], [])}
+            template = {"query_type": 0, "passage_type": 0}
+            seen = None
+            for token_id, type_id, seq in zip(probe.ids, probe.type_ids, probe.sequence_ids):
+                if seq is None:
+                    part = parts["prefix" if seen is None else "middle" if seen == 0 else "suffix"]
+                    part[0].append(token_id)
+                    part[1].append(type_id)
+                else:
+                    template["query_type" if seq == 0 else "passage_type"] = type_id
+                    seen = seq
+            template.update(parts)
+            self._template = template
+        return self._template
+
+    def _predict_ids(self, pairs):
+        """Forward pass à partir des ids pré-calculés : seule la question est tokenisée."""
+        import torch
+        model = self.load()
+        template = self.pair_template()
+        max_length = getattr(model, "max_length", None) or DEFAULT_MAX_LENGTH
+        specials = sum(len(template[part][0]) for part in ("prefix", "middle", "suffix"))
+        rows = []
+        for query, _, passage_ids in pairs:
+            q_ids = self.query_ids(query, max_length // 2)
+            p_ids = list(passage_ids)[:max(max_length - specials - len(q_ids), 0)]
+            ids = template["prefix"][0] + q_ids + template["middle"][0] + p_ids + template["suffix"][0]
+            types = (template["prefix"][1] + [template["query_type"]] * len(q_ids) + template["middle"][1]
+                     + [template["passage_type"]] * len(p_ids) + template["suffix"][1])
+            rows.append((ids, types))
+
+        # Padding à droite, comme la tokenisation de CrossEncoder.predict
+        width = max(len(ids) for ids, _ in rows)
+        pad_id = model.tokenizer.pad_token_id or 0
+        features = {
+            "input_ids": torch.tensor([ids + [pad_id] * (width - len(ids)) for ids, _ in rows]),
+            "attention_mask": torch.tensor([[1] * len(ids) + [0] * (width - len(ids)) for ids, _ in rows]),
+        }
+        if "token_type_ids" in model.tokenizer.model_input_names:
+            features["token_type_ids"] = torch.tensor([types + [0] * (width - len(types)) for _, types in rows])
+        with self._lock:
+            device = model.model.device
+            with torch.inference_mode():
+                logits = model.model(**{k: v.to(device) for k, v in features.items()}, return_dict=True).logits
+                # Même post-traitement que CrossEncoder.predict (sigmoïde pour 1 label)
+                activation = getattr(model, "activation_fn", None) or getattr(model, "default_activation_function", None)
+                if activation is not None:
+                    logits = activation(logits)
+        if logits.shape[-1] == 1:
+            logits = logits.squeeze(-1)
+        return [float(s) for s in logits.tolist()]
+
+class BatchScheduler:
+    """
+    Regroupe les paires de requêtes concurrentes pendant BATCH_WAIT_MS, puis
+    un seul appel au modèle : paires triées par longueur pour que chaque
+    sous-lot de BUCKET_SIZE ait des longueurs voisines. Les scores sont
+    rendus à chaque appelant via son Future, dans son ordre d'origine.
+    """
+
+    def __init__(self, encoder, wait_ms=BATCH_WAIT_MS, max_pairs=MAX_BATCH_PAIRS, bucket_size=BUCKET_SIZE):
+        self.encoder = encoder
+        self.wait = wait_ms / 1000
+        self.max_pairs = max_pairs
+        self.bucket_size = bucket_size
+        self.pending = []  # [(pairs, future)]
+        self.cond = threading.Condition()
+        self.stats = {"batches": 0, "requests": 0, "pairs": 0}
+        threading.Thread(target=self._loop, name="rerank-batcher", daemon=True).start()
+
+    def submit(self, pairs):
+        future = Future()
+        if not pairs:
+            future.set_result([])
+            return future
+        with self.cond:
+            self.pending.append((pairs, future))
+            self.cond.notify()
+        return future
+
+    def predict(self, pairs):
+        return self.submit(pairs).result()
+
+    def _take_batch(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            # Fenêtre de regroupement ouverte par la première requête
+            deadline = time.monotonic() + self.wait
+            while sum(len(p) for p, _ in self.pending) < self.max_pairs:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch, size = [], 0
+            while self.pending and (not batch or size + len(self.pending[0][0]) <= self.max_pairs):
+                pairs, future = self.pending.pop(0)
+                batch.append((pairs, future))
+                size += len(pairs)
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._take_batch()
+            # (requête, position, paire) triés par longueur de texte
+            flat = [(r, i, pair) for r, (pairs, _) in enumerate(batch) for i, pair in enumerate(pairs)]
+            flat.sort(key=lambda item: len(item[2][0]) + len(item[2][1]))
+            try:
+                scores = self.encoder.predict([pair for _, _, pair in flat], batch_size=self.bucket_size)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            results = [[None] * len(pairs) for pairs, _ in batch]
+            for (r, i, _), score in zip(flat, scores):
+                results[r][i] = score
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            self.stats["batches"] += 1
+            self.stats["requests"] += len(batch)
+            self.stats["pairs"] += len(flat)
+
+# ------------------------------------------------------------
+# Serveur
+# ------------------------------------------------------------
+class RerankerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            request = recv_message(self.request)
+            if request is None:
+                return
+            server.last_activity = time.time()
+            try:
+                if request.get("op") == "ping":
+                    response = {"model": server.encoder.model_name, "loaded": server.encoder.model is not None,
+                                "tokenizer_version": server.tokenizer_version(),
+                                "batching": server.scheduler.stats}
+                elif request.get("op") == "score":
+                    pairs = request["pairs"]
+                    # Ids produits par un autre tokenizer : repli sur le texte
+                    version = request.get("tokenizer_version")
+                    if not version or version != server.tokenizer_version():
+                        pairs = [pair[:2] for pair in pairs]
+                    response = {"scores": server.scheduler.predict(pairs)}
+                else:
+                    response = {"error": f"Unknown op: {request.get('op')}"}
+            except Exception as e:
+                response = {"error": str(e)}
+            send_message(self.request, response)
+
+class RerankerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, encoder):
+        self.encoder = encoder
+        self.scheduler = BatchScheduler(encoder)
+        self.last_activity = time.time()
+        super().__init__(socket_path, RerankerHandler)
+
+    def tokenizer_version(self):
+        version_fn = getattr(self.encoder, "tokenizer_version", None)
+        return version_fn() if version_fn else None
+
+def serve(socket_path=SOCKET_PATH, model_name=MODEL_NAME, idle_timeout=IDLE_TIMEOUT):
+    ensure_socket_dir(socket_path)
+    if os.path.exists(socket_path):
+        if socket_alive(socket_path):
+            raise RuntimeError(f"A reranker server is already running on {socket_path}")
+        os.unlink(socket_path)  # Socket orphelin d'un serveur arrêté
+    server = RerankerServer(socket_path, LazyCrossEncoder(model_name))
+    os.chmod(socket_path, 0o660)
+
+    if idle_timeout:
+        def watchdog():
+            while time.time() - server.last_activity < idle_timeout:
+                time.sleep(min(idle_timeout, 30))
+            print("💤 Reranker inactif, arrêt du serveur.", flush=True)
+            server.shutdown()
+        threading.Thread(target=watchdog, daemon=True).start()
+
+    print(f"✅ Reranker server prêt sur {socket_path}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+# ------------------------------------------------------------
+# Client
+# ------------------------------------------------------------
+class RerankerClient:
+    """
+    Interface CrossEncoder.predict() adossée au serveur partagé. Aucune
+    connexion n'est ouverte avant le premier appel ; le serveur est lancé
+    au besoin (verrou fichier : un seul lancement entre processus).
+    Chaque thread a sa propre connexion : les questions posées en parallèle
+    arrivent ensemble au serveur, qui les regroupe en un seul lot.
+    RERANKER_INPROCESS=1 charge le modèle dans le processus courant.
+    """
+
+    def __init__(self, socket_path=SOCKET_PATH, model_name=MODEL_NAME):
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self._conn = threading.local()  # Socket par thread
+        self.local = (BatchScheduler(LazyCrossEncoder(model_name))
+                      if os.getenv("RERANKER_INPROCESS") == "1" else None)
+        self._version = None
+        self._version_checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(REQUEST_TIMEOUT)
+        sock.connect(self.socket_path)
+        return sock
+
+    def _start_server(self):
+        ensure_socket_dir(self.socket_path)
+        with open(self.socket_path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return self._connect()  # Lancé entre-temps par un autre processus
+            except OSError:
+                pass
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--socket", self.socket_path,
+                 "--model", self.model_name],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+            )
+            deadline = time.time() + START_TIMEOUT
+            while time.time() < deadline:
+                try:
+                    return self._connect()
+                except OSError:
+                    time.sleep(0.1)
+        raise RuntimeError(f"Reranker server did not start on {self.socket_path}")
+
+    def _socket(self):
+        """Connexion du thread courant, ouverte (et le serveur lancé) au besoin."""
+        sock = getattr(self._conn, "sock", None)
+        if sock is None:
+            with self._lock:  # Seule la (re)connexion est sérialisée, pas l'aller-retour
+                try:
+                    sock = self._connect()
+                except OSError:
+                    sock = self._start_server()
+            self._conn.sock = sock
+        return sock
+
+    def _request(self, payload):
+        for attempt in range(2):
+            sock = self._socket()
+            try:
+                send_message(sock, payload)
+                response = recv_message(sock)
+                if response is not None:
+                    break
+            except OSError:
+                if attempt:
+                    raise
+            # Serveur arrêté (inactivité) : reconnexion une fois
+            self.close()
+        else:
+            raise RuntimeError("Reranker server closed the connection")
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def predict(self, pairs, tokenizer_version=None):
+        """
+        pairs : [question, passage] ou [question, passage, token_ids] ;
+        tokenizer_version : version sous laquelle les token_ids ont été calculés.
+        """
+        pairs = [[str(pair[0]), str(pair[1])] + ([pair[2]] if len(pair) > 2 and pair[2] else [])
+                 for pair in pairs]
+        if self.local is not None:
+            if not tokenizer_version or tokenizer_version != self.local.encoder.tokenizer_version():
+                pairs = [pair[:2] for pair in pairs]
+            return self.local.predict(pairs)
+        return self._request({"op": "score", "pairs": pairs, "tokenizer_version": tokenizer_version})["scores"]
+
+    def ping(self):
+        return self._request({"op": "ping"})
+
+    def tokenizer_version(self):
+        """
+        Version du tokenizer du serveur (clé des token_ids stockés), mise en
+        cache ; redemandée après TOKENIZER_RETRY secondes si indisponible.
+        """
+        if self._version is None and time.time() - self._version_checked_at >= TOKENIZER_RETRY:
+            self._version_checked_at = time.time()
+            if self.local is not None:
+                self._version = self.local.encoder.tokenizer_version()
+            else:
+                self._version = self.ping().get("tokenizer_version")
+        return self._version
+
+    def close(self):
+        """Ferme la connexion du thread courant."""
+        sock = getattr(self._conn, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._conn.sock = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur de reranking partagé")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--idle-timeout", type=int, default=IDLE_TIMEOUT)
+    opts = parser.parse_args()
+    serve(opts.socket, opts.model, opts.idle_timeout)
@@ -0,0 +1,30 @@
+# tests/test_agency_rerank.py
+import pytest
+
+for module in ("psycopg2", "dotenv", "requests"):
+    pytest.importorskip(module)
+
+from agency_expert import rerank_adaptive
+
+
+class Reranker:
+    def __init__(self, scores):
+        self.scores = scores
+        self.seen = 0
+
+    def predict(self, pairs):
+        batch = self.scores[self.seen:self.seen + len(pairs)]
+        self.seen += len(pairs)
+        return batch
+
+def test_stops_after_first_round_when_confident():
+    candidates = [(f"doc{i}", "t", "s") for i in range(20)]
+    reranker = Reranker([0.9, 0.8, 0.7] + [0.0] * 17)
+    scored = rerank_adaptive(reranker, "q", candidates, top_k=3, threshold=0.3)
+    assert reranker.seen == 8 and len(scored) == 8
+    assert [c[0] for _, c in scored[:3]] == ["doc0", "doc1", "doc2"]
+
+def test_keeps_going_when_scores_are_marginal():
+    candidates = [(f"doc{i}", "t", "s") for i in range(20)]
+    reranker = Reranker([0.35] * 20)
+    assert len(rerank_adaptive(reranker, "q", candidates)) == 20
@@ -0,0 +1,131 @@
+# tests/test_audit.py
+import sqlite3
+
+import pytest
+
+from agent.runtime import audit
+
+
+@pytest.fixture
+def audit_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(audit, "AUDIT_DB_PATH", str(tmp_path / "audit.db"))
+    audit.init_db()
+    return audit
+
+def test_truncate_keeps_head_and_tail():
+    text = "A" * 1000 + "B" * 1000
+    out = audit.truncate_output(text, max_bytes=100)
+    assert out.startswith("A" * 50)
+    assert out.endswith("B" * 50)
+    assert "1900 bytes truncated" in out
+
+def test_existing_db_migrated_to_incremental_vacuum(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(path) as conn:  # Base créée avant auto_vacuum
+        conn.execute("CREATE TABLE audit_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "timestamp TEXT, command TEXT, executed_command TEXT, "
+                     "exit_code INTEGER, stdout TEXT, stderr TEXT)")
+    monkeypatch.setattr(audit, "AUDIT_DB_PATH", path)
+    audit.init_db()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+def test_small_output_stored_as_text(audit_db):
+    audit_db.log_execution("ls", "/usr/bin/ls", 0, "hello", "")
+    log = audit_db.get_last_logs(1)[0]
+    assert log["stdout"] == "hello"
+    assert "stdout_z" not in log
+
+def test_large_output_roundtrip(audit_db, monkeypatch):
+    monkeypatch.setattr(audit_db, "AUDIT_MAX_OUTPUT_BYTES", 10 * 1024 * 1024)
+    big = "x" * (audit_db.AUDIT_COMPRESS_MIN_BYTES * 4)
+    audit_db.log_execution("psql", "psql", 0, big, "")
+    log = audit_db.get_last_logs(1)[0]
+    assert log["stdout"] == big
+    assert log["stdout_len"] == len(big)
+
+def test_prune_by_total_size(audit_db):
+    for i in range(10):
+        audit_db.log_execution("ls", "ls", 0, "y" * 100, "")
+    deleted = audit_db.prune_logs(max_age_days=0, max_total_bytes=500)
+    assert deleted > 0
+    assert len(audit_db.get_last_logs(100)) == 10 - deleted
+
+def test_query_logs_filters_and_keyset(audit_db):
+    for i in range(5):
+        audit_db.log_execution(f"/usr/bin/ls -l /tmp/{i}", "ls", 0, "out", "", plan_id="p1")
+    audit_db.log_execution("psql -c 'SELECT 1'", "psql", 2, "", "boom", plan_id="p2")
+
+    page = audit_db.query_logs(limit=2, tool="ls")
+    assert [log["tool"] for log in page["logs"]] == ["ls", "ls"]
+    assert "stdout" not in page["logs"][0]
+    assert page["next_cursor"] == page["logs"][-1]["id"]
+
+    seen = [log["id"] for log in page["logs"]]
+    while page["next_cursor"]:
+        page = audit_db.query_logs(limit=2, tool="ls", before_id=page["next_cursor"])
+        seen += [log["id"] for log in page["logs"]]
+    assert len(seen) == 5 and seen == sorted(seen, reverse=True)
+
+    failed = audit_db.query_logs(exit_code=2, include_output=True)["logs"]
+    assert len(failed) == 1
+    assert failed[0]["plan_id"] == "p2" and failed[0]["stderr"] == "boom"
+
+def test_query_logs_uses_index(audit_db):
+    import sqlite3
+    with sqlite3.connect(audit_db.AUDIT_DB_PATH) as conn:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM audit_logs WHERE tool = ? AND id < ? ORDER BY id DESC",
+            ("ls", 10)
+        ).fetchall()
+    assert any("idx_audit_tool" in row[-1] for row in plan)
+
+def test_parsed_output_roundtrip(audit_db):
+    parsed = {"parser": "parse_psql_csv", "records": [{"a": "1"}], "lossless": True}
+    audit_db.log_execution("psql --csv -c 'SELECT 1 AS a'", "psql", 0, "a\n1\n", "", parsed=parsed)
+    log = audit_db.get_last_logs(1)[0]
+    # Sans perte : stocké à la place de stdout, pas en plus
+    assert log["parsed"] == parsed and log["stdout"] is None and log["stdout_len"] == 4
+
+def test_lossy_parsed_output_keeps_stdout(audit_db):
+    parsed = {"parser": "parse_psql_aligned", "records": [{"a": "1"}], "lossless": False}
+    audit_db.log_execution("psql -c 'SELECT 1 AS a'", "psql", 0, " a\n---\n 1\n(1 row)\n", "", parsed=parsed)
+    log = audit_db.get_last_logs(1)[0]
+    assert log["parsed"] == parsed and log["stdout"].startswith(" a")
+
+def test_audit_batch_writes_during_the_batch(audit_db, monkeypatch):
+    import contextvars
+    import sqlite3
+    import threading
+
+    writes = []
+    first_started, release = threading.Event(), threading.Event()
+    real_write = audit._write_rows
+
+    def slow_write(rows):
+        # La première écriture bloque : les lignes suivantes se regroupent derrière elle
+        if not writes:
+            first_started.set()
+            release.wait(2)
+        writes.append(len(rows))
+        real_write(rows)
+
+    monkeypatch.setattr(audit, "_write_rows", slow_write)
+    with audit.audit_batch():
+        def start(i):
+            thread = threading.Thread(target=contextvars.copy_context().run,
+                                      args=(audit.log_execution, f"ls /{i}", f"ls /{i}", 0, "ok", ""))
+            thread.start()
+            return thread
+
+        first = start(0)
+        first_started.wait(2)
+        for thread in [start(1), start(2)]:
+            thread.join()
+        release.set()
+        first.join()
+        # Tout est écrit avant la fin du lot
+        assert writes == [1, 2]
+    assert writes == [1, 2]
+    with sqlite3.connect(audit.AUDIT_DB_PATH) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM audit_logs").fetchone()[0] == 3
@@ -0,0 +1,31 @@
+# tests/test_chunker.py
+from RAG.chunker import chunk_blocks, split_text
+
+def count_words(text):
+    return len(text.split())
+
+def test_small_paragraphs_of_a_section_are_merged():
+    blocks = [{"heading": "A", "text": "one two three"}, {"heading": "A", "text": "four five"},
+              {"heading": "B", "text": "six seven eight nine"}]
+    chunks = chunk_blocks(blocks, count_words, target=10, max_tokens=20, min_tokens=0)
+    assert [(c["heading"], c["tokens"]) for c in chunks] == [("A", 5), ("B", 4)]
+
+def test_long_block_split_under_max_with_overlap():
+    text = " ".join(f"Sentence {i} has five words." for i in range(20))
+    pieces = split_text(text, count_words, target=20, max_tokens=30, overlap=5)
+    assert len(pieces) > 1
+    assert all(count_words(p) <= 30 for p in pieces)
+    # Chaque morceau reprend la dernière phrase du précédent
+    for prev, nxt in zip(pieces, pieces[1:]):
+        assert nxt.startswith(prev.split(". ")[-1].rstrip("."))
+
+def test_code_split_on_lines():
+    code = "\n".join(f"SELECT {i} FROM t;" for i in range(30))
+    pieces = split_text(code, count_words, kind="code", target=12, max_tokens=16, overlap=0)
+    assert all(p.splitlines()[0].startswith("SELECT") for p in pieces)
+    assert sum(len(p.splitlines()) for p in pieces) == 30
+
+def test_tiny_remainder_attached_to_previous_chunk():
+    blocks = [{"heading": "A", "text": " ".join(["w"] * 9)}, {"heading": "A", "text": "tail"}]
+    chunks = chunk_blocks(blocks, count_words, target=9, max_tokens=12, min_tokens=3)
+    assert len(chunks) == 1 and chunks[0]["tokens"] == 10
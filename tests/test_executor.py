@@ -0,0 +1,90 @@
+# tests/test_executor.py
+import os
+import sys
+import time
+import subprocess
+import pytest
+
+# L'agent importe ses modules en absolu (runtime.*, security.*)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "agent"))
+
+import executor
+from runtime import audit
+
+
+@pytest.fixture(autouse=True)
+def no_sandbox(tmp_path, monkeypatch):
+    monkeypatch.setattr(executor, "USE_SANDBOX", False)
+    monkeypatch.setattr(audit, "AUDIT_DB_PATH", str(tmp_path / "audit.db"))
+    audit.init_db()
+
+def test_run_command_streams_chunks():
+    chunks = []
+    result = executor.run_command("ls /", on_chunk=lambda name, text: chunks.append(name))
+    assert result["exit_code"] == 0
+    assert chunks and set(chunks) <= {"stdout", "stderr"}
+
+def test_output_cap_and_spill():
+    streamed = []
+    result = executor.run_command("ls -R /usr/lib", max_bytes=200, spill=True,
+                                  on_chunk=lambda name, text: streamed.append((name, text)))
+    assert result["truncated"]
+    assert "output truncated after 200 bytes" in result["stdout"]
+    # Sortie complète relayée au flux, aucun fichier laissé sur l'hôte
+    full = "".join(text for name, text in streamed if name == "stdout")
+    assert len(full.encode()) == result["output_bytes"]["stdout"]
+    assert "stdout_file" not in result
+
+def test_spill_without_consumer_is_rejected():
+    with pytest.raises(ValueError):
+        executor.run_command("ls /", spill=True)
+
+def test_read_pipes_reports_applied_timeout():
+    process = subprocess.Popen(["sleep", "5"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        with pytest.raises(subprocess.TimeoutExpired) as exc:
+            list(executor._read_pipes(process, time.monotonic() + 0.2, 0.2))
+        assert exc.value.timeout == 0.2
+    finally:
+        process.kill()
+        process.wait()
+
+def test_abandoned_stream_is_audited_as_cancelled():
+    stream = executor.stream_command("ls -R /usr/lib")
+    assert next(stream)[0] in ("stdout", "stderr")
+    stream.close()
+    last = audit.get_last_logs(1)[0]
+    assert last["exit_code"] == executor.EXIT_CODE_CANCELLED
+    assert "disconnected" in last["stderr"]
+
+def test_rejected_command_is_not_run():
+    result = executor.run_command("rm -rf /")
+    assert result["exit_code"] == -1
+
+def test_bwrap_profile_is_precompiled(tmp_path, monkeypatch):
+    from runtime import sandbox_profiles
+    monkeypatch.setitem(sandbox_profiles.TOOL_EXTRA_BINDS, "ls", [("--ro-bind", str(tmp_path))])
+    monkeypatch.setitem(sandbox_profiles._compiled, "fingerprint", None)
+    monkeypatch.setitem(sandbox_profiles._compiled, "profiles", {})
+
+    cmd = executor.build_bwrap_command("ls -l '/a b'")
+    assert cmd[0] == "bwrap"
+    assert cmd[-3:] == [sandbox_profiles.get_profile("ls")["path"], "-l", "/a b"]
+    assert str(tmp_path) in cmd
+
+    # Même profil réutilisé tant que le registry ne change pas
+    assert executor.build_bwrap_command("ls /")[:-2] == cmd[:-3]
+
+def test_result_cache_serves_read_only_commands(monkeypatch):
+    from runtime.result_cache import ResultCache
+    monkeypatch.setattr(executor, "RESULT_CACHE", ResultCache())
+
+    first = executor.run_command("whoami")
+    second = executor.run_command("whoami")
+    assert first["exit_code"] == 0 and "cache_hit" not in first
+    assert second["cache_hit"] and second["stdout"] == first["stdout"]
+    assert audit.get_last_logs(1)[0]["cache_hit"] == 1
+
+    # 'ls' n'est pas déclaré en lecture seule : jamais mis en cache
+    executor.run_command("ls /")
+    assert "cache_hit" not in executor.run_command("ls /")
@@ -0,0 +1,37 @@
+# tests/test_fleet_manager.py
+import pytest
+
+pytest.importorskip("requests")
+
+from fleet_manager import stale_backups, summarize
+
+
+def _result(host, records, ok=True):
+    history = [{"step": {"tool": "pgbackrest"}, "result": {"parsed": {"records": records}}}]
+    return {"host": host, "ok": ok, "elapsed": 1.0, "response": {"state": {"history": history}}}
+
+def test_stale_backups_across_hosts():
+    results = [
+        _result("pg01", [{"stanza": "main", "status_code": 0, "last_backup_age_s": 3600}]),
+        _result("pg02", [{"stanza": "main", "status_code": 0, "last_backup_age_s": 90000}]),
+        _result("pg03", [{"stanza": "main", "status_code": 2, "last_backup_age_s": None}]),
+        {"host": "pg04", "ok": False, "elapsed": 5.0, "error": "timeout"},
+    ]
+    assert [s["host"] for s in stale_backups(results, max_age_hours=24)] == ["pg02", "pg03"]
+    assert summarize(results)["failed"] == ["pg04"]
+
+def test_plan_skips_agents_returning_error_plans(monkeypatch):
+    from fleet_manager import FleetManager
+
+    agents = [{"name": "pg01", "url": "http://pg01", "token": None},
+              {"name": "pg02", "url": "http://pg02", "token": None}]
+    plans = {
+        "pg01": {"goal": "Error: LLM unavailable", "steps": []},
+        "pg02": {"goal": "disk", "steps": [{"id": 1, "tool": "df", "args": ["-h"]}]},
+    }
+    fleet = FleetManager(agents)
+    monkeypatch.setattr(fleet, "_call", lambda agent, method, path, payload=None:
+                        {"ok": True, "response": {"plan": plans[agent["name"]]}})
+    assert fleet.plan("disk space")["goal"] == "disk"
+    with pytest.raises(RuntimeError, match="LLM unavailable"):
+        fleet.plan("disk space", planner=agents[0])
@@ -0,0 +1,62 @@
+# tests/test_ingest_tokens.py
+import pytest
+
+for module in ("psycopg2", "bs4", "dotenv", "requests"):
+    pytest.importorskip(module)
+
+from RAG import ingest
+
+
+class Encoding:
+    def __init__(self, text):
+        self.ids = [len(word) for word in text.split()]
+
+class Tokenizer:
+    def get_vocab(self):
+        return {"a": 0}
+
+    def encode_batch(self, texts, add_special_tokens=False):
+        return [Encoding(t) for t in texts]
+
+class Cursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.inserted = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+    def executemany(self, sql, rows):
+        self.inserted += rows
+
+class Connection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.committed = self.closed = False
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.committed = True
+
+    def close(self):
+        self.closed = True
+
+def test_tokens_only_backfills_missing_chunks(monkeypatch):
+    cur = Cursor([(1, "ab cde"), (2, "f")])
+    conn = Connection(cur)
+    monkeypatch.setattr(ingest.psycopg2, "connect", lambda **kw: conn)
+    monkeypatch.setattr(ingest, "load_tokenizer", lambda *a, **kw: Tokenizer())
+    ingest.run_tokens_only()
+    assert [(doc_id, ids) for doc_id, _, ids in cur.inserted] == [(1, [2, 3]), (2, [1])]
+    assert conn.committed and conn.closed
@@ -0,0 +1,164 @@
+# tests/test_orchestrator.py
+import os
+import sys
+import time
+import threading
+
+# L'agent importe ses modules en absolu (runtime.*, security.*)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "agent"))
+
+import orchestrator
+
+BINARIES = {"ls": "/usr/bin/ls", "psql": "/usr/bin/psql", "pgbackrest": "/usr/bin/pgbackrest"}
+
+
+def fake_runner(delay=0.2, failing=()):
+    calls = []
+    lock = threading.Lock()
+
+    def run_command(cmd, plan_id=None, **kwargs):
+        with lock:
+            calls.append(cmd)
+        time.sleep(delay)
+        code = 1 if any(f in cmd for f in failing) else 0
+        return {"stdout": cmd, "stderr": "", "exit_code": code, "command_executed": cmd}
+    return run_command, calls
+
+def test_independent_steps_run_concurrently(monkeypatch):
+    runner, calls = fake_runner()
+    monkeypatch.setattr(orchestrator, "run_command", runner)
+    plan = {"steps": [
+        {"id": "a", "tool": "ls", "args": ["/a"]},
+        {"id": "b", "tool": "ls", "args": ["/b"]},
+        {"id": "c", "tool": "ls", "args": ["/c"], "depends_on": ["a", "b"]},
+    ]}
+    start = time.time()
+    state = orchestrator.run_plan(plan, BINARIES)
+    assert time.time() - start < 0.55
+    assert [h["step"]["id"] for h in state["history"]] == ["a", "b", "c"]
+    assert calls[-1].endswith("/c")
+
+def test_without_depends_on_stays_sequential(monkeypatch):
+    runner, calls = fake_runner(delay=0, failing=("/b",))
+    monkeypatch.setattr(orchestrator, "run_command", runner)
+    plan = {"steps": [
+        {"tool": "ls", "args": ["/a"]},
+        {"tool": "ls", "args": ["/b"], "on_error": "abort"},
+        {"tool": "ls", "args": ["/c"]},
+    ]}
+    state = orchestrator.run_plan(plan, BINARIES)
+    assert calls == ["/usr/bin/ls /a", "/usr/bin/ls /b"]
+    assert state["errors"] == ["Step 1 failed, aborting plan."]
+
+def test_dependency_cycle_is_reported(monkeypatch):
+    runner, calls = fake_runner(delay=0)
+    monkeypatch.setattr(orchestrator, "run_command", runner)
+    plan = {"steps": [
+        {"id": "a", "tool": "ls", "args": [], "depends_on": ["b"]},
+        {"id": "b", "tool": "ls", "args": [], "depends_on": ["a"]},
+    ]}
+    state = orchestrator.run_plan(plan, BINARIES)
+    assert calls == []
+    assert "unresolvable" in state["errors"][0]
+
+def test_cancel_plan_kills_running_step(tmp_path, monkeypatch):
+    import executor
+    from runtime import audit
+    monkeypatch.setattr(executor, "USE_SANDBOX", False)
+    monkeypatch.setattr(executor, "_check_policy", lambda command, plan_id=None: None)
+    monkeypatch.setattr(audit, "AUDIT_DB_PATH", str(tmp_path / "audit.db"))
+    audit.init_db()
+
+    plan = {"steps": [{"id": "slow", "tool": "sleep", "args": ["30"]}]}
+    monkeypatch.setattr(orchestrator, "is_tool_allowed", lambda tool: True)
+    threading.Timer(0.3, orchestrator.cancel_plan, args=("p-cancel",)).start()
+
+    start = time.time()
+    state = orchestrator.run_plan(plan, {"sleep": "sleep"}, plan_id="p-cancel")
+    assert time.time() - start < 5
+    assert state["errors"] == ["Plan cancelled"]
+    assert state["history"][0]["result"]["exit_code"] == executor.EXIT_CODE_CANCELLED
+    assert "p-cancel" not in orchestrator.ACTIVE_PLANS
+
+def test_step_timeout_is_bounded_by_plan_budget():
+    assert orchestrator.step_timeout({"timeout": 10}, remaining=3) == 3
+    assert orchestrator.step_timeout({}, remaining=100) == orchestrator.COMMAND_TIMEOUT
+
+def test_streamed_read_only_steps_start_during_generation(monkeypatch):
+    runner, calls = fake_runner(delay=0)
+    monkeypatch.setattr(orchestrator, "run_command", runner)
+    seen_during_generation = []
+
+    def stream():
+        yield {"id": "a", "tool": "pgbackrest", "args": ["info"]}
+        yield {"id": "b", "tool": "ls", "args": ["/b"]}
+        time.sleep(0.3)  # Le LLM génère encore
+        seen_during_generation.extend(calls)
+        yield {"id": "c", "tool": "ls", "args": ["/c"], "depends_on": ["b"]}
+
+    state = orchestrator.run_plan({}, BINARIES, step_stream=stream())
+    # Seule l'étape en lecture seule part avant la fin de la génération
+    assert seen_during_generation == ["/usr/bin/pgbackrest info"]
+    assert [h["step"]["id"] for h in state["history"]] == ["a", "b", "c"]
+    assert state["errors"] == []
+
+def test_history_drops_raw_output_when_parsed():
+    from orchestrator import compact_result
+    result = {"stdout": "a|b\n1|2\n(1 row)\n", "columns": ["a", "b"], "rows": [[1, 2]],
+              "parsed": {"parser": "sql_pool", "records": [{"a": 1, "b": 2}], "lossless": True},
+              "exit_code": 0}
+    compact = compact_result(result)
+    assert "stdout" not in compact and "rows" not in compact
+    assert compact["parsed"] == result["parsed"] and compact["stdout_bytes"] == len(result["stdout"])
+    assert compact_result({"stdout": "x", "exit_code": 0})["stdout"] == "x"
+    # Tableau aligné reparsé : le stdout reste la référence
+    aligned = {"stdout": " a\n---\n 1\n(1 row)\n", "exit_code": 0,
+               "parsed": {"parser": "parse_psql_aligned", "records": [{"a": "1"}], "lossless": False}}
+    assert compact_result(aligned) == aligned
+
+def test_streamed_plan_without_dependencies_stays_sequential(monkeypatch):
+    spans = []
+
+    def runner(cmd, plan_id=None, **kwargs):
+        start = time.time()
+        time.sleep(0.15)
+        spans.append((start, time.time()))
+        return {"stdout": cmd, "stderr": "", "exit_code": 0, "command_executed": cmd}
+
+    monkeypatch.setattr(orchestrator, "run_command", runner)
+
+    def stream():
+        yield {"id": "a", "tool": "pgbackrest", "args": ["info"]}
+        yield {"id": "b", "tool": "pgbackrest", "args": ["info", "--stanza=main"]}
+        time.sleep(0.5)
+
+    orchestrator.run_plan({}, BINARIES, step_stream=stream())
+    assert len(spans) == 2 and spans[1][0] >= spans[0][1]
+
+def test_early_steps_count_against_plan_budget(monkeypatch):
+    runner, calls = fake_runner(delay=0)
+    monkeypatch.setattr(orchestrator, "run_command", runner)
+    monkeypatch.setattr(orchestrator, "MAX_PLAN_DURATION", 0.3)
+
+    def stream():
+        yield {"id": "a", "tool": "pgbackrest", "args": ["info"]}
+        time.sleep(2)  # Génération encore en cours au-delà du budget du plan
+        yield {"id": "b", "tool": "ls", "args": ["/"]}
+
+    start = time.time()
+    state = orchestrator.run_plan({}, BINARIES, step_stream=stream())
+    assert time.time() - start < 1
+    assert calls == ["/usr/bin/pgbackrest info"]
+    assert state["errors"] == ["Plan aborted: timeout"]
+
+def test_generation_deadline(monkeypatch):
+    monkeypatch.setattr(orchestrator, "MAX_GENERATION_DURATION", 0.2)
+
+    def stream():
+        time.sleep(2)
+        yield {"id": "a", "tool": "ls", "args": ["/"]}
+
+    start = time.time()
+    state = orchestrator.run_plan({}, BINARIES, step_stream=stream())
+    assert time.time() - start < 1
+    assert state["errors"] == ["Plan aborted: generation timeout"]
@@ -0,0 +1,77 @@
+# tests/test_parsers.py
+import json
+import time
+
+from agent.runtime.parsers import parse_output
+
+PGBACKREST_INFO = json.dumps([{
+    "name": "main",
+    "status": {"code": 0, "message": "ok"},
+    "backup": [
+        {"label": "20260101-010000F", "type": "full",
+         "timestamp": {"start": 1767229200, "stop": 1767229260},
+         "info": {"size": 1000, "repository": {"size": 200}}},
+    ],
+}])
+
+PATRONI_LIST = json.dumps([
+    {"Cluster": "pg", "Member": "pg1", "Host": "10.0.0.1", "Role": "Leader", "State": "running", "TL": 3},
+    {"Cluster": "pg", "Member": "pg2", "Host": "10.0.0.2", "Role": "Replica", "State": "streaming", "TL": 3,
+     "Lag in MB": 0},
+])
+
+PSQL_ALIGNED = """ datname  | numbackends
+----------+-------------
+ postgres |           3
+ app      |          12
+(2 rows)
+
+"""
+
+def test_pgbackrest_info_json():
+    parsed = parse_output("/usr/bin/pgbackrest info --output=json", PGBACKREST_INFO)
+    record = parsed["records"][0]
+    assert parsed["parser"] == "parse_pgbackrest_info"
+    assert record["stanza"] == "main" and record["status_code"] == 0
+    assert record["last_backup_type"] == "full"
+    assert record["last_backup_age_s"] >= int(time.time()) - 1767229260 - 1
+
+def test_patronictl_list_json():
+    parsed = parse_output("patronictl -c /etc/patroni.yml list -f json", PATRONI_LIST)
+    assert [m["role"] for m in parsed["records"]] == ["Leader", "Replica"]
+    assert parsed["records"][1]["lag_in_mb"] == 0
+
+def test_psql_aligned_and_unaligned():
+    parsed = parse_output("psql -c 'SELECT datname, numbackends FROM pg_stat_database'", PSQL_ALIGNED)
+    assert parsed["records"] == [
+        {"datname": "postgres", "numbackends": "3"},
+        {"datname": "app", "numbackends": "12"},
+    ]
+    parsed = parse_output("psql -A -c 'SELECT 1 AS one'", "one\n1\n(1 row)\n")
+    assert parsed["records"] == [{"one": "1"}]
+
+def test_psql_ambiguous_rows_are_not_parsed():
+    # '|' dans une valeur ou cellule sur plusieurs lignes : pas d'enregistrements faux
+    assert parse_output("psql -A -c 'SELECT note FROM t'", "note\na|b\n(1 row)\n") is None
+    wrapped = " note\n------\n line1+\n line2\n(1 row)\n"
+    assert parse_output("psql -c 'SELECT note FROM t'", wrapped) is None
+    assert parse_output("psql -c 'SELECT a FROM t'", " a\n---\n x | y\n(1 row)\n") is None
+
+def test_only_lossless_formats_are_flagged():
+    assert parse_output("psql --csv -c 'x'", "a\n1\n")["lossless"] is True
+    assert parse_output("psql -A -c 'x'", "a\n1\n(1 row)\n")["lossless"] is True
+    assert parse_output("psql -c 'x'", PSQL_ALIGNED)["lossless"] is False
+
+def test_psql_csv():
+    parsed = parse_output("psql --csv -c 'SELECT 1 AS a, 2 AS b'", "a,b\n1,2\n")
+    assert parsed["records"] == [{"a": "1", "b": "2"}]
+
+def test_unknown_or_invalid_output_is_ignored():
+    assert parse_output("ls -l /", "total 0\n") is None
+    assert parse_output("pgbackrest info --output=json", "not json") is None
+
+def test_psql_footer_only_exact_row_count():
+    parsed = parse_output("psql -A -c 'SELECT note FROM t'", "note\n(draft)\n(1 row)\n")
+    assert parsed["records"] == [{"note": "(draft)"}]
+    parsed = parse_output("psql -A -c 'x'", "n\n(a)\n")
+    assert parsed["records"] == [{"n": "(a)"}]
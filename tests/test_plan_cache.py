@@ -0,0 +1,21 @@
+# tests/test_plan_cache.py
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "agent"))
+
+from runtime.plan_cache import normalize_question, plan_cache_key
+
+
+def test_normalized_questions_share_a_key():
+    assert normalize_question("  Is the   backup OK ? ") == "is the backup ok"
+    k1 = plan_cache_key("Is the backup OK?", "readonly", "ctx", "abc")
+    k2 = plan_cache_key("is the backup ok", "readonly", "ctx", "abc")
+    assert k1 == k2
+
+def test_key_changes_with_registry_mode_and_context():
+    base = plan_cache_key("q", "readonly", "ctx", "abc")
+    assert plan_cache_key("q", "readonly", "ctx", "def") != base
+    assert plan_cache_key("q", "admin", "ctx", "abc") != base
+    assert plan_cache_key("q", "readonly", "other", "abc") != base
+    assert plan_cache_key("q", "readonly", [{"text": "ctx"}], "abc") != base
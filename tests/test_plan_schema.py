@@ -0,0 +1,23 @@
+# tests/test_plan_schema.py
+from agent.runtime.plan_schema import plan_schema, repair_plan, step_schema, validate
+
+
+def test_valid_plan_has_no_errors():
+    plan = {"goal": "disk", "steps": [{"id": 1, "tool": "df", "args": ["-h"], "on_error": "abort"}]}
+    assert validate(plan, plan_schema({"df": "/bin/df"})) == []
+
+def test_errors_point_to_failing_fields():
+    plan = {"goal": "x", "steps": [{"id": "a", "tool": "rm", "args": ["-h"], "on_error": "retry"}]}
+    paths = {path for path, _ in validate(plan, plan_schema({"df": "/bin/df"}))}
+    assert paths == {("steps", 0, "tool"), ("steps", 0, "on_error")}
+
+def test_local_repair_fixes_common_mistakes():
+    plan = repair_plan({"steps": [{"tool": "/usr/bin/df", "args": "-h /var", "on_error": "stop"},
+                                  {"tool": "psql", "args": ["-p", 5432], "depends_on": 0}]})
+    assert plan["goal"] == ""
+    assert plan["steps"][0] == {"id": "step_0", "tool": "df", "args": ["-h", "/var"], "on_error": "abort"}
+    assert plan["steps"][1]["args"] == ["-p", "5432"] and plan["steps"][1]["depends_on"] == [0]
+    assert validate(plan, plan_schema()) == []
+
+def test_booleans_are_not_integers():
+    assert validate({"id": True, "tool": "df", "args": []}, step_schema()) != []
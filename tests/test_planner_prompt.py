@@ -0,0 +1,60 @@
+# tests/test_planner_prompt.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "agent"))
+
+pytest.importorskip("requests")  # planner -> runtime.llm_client
+
+import planner
+from planner import build_planner_prompt, build_system_prefix, fix_invalid_steps
+
+
+def test_system_prefix_is_stable_and_question_free():
+    binaries = {"psql": "/usr/bin/psql", "df": "/bin/df"}
+    first = build_system_prefix(binaries, "fp1")
+    assert build_system_prefix({"other": "/x"}, "fp1") is first
+    assert "df, psql" in first
+    variable = build_planner_prompt("Check disk", {"df": "help"}, "doc", "16", "readonly")
+    assert "Check disk" in variable and "Check disk" not in first
+    assert variable.rstrip().endswith('"Check disk"')
+
+def test_only_invalid_steps_are_retried(monkeypatch):
+    prompts = []
+    def fake_llm(prompt, system=None, format=None):
+        prompts.append(prompt)
+        return '{"id": "b", "tool": "df", "args": ["-h"]}'
+    monkeypatch.setattr(planner, "call_llm", fake_llm)
+    plan = {"goal": "g", "steps": [{"id": "a", "tool": "df", "args": []},
+                                   {"id": "b", "tool": "dff", "args": ["-h"]}]}
+    fixed = fix_invalid_steps(plan, {"df": "/bin/df"})
+    assert len(prompts) == 1 and '"dff"' in prompts[0]
+    assert [s["tool"] for s in fixed["steps"]] == ["df", "df"]
+
+def test_plan_stream_keeps_plan_order_around_repaired_steps(monkeypatch):
+    raw = ('{"goal": "g", "steps": [{"id": "a", "tool": "df", "args": []}, '
+           '{"id": "b", "tool": "dff", "args": []}, {"id": "c", "tool": "ls", "args": []}]}')
+    monkeypatch.setattr(planner, "prepare_planning", lambda *args: {
+        "cached": None, "binaries": {"df": "/bin/df", "ls": "/bin/ls"},
+        "prompt": "p", "system": "s", "prompt_stats": {}})
+    monkeypatch.setattr(planner, "stream_llm", lambda *args, **kwargs: iter([raw]))
+    monkeypatch.setattr(planner, "call_llm", lambda *args, **kwargs: '{"id": "b", "tool": "df", "args": ["-h"]}')
+    monkeypatch.setattr(planner, "is_step_allowed", lambda step, binaries: True)
+    monkeypatch.setattr(planner, "remember_plan", lambda ctx, plan: None)
+    stream = planner.PlanStream("q")
+    # 'c' attend la reprise de 'b' : même ordre qu'un plan complet
+    assert [s["id"] for s in stream] == ["a", "b", "c"]
+    assert [s["id"] for s in stream.plan["steps"]] == ["a", "b", "c"]
+
+def test_stream_parser_emits_steps_as_they_close():
+    from planner import StepStreamParser
+    parser = StepStreamParser()
+    raw = '{"goal": "x {", "steps": [{"id": "a", "tool": "df", "args": ["}"]}, {"id": "b", "tool": "ls", "args": []}]}'
+    emitted = []
+    for i in range(0, len(raw), 7):
+        emitted.append([s["id"] for s in parser.feed(raw[i:i + 7])])
+    flat = [sid for chunk in emitted for sid in chunk]
+    assert flat == ["a", "b"]
+    assert emitted[-1] == []  # 'b' est émis avant la fin du JSON
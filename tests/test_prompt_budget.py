@@ -0,0 +1,55 @@
+# tests/test_prompt_budget.py
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "agent"))
+
+from runtime import prompt_budget
+from runtime.prompt_budget import budget_prompt_parts, rank_tools, trim_rag_context
+
+
+def _no_tokenizer(monkeypatch):
+    monkeypatch.setitem(prompt_budget._tokenizer, "loaded", True)
+    monkeypatch.setitem(prompt_budget._tokenizer, "instance", None)
+
+def test_rank_tools_prefers_named_and_relevant_tools():
+    tools = {
+        "pgbackrest": "backup restore stanza archive",
+        "df": "report file system disk space usage",
+        "whoami": "print effective user name",
+    }
+    assert rank_tools("Check available disk space", tools) == ["df"]
+    assert rank_tools("pgbackrest disk usage", tools)[0] == "pgbackrest"
+
+def test_rag_trimmed_by_score(monkeypatch):
+    _no_tokenizer(monkeypatch)
+    chunks = [{"text": "low " * 50, "score": 0.1}, {"text": "high", "score": 0.9}]
+    assert trim_rag_context(chunks, max_tokens=5).startswith("high")
+    assert trim_rag_context("a" * 400, max_tokens=10) == "a" * 40
+
+def test_budget_reports_token_counts(monkeypatch):
+    _no_tokenizer(monkeypatch)
+    settings = {"max_prompt_tokens": 60, "max_tools": 1, "tool_help_tokens": 10, "rag_tokens": 1000}
+    tools = {"df": "disk space " * 40, "whoami": "user name"}
+    selected, rag, stats = budget_prompt_parts("disk space", tools, "doc " * 500, settings)
+    assert list(selected) == ["df"] and len(selected["df"]) == 40
+    assert stats["tool_help_tokens"] == 10 and stats["rag_tokens"] <= 50
+    assert stats["tokenizer"] == "chars/4"
+
+def test_static_prefix_reduces_rag_budget(monkeypatch):
+    _no_tokenizer(monkeypatch)
+    settings = {"max_prompt_tokens": 60, "max_tools": 0, "tool_help_tokens": 10, "rag_tokens": 1000}
+    _, rag, stats = budget_prompt_parts("q", {}, "doc " * 500, settings, reserved_tokens=50)
+    assert stats["rag_tokens"] == 10
+
+def test_tokenizer_never_downloaded(monkeypatch):
+    class Forbidden:
+        @staticmethod
+        def from_pretrained(name):
+            raise AssertionError("network access")
+
+    monkeypatch.setattr(prompt_budget, "Tokenizer", Forbidden)
+    monkeypatch.setattr(prompt_budget, "get_settings", lambda: {"tokenizer": "Qwen/Qwen2.5-7B-Instruct"})
+    monkeypatch.setitem(prompt_budget._tokenizer, "loaded", False)
+    monkeypatch.setitem(prompt_budget._tokenizer, "instance", None)
+    assert prompt_budget.get_tokenizer() is None
@@ -0,0 +1,187 @@
+# tests/test_reranker_server.py
+import os
+import stat
+import threading
+
+import pytest
+
+import reranker_server
+from reranker_server import BatchScheduler, RerankerClient, RerankerServer
+
+
+class FakeEncoder:
+    model_name = "fake"
+    model = object()
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, pairs, batch_size=16):
+        self.calls.append(list(pairs))
+        return [float(len(p)) for _, p in pairs]
+
+@pytest.fixture
+def server(tmp_path):
+    path = str(tmp_path / "rr.sock")
+    srv = RerankerServer(path, FakeEncoder())
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield path
+    srv.shutdown()
+    srv.server_close()
+
+def test_client_scores_through_shared_server(server):
+    client = RerankerClient(socket_path=server)
+    assert client.ping()["loaded"] is True
+    assert client.predict([["q", "ab"], ["q", "abcd"]]) == [2.0, 4.0]
+    client.close()
+
+def test_serve_keeps_socket_of_live_server(server):
+    with pytest.raises(RuntimeError, match="already running"):
+        reranker_server.serve(server, idle_timeout=0)
+    assert RerankerClient(socket_path=server).ping()["loaded"] is True
+
+def test_default_socket_dir_is_private(tmp_path, monkeypatch):
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(reranker_server.tempfile, "gettempdir", lambda: str(tmp_path))
+    directory = reranker_server.default_socket_dir()
+    reranker_server.ensure_socket_dir(os.path.join(directory, "rr.sock"))
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+    os.chmod(directory, 0o777)  # Dossier ouvert à tous : refusé
+    with pytest.raises(RuntimeError, match="Unsafe"):
+        reranker_server.ensure_socket_dir(os.path.join(directory, "rr.sock"))
+
+def test_server_errors_are_raised(server, monkeypatch):
+    monkeypatch.setattr(FakeEncoder, "predict", lambda self, pairs, batch_size=16: 1 / 0)
+    with pytest.raises(RuntimeError):
+        RerankerClient(socket_path=server).predict([["q", "p"]])
+
+def test_concurrent_requests_share_one_sorted_batch():
+    encoder = FakeEncoder()
+    scheduler = BatchScheduler(encoder, wait_ms=50)
+    futures = [scheduler.submit([["q", "x" * n] for n in lengths]) for lengths in ([5, 1], [3], [2, 4])]
+    assert [f.result(timeout=2) for f in futures] == [[5.0, 1.0], [3.0], [2.0, 4.0]]
+    assert len(encoder.calls) == 1
+    assert [len(p) for _, p in encoder.calls[0]] == [1, 2, 3, 4, 5]
+
+def test_parallel_client_questions_share_one_batch(tmp_path):
+    encoder = FakeEncoder()
+    path = str(tmp_path / "rr.sock")
+    srv = RerankerServer(path, encoder)
+    srv.scheduler = BatchScheduler(encoder, wait_ms=300)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    client = RerankerClient(socket_path=path)  # Partagé entre threads, comme DBAgencyExpert
+    results = {}
+    barrier = threading.Barrier(2)
+
+    def ask(name, pairs):
+        barrier.wait()
+        results[name] = client.predict(pairs)
+
+    threads = [threading.Thread(target=ask, args=("a", [["q1", "xx"], ["q1", "x"]])),
+               threading.Thread(target=ask, args=("b", [["q2", "xxx"]]))]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=5)
+        assert results == {"a": [2.0, 1.0], "b": [3.0]}
+        assert len(encoder.calls) == 1 and len(encoder.calls[0]) == 3
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+def test_passages_truncated_to_model_length():
+    from reranker_server import LazyCrossEncoder
+
+    class Model:
+        max_length = 4
+        def predict(self, pairs, batch_size=16):
+            return [len(p) for _, p in pairs]
+
+    encoder = LazyCrossEncoder()
+    encoder.model = Model()
+    assert encoder.predict([["q", "x" * 100]]) == [16.0]
+
+def test_token_ids_dropped_on_tokenizer_version_mismatch(tmp_path):
+    class VersionedEncoder(FakeEncoder):
+        def tokenizer_version(self):
+            return "v1"
+
+        def predict(self, pairs, batch_size=16):
+            self.calls.append(list(pairs))
+            return [float(len(pair)) for pair in pairs]
+
+    encoder = VersionedEncoder()
+    srv = RerankerServer(str(tmp_path / "rr.sock"), encoder)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        client = RerankerClient(socket_path=str(tmp_path / "rr.sock"))
+        assert client.tokenizer_version() == "v1"
+        assert client.predict([["q", "p", [1, 2]]], tokenizer_version="v1") == [3.0]
+        assert client.predict([["q", "p", [1, 2]]], tokenizer_version="v0") == [2.0]
+        assert client.predict([["q", "p", [1, 2]]]) == [2.0]
+        client.close()
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+def test_tokenizer_failure_not_retried_on_every_request(monkeypatch):
+    import reranker_server
+
+    calls = []
+    monkeypatch.setattr(reranker_server, "load_tokenizer", lambda name: calls.append(name))
+    encoder = reranker_server.LazyCrossEncoder()
+    assert encoder.tokenizer_version() is None
+    assert encoder.tokenizer_version() is None
+    assert len(calls) == 1
+
+def test_ids_scores_match_text_scores():
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    tokenizers = pytest.importorskip("tokenizers")
+    from reranker_server import LazyCrossEncoder, encode_passages
+
+    # Mini BERT aléatoire (aucun téléchargement) : seule l'égalité des deux chemins compte
+
+    words = ["backup", "restore", "wal", "archive", "disk", "space", "check", "the", "how", "to"]
+    vocab = {token: i for i, token in enumerate(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words)}
+    backend = tokenizers.Tokenizer(tokenizers.models.WordPiece(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    backend.post_processor = tokenizers.processors.TemplateProcessing(
+        single="[CLS] $A [SEP]", pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+        special_tokens=[("[CLS]", vocab["[CLS]"]), ("[SEP]", vocab["[SEP]"])])
+    hf_tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="[PAD]",
+                                                        model_input_names=["input_ids", "token_type_ids",
+                                                                           "attention_mask"])
+    torch.manual_seed(0)
+    config = transformers.BertConfig(vocab_size=len(vocab), hidden_size=16, num_hidden_layers=1,
+                                     num_attention_heads=2, intermediate_size=32, num_labels=1,
+                                     max_position_embeddings=64, initializer_range=1.0)
+    bert = transformers.BertForSequenceClassification(config).eval()
+
+    class TinyCrossEncoder:
+        # Même chemin texte que CrossEncoder.predict : tokenisation de la paire, sigmoïde
+        tokenizer = hf_tokenizer
+        model = bert
+        max_length = 32
+        activation_fn = staticmethod(torch.sigmoid)
+
+        def predict(self, pairs, batch_size=16):
+            features = hf_tokenizer([q for q, _ in pairs], [p for _, p in pairs], padding=True,
+                                    truncation=True, max_length=self.max_length, return_tensors="pt")
+            with torch.inference_mode():
+                return torch.sigmoid(bert(**features).logits).squeeze(-1).tolist()
+
+    encoder = LazyCrossEncoder()
+    encoder.model = TinyCrossEncoder()
+    encoder.tokenizer = backend
+    encoder.version = "tiny"
+
+    query = "how to check disk space"
+    passages = ["the wal archive", "backup and restore the disk", "space"]
+    ids = encode_passages(encoder.tokenizer, passages)
+    by_text = encoder.predict([[query, p] for p in passages])
+    by_ids = encoder.predict([[query, p, i] for p, i in zip(passages, ids)])
+    assert len(set(round(s, 4) for s in by_text)) == 3
+    assert by_ids == pytest.approx(by_text, abs=1e-5)
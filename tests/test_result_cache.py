@@ -0,0 +1,38 @@
+# tests/test_result_cache.py
+import time
+
+from agent.runtime.result_cache import ResultCache
+from agent.security.allowlist import is_read_only_invocation
+
+
+def test_ttl_expiry():
+    cache = ResultCache()
+    cache.put(("a",), {"stdout": "x"}, ttl=0.05)
+    assert cache.get(("a",)) == {"stdout": "x"}
+    time.sleep(0.06)
+    assert cache.get(("a",)) is None
+
+def test_entry_and_byte_budgets():
+    cache = ResultCache(max_entries=2, max_bytes=10_000)
+    for key in ("a", "b", "c"):
+        cache.put((key,), {"stdout": key})
+    assert cache.get(("a",)) is None and cache.get(("c",)) is not None
+
+    cache = ResultCache(max_entries=10, max_bytes=100)
+    cache.put(("big",), {"stdout": "x" * 200})
+    assert cache.stats()["entries"] == 0
+
+def test_returned_results_are_copies():
+    cache = ResultCache()
+    cache.put(("a",), {"stdout": "x"})
+    cache.get(("a",))["stdout"] = "mutated"
+    assert cache.get(("a",))["stdout"] == "x"
+
+def test_read_only_invocations_from_allowlist():
+    assert is_read_only_invocation("patronictl", ["-c", "/etc/patroni.yml", "list"])
+    assert not is_read_only_invocation("patronictl", ["-c", "/etc/patroni.yml", "restart", "pg"])
+    assert is_read_only_invocation("pgbackrest", ["--stanza=main", "info", "--output=json"])
+    assert not is_read_only_invocation("pgbackrest", ["--stanza=main", "backup"])
+    assert is_read_only_invocation("repmgr", ["-f", "/etc/repmgr.conf", "cluster", "show"])
+    assert not is_read_only_invocation("repmgr", ["node", "rejoin"])
+    assert not is_read_only_invocation("ls", ["/"])
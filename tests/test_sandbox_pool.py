@@ -0,0 +1,69 @@
+# tests/test_sandbox_pool.py
+import os
+import sys
+import threading
+
+# L'agent importe ses modules en absolu (runtime.*, security.*)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "agent"))
+
+import pytest
+
+from runtime.sandbox_pool import SandboxPool, SANDBOX_PYTHON
+
+pytestmark = pytest.mark.skipif(not os.path.exists(SANDBOX_PYTHON), reason="system python3 required")
+
+
+@pytest.fixture
+def pool():
+    # Préfixe vide : on teste le protocole et le recyclage, pas bwrap
+    pool = SandboxPool([], size=1, max_uses=2)
+    yield pool
+    pool.close()
+
+def test_pool_runs_and_caps_output(pool):
+    reply = pool.run(["ls", "/"], timeout=5, max_bytes=10)
+    assert reply["exit_code"] == 0
+    assert reply["truncated"]
+    assert "output truncated after 10 bytes" in reply["stdout"]
+
+def test_helper_recycled_after_max_uses(pool):
+    first = pool._acquire()
+    pool._release(first)
+    pids = set()
+    for _ in range(3):
+        helper = pool._acquire()
+        pids.add(helper.process.pid)
+        helper.uses += 1
+        pool._release(helper)
+    assert len(pids) >= 2
+
+def test_cancel_kills_helper(pool):
+    event = threading.Event()
+    threading.Timer(0.2, event.set).start()
+    assert pool.run(["sleep", "5"], timeout=10, max_bytes=100, cancel_event=event) is None
+
+def test_helper_output_read_with_cap():
+    from runtime.sandbox_helper import execute
+    reply = execute({"argv": ["head", "-c", "5000000", "/dev/zero"], "timeout": 5, "max_bytes": 100})
+    assert reply["exit_code"] == 0 and reply["truncated"]
+    assert len(reply["stdout"]) < 200
+
+    # TMPDIR propre à la commande, supprimé après exécution
+    tmpdir = execute({"argv": ["sh", "-c", "echo $TMPDIR"], "timeout": 5})["stdout"].strip()
+    assert tmpdir and not os.path.exists(tmpdir)
+
+def test_unavailable_pool_falls_back_to_bwrap(tmp_path, monkeypatch):
+    import executor
+    from runtime import audit
+    from runtime.sandbox_pool import SandboxUnavailable
+
+    class DeadPool:
+        bind_dirs = {os.path.dirname(executor.resolve_argv("ls")[0])}
+
+        def run(self, *args):
+            raise SandboxUnavailable("bwrap missing")
+
+    monkeypatch.setattr(audit, "AUDIT_DB_PATH", str(tmp_path / "audit.db"))
+    audit.init_db()
+    monkeypatch.setattr(executor, "get_sandbox_pool", lambda tool: DeadPool())
+    assert executor._run_pooled("ls /") is None
@@ -0,0 +1,45 @@
+# tests/test_sql_pool.py
+import os
+import sys
+
+# L'agent importe ses modules en absolu (runtime.*, security.*)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "agent"))
+
+from runtime.sql_pool import parse_psql_args, render_unaligned
+
+
+def test_parse_simple_command():
+    parsed = parse_psql_args(["-X", "-d", "postgres", "--username=app", "-c", "SELECT 1"])
+    assert parsed == {"sql": "SELECT 1", "conn": {"dbname": "postgres", "user": "app"}, "tuples_only": False}
+
+def test_parse_rejects_unsupported_options():
+    assert parse_psql_args(["-f", "/tmp/x.sql"]) is None
+    assert parse_psql_args(["-c", "SELECT 1", "-c", "SELECT 2"]) is None
+    assert parse_psql_args(["-c", "\\dt"]) is None
+    assert parse_psql_args(["--version"]) is None
+
+def test_render_unaligned_like_psql():
+    out = render_unaligned(["a", "b"], [[1, None], [2, "x"]])
+    assert out == "a|b\n1|\n2|x\n(2 rows)\n"
+    assert render_unaligned(["a"], [[1]], tuples_only=True) == "1\n"
+
+def test_multi_statement_sql_goes_back_to_psql():
+    assert parse_psql_args(["-c", "COMMIT; SET default_transaction_read_only=off; DROP TABLE t"]) is None
+    assert parse_psql_args(["-c", "SELECT 1; -- fin"]) is None
+    assert parse_psql_args(["-c", "SELECT 1;"])["sql"] == "SELECT 1;"
+    assert parse_psql_args(["-c", "SELECT ';' AS a, $$x;y$$ /* ; */"]) is not None
+
+def test_pool_count_is_bounded(monkeypatch):
+    import types
+    import pytest
+    from runtime import sql_pool
+
+    fake = types.SimpleNamespace(pool=types.SimpleNamespace(ThreadedConnectionPool=lambda *a, **kw: object()))
+    monkeypatch.setattr(sql_pool, "psycopg2", fake)
+    monkeypatch.setattr(sql_pool, "_pools", {})
+    settings = {"size": 2, "max_pools": 2, "statement_timeout_ms": 1000}
+    first = sql_pool._get_pool({"host": "a"}, settings)
+    sql_pool._get_pool({"host": "b"}, settings)
+    assert sql_pool._get_pool({"host": "a"}, settings) is first
+    with pytest.raises(RuntimeError):
+        sql_pool._get_pool({"host": "c"}, settings)